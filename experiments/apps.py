@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.utils.translation import gettext_lazy as _
+
+
+class ExperimentsAppConfig(AppConfig):
+    name = 'experiments'
+    label = 'experiments'
+    verbose_name = _("Experiments")
+
+    def ready(self):
+        from experiments import checks  # noqa: F401
+        from experiments.signal_handlers import register_signal_handlers
+
+        register_signal_handlers()
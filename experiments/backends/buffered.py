@@ -0,0 +1,253 @@
+'''
+    A backend that collects participant and completion counts in memory and writes
+    them to ExperimentHistory in batches, rather than on every request.
+
+    To use it, set:
+
+        WAGTAIL_EXPERIMENTS_BACKEND = 'experiments.backends.buffered'
+
+    Pending counts are written when WAGTAIL_EXPERIMENTS_BUFFER_MAX_EVENTS events
+    (default 1000) have accumulated, every WAGTAIL_EXPERIMENTS_BUFFER_FLUSH_INTERVAL
+    seconds (default 10; None disables the background flush), and when the process exits.
+    Counts that have not been written yet are lost if the process is killed.
+'''
+
+import atexit
+import datetime
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from experiments.backends import db
+from experiments.counters import exclude_deleted, increment_history_counts
+from experiments.models import get_variation_ids_for_experiments
+from experiments.utils import complete_participation, start_participation
+
+
+logger = logging.getLogger(__name__)
+
+
+class CounterBuffer(object):
+    '''
+        Thread-safe accumulator of (experiment, variation, date) count increments.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counts = {}
+        self._event_count = 0
+        self._last_flush = time.monotonic()
+        self._flusher = None
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'WAGTAIL_EXPERIMENTS_BUFFER_FLUSH_INTERVAL', 10)
+
+    @property
+    def max_events(self):
+        return getattr(settings, 'WAGTAIL_EXPERIMENTS_BUFFER_MAX_EVENTS', 1000)
+
+    def add(self, experiment_id, variation_id, date, participant_count, completion_count):
+        '''
+            Add to the pending counts, writing them out if the buffer is due to be flushed.
+
+            Return:
+                Nothing
+        '''
+
+        flush_interval = self.flush_interval
+
+        with self._lock:
+            counts = self._counts.setdefault((experiment_id, variation_id, date), [0, 0])
+            counts[0] += participant_count
+            counts[1] += completion_count
+            self._event_count += 1
+            flush_due = self._event_count >= self.max_events or (
+                flush_interval is not None and time.monotonic() - self._last_flush >= flush_interval
+            )
+
+        if flush_interval is not None:
+            self._start_flusher()
+
+        if flush_due:
+            try:
+                self.flush()
+            except Exception:
+                # the counts are kept for the next flush; don't fail the request over them
+                logger.exception("Failed to write buffered experiment counts")
+
+    def pending(self):
+        '''
+            Get the counts that have not been written to the database yet.
+
+            Return:
+                A dict mapping (experiment_id, variation_id, date) to a
+                (participant_count, completion_count) tuple.
+        '''
+
+        with self._lock:
+            return {key: tuple(counts) for key, counts in self._counts.items()}
+
+    def flush(self):
+        '''
+            Write all pending counts to ExperimentHistory. Counts for experiments or pages
+            that have since been deleted are discarded. If writing fails, the counts are
+            kept in the buffer to be written on the next flush.
+
+            Return:
+                Nothing
+        '''
+
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts = self._counts, {}
+                self._event_count = 0
+                self._last_flush = time.monotonic()
+
+            if not counts:
+                return
+
+            try:
+                counts, deleted = exclude_deleted(counts)
+                if deleted:
+                    logger.warning(
+                        "Discarded buffered experiment counts for %d deleted experiments or pages", len(deleted)
+                    )
+                increment_history_counts(
+                    key + tuple(key_counts) for key, key_counts in counts.items()
+                )
+            except Exception:
+                with self._lock:
+                    for key, (participant_count, completion_count) in counts.items():
+                        key_counts = self._counts.setdefault(key, [0, 0])
+                        key_counts[0] += participant_count
+                        key_counts[1] += completion_count
+                raise
+
+    def _start_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(
+                    target=self._run_flusher, name='wagtail-experiments-flusher', daemon=True
+                )
+                self._flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            flush_interval = self.flush_interval
+            if flush_interval is None:
+                return
+            time.sleep(flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to write buffered experiment counts")
+            finally:
+                # this thread's connection would otherwise stay open until the process exits
+                connections.close_all()
+
+
+buffer = CounterBuffer()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        buffer.flush()
+    except Exception:
+        logger.exception("Failed to write buffered experiment counts on exit")
+
+
+def flush():
+    '''
+        Write all counts buffered in this process to the database.
+
+        Return:
+            Nothing
+    '''
+
+    buffer.flush()
+
+
+def record_participant(experiment, user_id, variation, request):
+    '''
+        If the user hasn't already participated in this experiment,
+        then count the variation the user viewed.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+            user_id:    the id for this user.
+            variation:  variation user viewed.
+            request:    django HttpRequest.
+
+        Return:
+            Nothing
+    '''
+
+    if start_participation(experiment, request):
+        buffer.add(experiment.pk, variation.pk, datetime.date.today(), 1, 0)
+
+
+def record_completion(experiment, user_id, variation, request):
+    '''
+        If the user has started this experiment, but not completed it yet,
+        then count a completion for the variation the user viewed.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+            user_id:   the id for this user.
+            variation: variation user viewed.
+            request:   django HttpRequest.
+
+        Return:
+            Nothing
+    '''
+
+    if complete_participation(experiment, request):
+        buffer.add(experiment.pk, variation.pk, datetime.date.today(), 0, 1)
+
+
+def record_completions(experiments, user_id, request):
+    '''
+        Count completions for several experiments the user has started but not
+        completed yet.
+
+        Args:
+            experiments: list of experiments.models.Experiment instances
+            user_id:     the id for this user.
+            request:     django HttpRequest.
+
+        Return:
+            Nothing
+    '''
+
+    today = datetime.date.today()
+    experiments = [experiment for experiment in experiments if complete_participation(experiment, request)]
+    variation_ids = get_variation_ids_for_experiments(experiments)
+    for experiment in experiments:
+        variation = experiment.get_assigned_variation(user_id, request, variation_ids[experiment.pk])
+        buffer.add(experiment.pk, variation.pk, today, 0, 1)
+
+
+def get_report(experiment):
+    '''
+        Generate a report about the experiment's results, after writing out the counts
+        buffered in this process. Counts buffered in other processes are not included
+        until they are flushed.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+
+        Return:
+            A report of experiment results as a dictionary.
+    '''
+
+    buffer.flush()
+    return db.get_report(experiment)
@@ -0,0 +1,198 @@
+'''
+    A backend that counts participants and completions with atomic increments in the
+    Django cache, so that no database write is made on the request path. The
+    `experiment-flush-counters` management command, or a call to `flush()`, moves the
+    counts to ExperimentHistory. Reports include counts that have not been moved yet.
+
+    To use it, set:
+
+        WAGTAIL_EXPERIMENTS_BACKEND = 'experiments.backends.cache'
+
+    Counts are kept in the cache named by WAGTAIL_EXPERIMENTS_CACHE, which must be
+    shared between processes (such as memcached or redis) and support atomic `incr`.
+    They expire after WAGTAIL_EXPERIMENTS_COUNTER_CACHE_TIMEOUT seconds (default 7 days),
+    and the counts of the last WAGTAIL_EXPERIMENTS_COUNTER_CACHE_DAYS days (default 2)
+    are flushed, so counts are lost if they are evicted or not flushed in time.
+'''
+
+import datetime
+
+from django.conf import settings
+
+from experiments.backends import db
+from experiments.counters import increment_history_counts
+from experiments.models import Experiment
+from experiments.utils import complete_participation, get_cache, start_participation
+
+
+PARTICIPANT = 'p'
+COMPLETION = 'c'
+
+
+def get_counter_key(experiment_id, variation_id, date, kind):
+    return 'wagtail-experiments:counter:{0}:{1}:{2}:{3}'.format(
+        experiment_id, variation_id, date.isoformat(), kind
+    )
+
+
+def increment(experiment_id, variation_id, kind):
+    cache = get_cache()
+    key = get_counter_key(experiment_id, variation_id, datetime.date.today(), kind)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the counter does not exist yet; if another process creates it first, add to that
+        if not cache.add(key, 1, getattr(settings, 'WAGTAIL_EXPERIMENTS_COUNTER_CACHE_TIMEOUT', 7 * 24 * 3600)):
+            cache.incr(key)
+
+
+def record_participant(experiment, user_id, variation, request):
+    '''
+        If the user hasn't already participated in this experiment,
+        then count the variation the user viewed.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+            user_id:    the id for this user.
+            variation:  variation user viewed.
+            request:    django HttpRequest.
+
+        Return:
+            Nothing
+    '''
+
+    if start_participation(experiment, request):
+        increment(experiment.pk, variation.pk, PARTICIPANT)
+
+
+def record_completion(experiment, user_id, variation, request):
+    '''
+        If the user has started this experiment, but not completed it yet,
+        then count a completion for the variation the user viewed.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+            user_id:   the id for this user.
+            variation: variation user viewed.
+            request:   django HttpRequest.
+
+        Return:
+            Nothing
+    '''
+
+    if complete_participation(experiment, request):
+        increment(experiment.pk, variation.pk, COMPLETION)
+
+
+def get_pending_counts(experiments):
+    '''
+        Get the counts held in the cache for the given experiments, with a single cache lookup.
+
+        Args:
+            experiments: iterable of experiments.models.Experiment instances
+
+        Return:
+            A dict mapping (experiment_id, variation_id, date) to a
+            (participant_count, completion_count) tuple, for non-zero counts only.
+    '''
+
+    today = datetime.date.today()
+    dates = [
+        today - datetime.timedelta(days=days)
+        for days in range(0, getattr(settings, 'WAGTAIL_EXPERIMENTS_COUNTER_CACHE_DAYS', 2))
+    ]
+
+    keys = {}
+    for experiment in experiments:
+        for variation_id in experiment.get_variation_ids():
+            for date in dates:
+                for kind in (PARTICIPANT, COMPLETION):
+                    keys[get_counter_key(experiment.pk, variation_id, date, kind)] = (
+                        experiment.pk, variation_id, date, kind
+                    )
+
+    counts = {}
+    for key, value in get_cache().get_many(list(keys)).items():
+        if not value:
+            continue
+        experiment_id, variation_id, date, kind = keys[key]
+        participant_count, completion_count = counts.get((experiment_id, variation_id, date), (0, 0))
+        if kind == PARTICIPANT:
+            participant_count += value
+        else:
+            completion_count += value
+        counts[(experiment_id, variation_id, date)] = (participant_count, completion_count)
+    return counts
+
+
+def flush(experiments=None):
+    '''
+        Move the counts held in the cache to ExperimentHistory. Counts are taken from the
+        cache with atomic decrements, so increments made during the flush are kept for the
+        next one, and are put back if the database write fails.
+
+        Args:
+            experiments: iterable of experiments.models.Experiment instances to flush the
+                         counts of. Defaults to all experiments that are not drafts.
+
+        Return:
+            The number of participants and completions moved.
+    '''
+
+    if experiments is None:
+        experiments = Experiment.objects.exclude(status='draft')
+
+    cache = get_cache()
+    counts = get_pending_counts(experiments)
+
+    taken = []
+    for (experiment_id, variation_id, date), (participant_count, completion_count) in counts.items():
+        for kind, count in ((PARTICIPANT, participant_count), (COMPLETION, completion_count)):
+            if count:
+                key = get_counter_key(experiment_id, variation_id, date, kind)
+                cache.decr(key, count)
+                taken.append((key, count))
+
+    try:
+        increment_history_counts(
+            (experiment_id, variation_id, date, participant_count, completion_count)
+            for (experiment_id, variation_id, date), (participant_count, completion_count) in counts.items()
+        )
+    except Exception:
+        for key, count in taken:
+            cache.incr(key, count)
+        raise
+
+    return sum(count for key, count in taken)
+
+
+def get_report(experiment):
+    '''
+        Generate a report about the experiment's results, including the counts that
+        are still held in the cache.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+
+        Return:
+            A report of experiment results as a dictionary.
+    '''
+
+    report = db.get_report(experiment)
+    pending = get_pending_counts([experiment])
+
+    for variation in report['variations']:
+        history = {entry['date']: entry for entry in variation['history']}
+        for (experiment_id, variation_id, date), (participant_count, completion_count) in pending.items():
+            if variation_id != variation['variation_pk']:
+                continue
+
+            entry = history.setdefault(date, {'date': date, 'participant_count': 0, 'completion_count': 0})
+            entry['participant_count'] += participant_count
+            entry['completion_count'] += completion_count
+            variation['total_participant_count'] += participant_count
+            variation['total_completion_count'] += completion_count
+
+        variation['history'] = sorted(history.values(), key=lambda entry: entry['date'])
+
+    return report
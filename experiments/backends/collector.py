@@ -0,0 +1,301 @@
+'''
+    A backend that sends each participant and completion as a datagram to a collector
+    process, which aggregates the events from all worker processes and writes them to
+    ExperimentHistory in batches. Sending never blocks: if the collector is not running
+    or cannot keep up, events are dropped.
+
+    To use it, set:
+
+        WAGTAIL_EXPERIMENTS_BACKEND = 'experiments.backends.collector'
+        WAGTAIL_EXPERIMENTS_COLLECTOR_ADDRESS = '127.0.0.1:8127'
+
+    and run the collector with the `experiment-collector` management command.
+    WAGTAIL_EXPERIMENTS_COLLECTOR_ADDRESS is either a 'host:port' UDP address (default
+    '127.0.0.1:8127') or the path of a UNIX datagram socket. The collector writes the
+    counts it has received every WAGTAIL_EXPERIMENTS_COLLECTOR_FLUSH_INTERVAL seconds
+    (default 5), and when it is stopped.
+'''
+
+import datetime
+import os
+import socket
+import struct
+import threading
+import time
+
+from django.conf import settings
+
+from experiments.backends import db
+from experiments.backends.eventlog import COMPLETION, PARTICIPANT, RECORD, decode_events, encode_event
+from experiments.counters import exclude_deleted, increment_history_counts
+from experiments.utils import complete_participation, start_participation
+
+# magic, format version, sender process ID, sequence number; followed by one event record
+DATAGRAM_HEADER = struct.Struct('<4sHIQ')
+MAGIC = b'WXCD'
+VERSION = 1
+
+
+def parse_address(address):
+    '''
+        Parse a collector address.
+
+        Args:
+            address: a 'host:port' UDP address, or the path of a UNIX datagram socket.
+
+        Return:
+            A (socket family, socket address) tuple.
+    '''
+
+    if '/' in address:
+        return socket.AF_UNIX, address
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host, int(port))
+
+
+def get_address():
+    return parse_address(getattr(settings, 'WAGTAIL_EXPERIMENTS_COLLECTOR_ADDRESS', '127.0.0.1:8127'))
+
+
+class DatagramSender(object):
+    '''
+        Sends events from this process to the collector, numbering them so that the
+        collector can tell how many were lost.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._socket = None
+        self._address = None
+        self._sequence = 0
+        self.failed = 0
+
+    def send(self, record):
+        '''
+            Send an event record to the collector, without waiting.
+
+            Args:
+                record: bytes, as returned by experiments.backends.eventlog.encode_event
+
+            Return:
+                True if the datagram was sent, False if it was dropped.
+        '''
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # don't share the socket or sequence numbers with a forked parent process
+                self._pid = os.getpid()
+                self._socket = None
+                self._sequence = 0
+
+            if self._socket is None:
+                family, self._address = get_address()
+                self._socket = socket.socket(family, socket.SOCK_DGRAM)
+                self._socket.setblocking(False)
+
+            self._sequence += 1
+            datagram = DATAGRAM_HEADER.pack(MAGIC, VERSION, self._pid, self._sequence) + record
+
+            try:
+                self._socket.sendto(datagram, self._address)
+            except OSError:
+                # not running, or its receive buffer is full; the collector counts the gap
+                self.failed += 1
+                return False
+            return True
+
+
+sender = DatagramSender()
+
+
+def send_event(experiment, variation, kind):
+    sender.send(encode_event(experiment.pk, variation.pk, datetime.date.today(), kind, time.time()))
+
+
+def record_participant(experiment, user_id, variation, request):
+    '''
+        If the user hasn't already participated in this experiment,
+        then send the variation the user viewed to the collector.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+            user_id:    the id for this user.
+            variation:  variation user viewed.
+            request:    django HttpRequest.
+
+        Return:
+            Nothing
+    '''
+
+    if start_participation(experiment, request):
+        send_event(experiment, variation, PARTICIPANT)
+
+
+def record_completion(experiment, user_id, variation, request):
+    '''
+        If the user has started this experiment, but not completed it yet,
+        then send a completion for the variation the user viewed to the collector.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+            user_id:   the id for this user.
+            variation: variation user viewed.
+            request:   django HttpRequest.
+
+        Return:
+            Nothing
+    '''
+
+    if complete_participation(experiment, request):
+        send_event(experiment, variation, COMPLETION)
+
+
+def get_report(experiment):
+    '''
+        Generate a report about the experiment's results. Only events that the
+        collector has written to ExperimentHistory are included.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+
+        Return:
+            A report of experiment results as a dictionary.
+    '''
+
+    return db.get_report(experiment)
+
+
+class Collector(object):
+    '''
+        Receives event datagrams, and aggregates them until they are flushed to ExperimentHistory.
+    '''
+
+    def __init__(self, address):
+        self.family, self.address = parse_address(address)
+        self.socket = None
+        self._counts = {}
+        self._event_count = 0
+        self._sequences = {}
+        self.stats = {
+            'received': 0, 'dropped': 0, 'invalid': 0, 'discarded': 0, 'flushed': 0, 'flush_failures': 0,
+            'last_flush_seconds': None, 'max_flush_seconds': 0,
+        }
+
+    def bind(self):
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.remove(self.address)
+        self.socket = socket.socket(self.family, socket.SOCK_DGRAM)
+        self.socket.bind(self.address)
+        if self.family == socket.AF_INET:
+            # pick up the port chosen by the OS, when binding to port 0
+            self.address = self.socket.getsockname()
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+            if self.family == socket.AF_UNIX and os.path.exists(self.address):
+                os.remove(self.address)
+
+    def handle_datagram(self, datagram, sender_address=None):
+        '''
+            Add the event in a datagram to the pending counts, and count the datagrams
+            lost since the previous one from the same process.
+
+            Return:
+                Nothing
+        '''
+
+        if len(datagram) != DATAGRAM_HEADER.size + RECORD.size:
+            self.stats['invalid'] += 1
+            return
+
+        magic, version, pid, sequence = DATAGRAM_HEADER.unpack_from(datagram)
+        if magic != MAGIC or version != VERSION:
+            self.stats['invalid'] += 1
+            return
+
+        sender_key = (sender_address or None, pid)
+        last_sequence = self._sequences.get(sender_key, 0)
+        if sequence > last_sequence:
+            self.stats['dropped'] += sequence - last_sequence - 1
+            self._sequences[sender_key] = sequence
+        elif sequence < last_sequence and self.stats['dropped']:
+            # arrived out of order, after being counted as dropped
+            self.stats['dropped'] -= 1
+
+        for experiment_id, variation_id, date, kind, timestamp in decode_events(datagram[DATAGRAM_HEADER.size:]):
+            counts = self._counts.setdefault((experiment_id, variation_id, date), [0, 0])
+            if kind == PARTICIPANT:
+                counts[0] += 1
+            elif kind == COMPLETION:
+                counts[1] += 1
+            self._event_count += 1
+        self.stats['received'] += 1
+
+    def receive(self, timeout):
+        '''
+            Handle the datagrams that arrive within `timeout` seconds.
+
+            Return:
+                Nothing
+        '''
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            self.socket.settimeout(remaining)
+            try:
+                datagram, sender_address = self.socket.recvfrom(DATAGRAM_HEADER.size + RECORD.size + 1)
+            except socket.timeout:
+                return
+            self.handle_datagram(datagram, sender_address)
+
+    def pending(self):
+        '''
+            Get the number of events received but not written yet.
+        '''
+
+        return self._event_count
+
+    def flush(self):
+        '''
+            Write the pending counts to ExperimentHistory. Events for experiments or pages
+            that have since been deleted are discarded. If writing fails, the counts are kept
+            for the next flush.
+
+            Return:
+                The number of events written.
+        '''
+
+        if not self._counts:
+            return 0
+
+        started = time.monotonic()
+        try:
+            self._counts, deleted = exclude_deleted(self._counts)
+            if deleted:
+                discarded = sum(sum(counts) for counts in deleted.values())
+                self._event_count -= discarded
+                self.stats['discarded'] += discarded
+
+            increment_history_counts(
+                key + tuple(counts) for key, counts in self._counts.items()
+            )
+        except Exception:
+            self.stats['flush_failures'] += 1
+            raise
+
+        event_count = self._event_count
+        self._counts = {}
+        self._event_count = 0
+
+        elapsed = time.monotonic() - started
+        self.stats['flushed'] += event_count
+        self.stats['last_flush_seconds'] = elapsed
+        self.stats['max_flush_seconds'] = max(self.stats['max_flush_seconds'], elapsed)
+        return event_count
@@ -1,7 +1,11 @@
 import datetime
-from django.db.models import F, Sum
+from django.db.models import Sum
 
-from experiments.models import ExperimentHistory
+from experiments import deferred
+from experiments.counters import get_shard, increment_history_counts
+from experiments.models import ExperimentHistory, ExperimentVariationTotal, get_variation_ids_for_experiments
+from experiments.report_cache import report_cache
+from experiments.utils import complete_participation, start_participation
 
 
 def record_participant(experiment, user_id, variation, request):
@@ -20,19 +24,15 @@ def record_participant(experiment, user_id, variation, request):
     '''
 
     # abort if this user has participated already
-    experiments_started = request.session.get('experiments_started', [])
-    if experiment.id in experiments_started:
+    if not start_participation(experiment, request):
         return
 
-    experiments_started.append(experiment.id)
-    request.session['experiments_started'] = experiments_started
-
-    # get or create a History record for this experiment variation and the current date
-    history, _ = ExperimentHistory.objects.get_or_create(
-        experiment=experiment, variation=variation, date=datetime.date.today()
+    # increment the participant_count of the History record for this experiment variation
+    # and the current date, creating it if necessary
+    deferred.submit(
+        increment_history_counts, [(experiment.pk, variation.pk, datetime.date.today(), 1, 0)], get_shard(user_id)
     )
-    # increment the participant_count
-    ExperimentHistory.objects.filter(pk=history.pk).update(participant_count=F('participant_count') + 1)
+
 
 def record_completion(experiment, user_id, variation, request):
     '''
@@ -49,29 +49,50 @@ def record_completion(experiment, user_id, variation, request):
             Nothing
     '''
 
-    # abort if this user never started the experiment
-    if experiment.id not in request.session.get('experiments_started', []):
+    # abort if this user never started the experiment, or has completed already
+    if not complete_participation(experiment, request):
         return
 
-    # abort if this user has completed already
-    experiments_completed = request.session.get('experiments_completed', [])
-    if experiment.id in experiments_completed:
-        return
+    # increment the completion_count of the History record for this experiment variation
+    # and the current date, creating it if necessary
+    deferred.submit(
+        increment_history_counts, [(experiment.pk, variation.pk, datetime.date.today(), 0, 1)], get_shard(user_id)
+    )
 
-    experiments_completed.append(experiment.id)
-    request.session['experiments_completed'] = experiments_completed
 
-    # get or create a History record for this experiment variation and the current date
-    history, _ = ExperimentHistory.objects.get_or_create(
-        experiment=experiment, variation=variation, date=datetime.date.today()
-    )
-    # increment the completion_count
-    ExperimentHistory.objects.filter(pk=history.pk).update(completion_count=F('completion_count') + 1)
+def record_completions(experiments, user_id, request):
+    '''
+        Mark the user's participation in several experiments as completed, writing
+        all the completions in a single statement.
+
+        Args:
+            experiments: list of experiments.models.Experiment instances
+            user_id:     the id for this user.
+            request:     django HttpRequest.
+
+        Return:
+            Nothing
+    '''
+
+    today = datetime.date.today()
+    experiments = [experiment for experiment in experiments if complete_participation(experiment, request)]
+    variation_ids = get_variation_ids_for_experiments(experiments)
+    increments = [
+        (
+            experiment.pk, experiment.get_assigned_variation(user_id, request, variation_ids[experiment.pk]).pk,
+            today, 0, 1,
+        )
+        for experiment in experiments
+    ]
+    if increments:
+        deferred.submit(increment_history_counts, increments, get_shard(user_id))
 
 
 def get_report(experiment):
     '''
-        Generate a report about the experiment's results.
+        Generate a report about the experiment's results, summing the counts of all shards.
+        Totals are read from ExperimentVariationTotal. Only the history of recent days is
+        read from the database if the rest is cached.
 
         Args:
             experiment: instance of experiments.models.Experiment
@@ -80,29 +101,43 @@ def get_report(experiment):
             A report of experiment results as a dictionary.
     '''
 
-    result = {}
-    result.setdefault('variations', [])
-
-    variations = experiment.get_variations()
-    for variation in variations:
-        history_entries = ExperimentHistory.objects.filter(experiment=experiment, variation=variation)
-
-        variation_data = {
-            'variation_pk': variation.pk,
-            'is_control': variation.pk == experiment.control_page.pk,
-            'is_winner': variation.pk == experiment.winning_variation.pk if experiment.winning_variation else False,
-            'total_participant_count': history_entries.aggregate(sum=Sum('participant_count')).get('sum', 0),
-            'total_completion_count': history_entries.aggregate(sum=Sum('completion_count')).get('sum', 0),
-        }
-        variation_data.setdefault('history', [])
+    def load_history(since):
+        history_entries = ExperimentHistory.objects.filter(experiment=experiment)
+        if since is not None:
+            history_entries = history_entries.filter(date__gte=since)
+        history_entries = history_entries.values('variation_id', 'date').annotate(
+            participant_count=Sum('participant_count'), completion_count=Sum('completion_count')
+        ).order_by('date')
 
+        history_by_variation = {}
         for entry in history_entries:
-            variation_data['history'].append({
-                'date': entry.date,
-                'participant_count': entry.participant_count,
-                'completion_count': entry.completion_count,
+            history_by_variation.setdefault(entry['variation_id'], []).append({
+                'date': entry['date'],
+                'participant_count': entry['participant_count'],
+                'completion_count': entry['completion_count'],
             })
-
-        result['variations'].append(variation_data)
+        return history_by_variation
+
+    totals_by_variation = {
+        totals['variation_id']: totals
+        for totals in ExperimentVariationTotal.objects.filter(experiment=experiment).values(
+            'variation_id'
+        ).annotate(
+            participant_count=Sum('participant_count'), completion_count=Sum('completion_count')
+        ).order_by()
+    }
+    history_by_variation = report_cache.get(experiment.pk, load_history)
+
+    result = {'variations': []}
+    for variation_id in experiment.get_variation_ids():
+        totals = totals_by_variation.get(variation_id, {})
+        result['variations'].append({
+            'variation_pk': variation_id,
+            'is_control': variation_id == experiment.control_page_id,
+            'is_winner': variation_id == experiment.winning_variation_id,
+            'total_participant_count': totals.get('participant_count', 0),
+            'total_completion_count': totals.get('completion_count', 0),
+            'history': history_by_variation.get(variation_id, []),
+        })
 
     return result
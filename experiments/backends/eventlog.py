@@ -0,0 +1,341 @@
+'''
+    A backend that appends each participant and completion to a local, memory-mapped
+    log file, instead of writing to the database on the request path. The
+    `experiment-compact-log` management command adds the logged events to
+    ExperimentHistory, and archives the log files so that the raw events can be
+    aggregated again later.
+
+    To use it, set:
+
+        WAGTAIL_EXPERIMENTS_BACKEND = 'experiments.backends.eventlog'
+        WAGTAIL_EXPERIMENTS_EVENT_LOG_DIR = '/var/lib/mysite/experiment-events'
+
+    Each process writes to its own segment file of WAGTAIL_EXPERIMENTS_EVENT_LOG_SEGMENT_SIZE
+    records (default 65536). A segment is sealed, and becomes available for compaction, when it
+    is full, when it is older than WAGTAIL_EXPERIMENTS_EVENT_LOG_ROTATE_INTERVAL seconds (default
+    3600; checked when an event is written) and when the process exits. Written events are synced
+    to disk every WAGTAIL_EXPERIMENTS_EVENT_LOG_SYNC_EVENTS events (default 100) or
+    WAGTAIL_EXPERIMENTS_EVENT_LOG_SYNC_INTERVAL seconds (default 1), whichever comes first.
+'''
+
+import atexit
+import datetime
+import logging
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from experiments.backends import db
+from experiments.utils import complete_participation, start_participation
+
+
+logger = logging.getLogger(__name__)
+
+PARTICIPANT = 1
+COMPLETION = 2
+
+# magic, format version, record size, number of records written
+HEADER = struct.Struct('<4sHHQ')
+MAGIC = b'WXEL'
+VERSION = 1
+
+# experiment ID, variation ID, date (as an ordinal), kind, timestamp
+RECORD = struct.Struct('<IIIB3xd')
+
+ACTIVE_SUFFIX = '.active'
+SEALED_SUFFIX = '.segment'
+
+
+def encode_event(experiment_id, variation_id, date, kind, timestamp):
+    '''
+        Pack an event into a fixed-size binary record.
+
+        Args:
+            experiment_id: the primary key of the experiment.
+            variation_id:  the page ID of the variation.
+            date:          the date the event is counted against.
+            kind:          PARTICIPANT or COMPLETION.
+            timestamp:     the time of the event, in seconds since the epoch.
+
+        Return:
+            The record as bytes.
+    '''
+
+    return RECORD.pack(experiment_id, variation_id, date.toordinal(), kind, timestamp)
+
+
+def decode_events(data):
+    '''
+        Unpack a sequence of binary records.
+
+        Args:
+            data: bytes containing a whole number of records.
+
+        Return:
+            An iterator of (experiment_id, variation_id, date, kind, timestamp) tuples.
+    '''
+
+    for experiment_id, variation_id, date, kind, timestamp in RECORD.iter_unpack(data):
+        yield experiment_id, variation_id, datetime.date.fromordinal(date), kind, timestamp
+
+
+def read_segment(path):
+    '''
+        Read the events written to a segment file.
+
+        Args:
+            path: the path of the segment file.
+
+        Return:
+            A list of (experiment_id, variation_id, date, kind, timestamp) tuples.
+    '''
+
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return []
+
+        magic, version, record_size, count = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError("%s is not a wagtail-experiments event log segment" % path)
+
+        data = f.read(count * RECORD.size)
+
+    # ignore a partially written record at the end of a segment from a crashed process
+    data = data[:len(data) - len(data) % RECORD.size]
+    return list(decode_events(data))
+
+
+def seal_orphaned_segments(log_dir):
+    '''
+        Seal the active segments left behind by processes on this host that have exited
+        without sealing them, such as after a crash.
+
+        Args:
+            log_dir: the event log directory.
+
+        Return:
+            A list of the paths of the sealed segments.
+    '''
+
+    hostname = socket.gethostname()
+    sealed = []
+
+    for filename in sorted(os.listdir(log_dir)):
+        if not filename.endswith(ACTIVE_SUFFIX):
+            continue
+
+        host, pid, _ = filename[:-len(ACTIVE_SUFFIX)].rsplit('-', 2)
+        if host != hostname:
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            # the process exists, but belongs to another user
+            continue
+        else:
+            continue
+
+        path = os.path.join(log_dir, filename)
+        with open(path, 'r+b') as f:
+            count = HEADER.unpack(f.read(HEADER.size))[3]
+            f.truncate(HEADER.size + count * RECORD.size)
+        sealed_path = path[:-len(ACTIVE_SUFFIX)] + SEALED_SUFFIX
+        os.rename(path, sealed_path)
+        sealed.append(sealed_path)
+
+    return sealed
+
+
+def get_log_dir():
+    log_dir = getattr(settings, 'WAGTAIL_EXPERIMENTS_EVENT_LOG_DIR', None)
+    if not log_dir:
+        raise ImproperlyConfigured(
+            "WAGTAIL_EXPERIMENTS_EVENT_LOG_DIR must be set to use experiments.backends.eventlog"
+        )
+    return log_dir
+
+
+class SegmentWriter(object):
+    '''
+        Appends records to this process's active segment file.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._mmap = None
+        self._path = None
+        self._capacity = 0
+        self._count = 0
+        self._opened_at = 0
+        self._unsynced = 0
+        self._synced_at = 0
+
+    def _open(self):
+        log_dir = get_log_dir()
+        os.makedirs(log_dir, exist_ok=True)
+
+        self._capacity = getattr(settings, 'WAGTAIL_EXPERIMENTS_EVENT_LOG_SEGMENT_SIZE', 65536)
+        self._pid = os.getpid()
+        self._path = os.path.join(
+            log_dir, '{0}-{1}-{2}{3}'.format(socket.gethostname(), self._pid, time.time_ns(), ACTIVE_SUFFIX)
+        )
+        self._file = open(self._path, 'w+b')
+        self._file.truncate(HEADER.size + self._capacity * RECORD.size)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self._count = 0
+        self._write_header()
+        self._opened_at = self._synced_at = time.monotonic()
+        self._unsynced = 0
+
+    def _write_header(self):
+        self._mmap[:HEADER.size] = HEADER.pack(MAGIC, VERSION, RECORD.size, self._count)
+
+    def _sync(self):
+        self._mmap.flush()
+        self._synced_at = time.monotonic()
+        self._unsynced = 0
+
+    def _seal(self):
+        segment_mmap, segment_file, path = self._mmap, self._file, self._path
+        # start a new segment on the next write, even if sealing this one fails
+        self._mmap = self._file = self._path = None
+
+        try:
+            segment_mmap.flush()
+            segment_mmap.close()
+            segment_file.truncate(HEADER.size + self._count * RECORD.size)
+        finally:
+            segment_file.close()
+        os.rename(path, path[:-len(ACTIVE_SUFFIX)] + SEALED_SUFFIX)
+
+    def append(self, record):
+        '''
+            Append a record to the active segment, opening or rotating segments as necessary.
+
+            Args:
+                record: bytes, as returned by encode_event
+
+            Return:
+                Nothing
+        '''
+
+        with self._lock:
+            if self._mmap is not None and self._pid != os.getpid():
+                # inherited from the parent process when forking; leave it to the parent
+                self._mmap = self._file = self._path = None
+
+            if self._mmap is not None and (
+                self._count >= self._capacity
+                or time.monotonic() - self._opened_at >= getattr(
+                    settings, 'WAGTAIL_EXPERIMENTS_EVENT_LOG_ROTATE_INTERVAL', 3600
+                )
+            ):
+                self._seal()
+
+            if self._mmap is None:
+                self._open()
+
+            offset = HEADER.size + self._count * RECORD.size
+            self._mmap[offset:offset + RECORD.size] = record
+            self._count += 1
+            self._write_header()
+
+            self._unsynced += 1
+            if (
+                self._unsynced >= getattr(settings, 'WAGTAIL_EXPERIMENTS_EVENT_LOG_SYNC_EVENTS', 100)
+                or time.monotonic() - self._synced_at >= getattr(
+                    settings, 'WAGTAIL_EXPERIMENTS_EVENT_LOG_SYNC_INTERVAL', 1
+                )
+            ):
+                self._sync()
+
+    def seal(self):
+        '''
+            Seal the active segment, if any, so that it can be compacted.
+
+            Return:
+                Nothing
+        '''
+
+        with self._lock:
+            if self._mmap is not None and self._pid == os.getpid():
+                self._seal()
+
+
+writer = SegmentWriter()
+
+
+@atexit.register
+def _seal_on_exit():
+    try:
+        writer.seal()
+    except Exception:
+        logger.exception("Failed to seal experiment event log segment on exit")
+
+
+def log_event(experiment, variation, kind):
+    writer.append(encode_event(experiment.pk, variation.pk, datetime.date.today(), kind, time.time()))
+
+
+def record_participant(experiment, user_id, variation, request):
+    '''
+        If the user hasn't already participated in this experiment,
+        then log the variation the user viewed.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+            user_id:    the id for this user.
+            variation:  variation user viewed.
+            request:    django HttpRequest.
+
+        Return:
+            Nothing
+    '''
+
+    if start_participation(experiment, request):
+        log_event(experiment, variation, PARTICIPANT)
+
+
+def record_completion(experiment, user_id, variation, request):
+    '''
+        If the user has started this experiment, but not completed it yet,
+        then log a completion for the variation the user viewed.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+            user_id:   the id for this user.
+            variation: variation user viewed.
+            request:   django HttpRequest.
+
+        Return:
+            Nothing
+    '''
+
+    if complete_participation(experiment, request):
+        log_event(experiment, variation, COMPLETION)
+
+
+def get_report(experiment):
+    '''
+        Generate a report about the experiment's results. Only events that have
+        been compacted into ExperimentHistory are included.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+
+        Return:
+            A report of experiment results as a dictionary.
+    '''
+
+    return db.get_report(experiment)
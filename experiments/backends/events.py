@@ -0,0 +1,210 @@
+'''
+    A backend that inserts a row into ExperimentEvent for each participant and
+    completion, instead of updating a shared ExperimentHistory row. The
+    `experiment-rollup` management command adds new events to ExperimentHistory.
+
+    To use it, set:
+
+        WAGTAIL_EXPERIMENTS_BACKEND = 'experiments.backends.events'
+'''
+
+import datetime
+from hashlib import sha1
+
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from experiments import deferred
+from experiments.backends import db
+from experiments.counters import increment_history_counts
+from experiments.models import (
+    ExperimentEvent, ExperimentEventRollup, ExperimentHistory, ExperimentVariationTotal,
+    get_variation_ids_for_experiments,
+)
+from experiments.report_cache import report_cache
+from experiments.utils import complete_participation, start_participation
+
+
+def get_user_hash(user_id):
+    return sha1(str(user_id).encode('utf-8')).hexdigest()
+
+
+def record_participant(experiment, user_id, variation, request):
+    '''
+        If the user hasn't already participated in this experiment,
+        then log the variation the user viewed.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+            user_id:    the id for this user.
+            variation:  variation user viewed.
+            request:    django HttpRequest.
+
+        Return:
+            Nothing
+    '''
+
+    if start_participation(experiment, request):
+        deferred.submit(ExperimentEvent.objects.bulk_create, [ExperimentEvent(
+            experiment_id=experiment.pk, variation_id=variation.pk,
+            kind='participant', user_hash=get_user_hash(user_id),
+        )])
+
+
+def record_completion(experiment, user_id, variation, request):
+    '''
+        If the user has started this experiment, but not completed it yet,
+        then log a completion for the variation the user viewed.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+            user_id:   the id for this user.
+            variation: variation user viewed.
+            request:   django HttpRequest.
+
+        Return:
+            Nothing
+    '''
+
+    record_completions([experiment], user_id, request, variations={experiment.pk: variation})
+
+
+def record_completions(experiments, user_id, request, variations=None):
+    '''
+        Log completions for several experiments the user has started but not
+        completed yet, in a single insert.
+
+        Args:
+            experiments: list of experiments.models.Experiment instances
+            user_id:     the id for this user.
+            request:     django HttpRequest.
+            variations:  optional dict of the variations served to the user, by experiment ID.
+
+        Return:
+            Nothing
+    '''
+
+    variations = variations or {}
+    user_hash = get_user_hash(user_id)
+    experiments = [experiment for experiment in experiments if complete_participation(experiment, request)]
+    variation_ids = get_variation_ids_for_experiments(
+        [experiment for experiment in experiments if experiment.pk not in variations]
+    )
+    events = [
+        ExperimentEvent(
+            experiment_id=experiment.pk,
+            variation_id=(
+                variations.get(experiment.pk)
+                or experiment.get_assigned_variation(user_id, request, variation_ids[experiment.pk])
+            ).pk,
+            kind='completion', user_hash=user_hash,
+        )
+        for experiment in experiments
+    ]
+    if events:
+        deferred.submit(ExperimentEvent.objects.bulk_create, events)
+
+
+def get_report(experiment):
+    '''
+        Generate a report about the experiment's results. Only events that have
+        been rolled up into ExperimentHistory are included.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+
+        Return:
+            A report of experiment results as a dictionary.
+    '''
+
+    return db.get_report(experiment)
+
+
+def get_event_counts(events):
+    '''
+        Count events by experiment, variation, date and kind, with a single query.
+
+        Args:
+            events: a queryset of ExperimentEvent
+
+        Return:
+            A list of (experiment_id, variation_id, date, participant_count, completion_count) tuples.
+    '''
+
+    rows = events.annotate(date=TruncDate('timestamp')).values(
+        'experiment_id', 'variation_id', 'date', 'kind'
+    ).annotate(count=Count('id')).order_by()
+
+    return [
+        (
+            row['experiment_id'], row['variation_id'], row['date'],
+            row['count'] if row['kind'] == 'participant' else 0,
+            row['count'] if row['kind'] == 'completion' else 0,
+        )
+        for row in rows
+    ]
+
+
+def roll_up_events(lag=60):
+    '''
+        Add the events recorded since the last rollup to ExperimentHistory.
+
+        Args:
+            lag: events newer than this many seconds are left for the next rollup, so that
+                 events from transactions that have not committed yet (which may have lower
+                 IDs than committed ones) are not skipped.
+
+        Return:
+            The number of events rolled up.
+    '''
+
+    with transaction.atomic():
+        rollup, _ = ExperimentEventRollup.objects.get_or_create(pk=1)
+        # lock the high-water mark, so that concurrent rollups cannot count events twice
+        rollup = ExperimentEventRollup.objects.select_for_update().get(pk=rollup.pk)
+
+        cutoff = timezone.now() - datetime.timedelta(seconds=lag)
+        last_event_id = ExperimentEvent.objects.filter(
+            pk__gt=rollup.last_event_id, timestamp__lte=cutoff
+        ).aggregate(last_event_id=Max('pk'))['last_event_id']
+        if last_event_id is None:
+            return 0
+
+        events = ExperimentEvent.objects.filter(pk__gt=rollup.last_event_id, pk__lte=last_event_id)
+        counts = get_event_counts(events)
+        increment_history_counts(counts)
+
+        rollup.last_event_id = last_event_id
+        rollup.save()
+
+    return sum(participant_count + completion_count for _, _, _, participant_count, completion_count in counts)
+
+
+def rebuild_history(experiments):
+    '''
+        Replace the history of the given experiments with counts rebuilt from all their events.
+        Only suitable for experiments that have recorded all their results as events.
+
+        Args:
+            experiments: a queryset of experiments.models.Experiment
+
+        Return:
+            The number of events counted.
+    '''
+
+    with transaction.atomic():
+        rollup, _ = ExperimentEventRollup.objects.get_or_create(pk=1)
+        rollup = ExperimentEventRollup.objects.select_for_update().get(pk=rollup.pk)
+
+        ExperimentHistory.objects.filter(experiment__in=experiments).delete()
+        ExperimentVariationTotal.objects.filter(experiment__in=experiments).delete()
+        counts = get_event_counts(ExperimentEvent.objects.filter(
+            experiment__in=experiments, pk__lte=rollup.last_event_id
+        ))
+        increment_history_counts(counts)
+
+    report_cache.invalidate(*[experiment.pk for experiment in experiments])
+
+    return sum(participant_count + completion_count for _, _, _, participant_count, completion_count in counts)
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+from django.utils.module_loading import import_string
+
+
+@register(Tags.compatibility)
+def check_participant_state(app_configs, **kwargs):
+    '''
+        Check that the middleware needed by the participant state store is installed.
+        Without it, a store such as experiments.state.SignedCookieParticipantState never
+        saves its state, and every request counts as a new participant.
+
+        Args:
+            app_configs: the app configs to check, or None for all of them.
+
+        Return:
+            A list of errors.
+    '''
+
+    state_class = import_string(getattr(
+        settings, 'WAGTAIL_EXPERIMENTS_PARTICIPANT_STATE', 'experiments.state.SessionParticipantState'
+    ))
+    middleware = getattr(state_class, 'middleware', None)
+    if middleware is None or middleware in settings.MIDDLEWARE:
+        return []
+
+    return [Error(
+        '%s requires %s to be in MIDDLEWARE.' % (state_class.__name__, middleware),
+        hint='Add %s to MIDDLEWARE, or use another WAGTAIL_EXPERIMENTS_PARTICIPANT_STATE.' % middleware,
+        id='experiments.E001',
+    )]
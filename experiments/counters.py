@@ -0,0 +1,300 @@
+import datetime
+import zlib
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from wagtail.models import Page
+
+from .models import Experiment, ExperimentHistory, ExperimentVariationTotal
+from .report_cache import report_cache
+
+
+# number of rows to send in a single INSERT statement
+BATCH_SIZE = 100
+
+
+def get_shard(user_id):
+    '''
+        Choose the ExperimentHistory shard that a user's participation and completion are
+        counted in, spreading concurrent increments to a variation's daily counts over
+        WAGTAIL_EXPERIMENTS_HISTORY_SHARDS rows (default 1, i.e. no sharding).
+
+        Args:
+            user_id: the id for this user.
+
+        Return:
+            The shard number.
+    '''
+
+    shards = getattr(settings, 'WAGTAIL_EXPERIMENTS_HISTORY_SHARDS', 1)
+    if shards <= 1:
+        return 0
+    return zlib.crc32(str(user_id).encode('utf-8')) % shards
+
+
+def aggregate_increments(increments):
+    '''
+        Combine increments that apply to the same ExperimentHistory row.
+
+        Args:
+            increments: iterable of (experiment_id, variation_id, date, participant_count, completion_count)
+                        tuples, where the counts are the amounts to add.
+
+        Return:
+            An ordered dict mapping (experiment_id, variation_id, date) to a
+            [participant_count, completion_count] list.
+    '''
+
+    totals = OrderedDict()
+    for experiment_id, variation_id, date, participant_count, completion_count in increments:
+        counts = totals.setdefault((experiment_id, variation_id, date), [0, 0])
+        counts[0] += participant_count
+        counts[1] += completion_count
+    return totals
+
+
+def exclude_deleted(counts):
+    '''
+        Remove the counts of experiments or pages that have been deleted since they were
+        counted, which could never be written.
+
+        Args:
+            counts: dict keyed by (experiment_id, variation_id, date) tuples.
+
+        Return:
+            A (counts, deleted) tuple of dicts, holding the counts of existing experiments
+            and pages, and the rest.
+    '''
+
+    experiment_ids = set(Experiment.objects.filter(
+        pk__in={key[0] for key in counts}
+    ).values_list('pk', flat=True))
+    page_ids = set(Page.objects.filter(
+        pk__in={key[1] for key in counts}
+    ).values_list('pk', flat=True))
+
+    existing = {}
+    deleted = {}
+    for key, value in counts.items():
+        if key[0] in experiment_ids and key[1] in page_ids:
+            existing[key] = value
+        else:
+            deleted[key] = value
+    return existing, deleted
+
+
+def get_upsert_sql(connection, row_count, model=ExperimentHistory):
+    '''
+        Build an INSERT statement that adds to the counts of existing rows rather than failing
+        on the unique constraint of ExperimentHistory (experiment, date, variation, shard), or of
+        ExperimentVariationTotal (experiment, variation, shard).
+
+        Args:
+            connection: the database connection the statement will run on.
+            row_count:  the number of rows in the VALUES clause.
+            model:      ExperimentHistory or ExperimentVariationTotal.
+
+        Return:
+            The SQL string, or None if the database has no suitable syntax. The values for
+            each row are the fields of the unique constraint, followed by the two counts and,
+            for models with a `last_modified` field, the modification time.
+    '''
+
+    opts = model._meta
+    qn = connection.ops.quote_name
+    table = qn(opts.db_table)
+    keys = [qn(opts.get_field(name).column) for name in opts.unique_together[0]]
+    participant_count, completion_count = [
+        qn(opts.get_field(name).column) for name in ('participant_count', 'completion_count')
+    ]
+    last_modified = qn(opts.get_field('last_modified').column) if has_last_modified(model) else None
+
+    if connection.vendor in ('postgresql', 'sqlite') and connection.features.supports_update_conflicts_with_target:
+        on_conflict = 'ON CONFLICT ({0}) DO UPDATE SET {1} = {3}.{1} + EXCLUDED.{1}, {2} = {3}.{2} + EXCLUDED.{2}'.format(
+            ', '.join(keys), participant_count, completion_count, table
+        )
+        if last_modified:
+            on_conflict += ', {0} = EXCLUDED.{0}'.format(last_modified)
+    elif connection.vendor == 'mysql':
+        on_conflict = 'ON DUPLICATE KEY UPDATE {0} = {0} + VALUES({0}), {1} = {1} + VALUES({1})'.format(
+            participant_count, completion_count
+        )
+        if last_modified:
+            on_conflict += ', {0} = VALUES({0})'.format(last_modified)
+    else:
+        return None
+
+    columns = keys + [participant_count, completion_count]
+    if last_modified:
+        columns.append(last_modified)
+    return 'INSERT INTO {0} ({1}) VALUES {2} {3}'.format(
+        table, ', '.join(columns),
+        ', '.join(['(' + ', '.join(['%s'] * len(columns)) + ')'] * row_count),
+        on_conflict,
+    )
+
+
+def has_last_modified(model):
+    return any(field.name == 'last_modified' for field in model._meta.concrete_fields)
+
+
+def _increment_with_upsert(connection, model, rows):
+    extra_params = []
+    if has_last_modified(model):
+        extra_params.append(connection.ops.adapt_datetimefield_value(timezone.now()))
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            params = []
+            for key, (participant_count, completion_count) in batch:
+                params.extend(
+                    connection.ops.adapt_datefield_value(value) if isinstance(value, datetime.date) else value
+                    for value in key
+                )
+                params.extend([participant_count, completion_count])
+                params.extend(extra_params)
+            cursor.execute(get_upsert_sql(connection, len(batch), model), params)
+
+
+def _increment_with_update(using, model, rows):
+    attnames = [model._meta.get_field(name).attname for name in model._meta.unique_together[0]]
+
+    for key, (participant_count, completion_count) in rows:
+        lookup = dict(zip(attnames, key))
+        increment = dict(
+            participant_count=F('participant_count') + participant_count,
+            completion_count=F('completion_count') + completion_count,
+        )
+        if has_last_modified(model):
+            increment['last_modified'] = timezone.now()
+
+        if model.objects.using(using).filter(**lookup).update(**increment):
+            continue
+
+        try:
+            with transaction.atomic(using=using):
+                model.objects.using(using).create(
+                    participant_count=participant_count, completion_count=completion_count, **lookup
+                )
+        except IntegrityError:
+            # another request created the row since we tried to update it
+            model.objects.using(using).filter(**lookup).update(**increment)
+
+
+def increment_history_counts(increments, shard=0, update_totals=True):
+    '''
+        Add to the daily participant and completion counts of experiment variations, and to
+        their running totals in ExperimentVariationTotal, in the same transaction.
+
+        Where the database supports it, rows are written with a single
+        INSERT ... ON CONFLICT DO UPDATE (or ON DUPLICATE KEY UPDATE) statement per batch,
+        which cannot race with another request creating the same row. Other databases
+        fall back on an UPDATE followed, if no row existed, by an INSERT.
+
+        Args:
+            increments:    iterable of (experiment_id, variation_id, date, participant_count,
+                           completion_count) tuples, where the counts are the amounts to add.
+            shard:         the shard of the rows to add to, as returned by get_shard.
+            update_totals: False to leave the running totals alone, when moving counts
+                           between history rows.
+
+        Return:
+            Nothing
+    '''
+
+    rows = aggregate_increments(increments)
+    if not rows:
+        return
+
+    # cached reports only pick up later writes to the current day
+    today = datetime.date.today()
+    stale_experiment_ids = {experiment_id for experiment_id, variation_id, date in rows if date < today}
+
+    writes = [(
+        ExperimentHistory,
+        [((experiment_id, date, variation_id, shard), counts) for (experiment_id, variation_id, date), counts in rows.items()]
+    )]
+    if update_totals:
+        totals = OrderedDict()
+        for (experiment_id, variation_id, date), (participant_count, completion_count) in rows.items():
+            counts = totals.setdefault((experiment_id, variation_id, shard), [0, 0])
+            counts[0] += participant_count
+            counts[1] += completion_count
+        writes.append((ExperimentVariationTotal, list(totals.items())))
+
+    using = router.db_for_write(ExperimentHistory)
+    connection = connections[using]
+
+    with transaction.atomic(using=using):
+        for model, model_rows in writes:
+            if get_upsert_sql(connection, 1, model) is None:
+                _increment_with_update(using, model, model_rows)
+            else:
+                _increment_with_upsert(connection, model, model_rows)
+
+        # a report read before the commit would cache the old counts again
+        if stale_experiment_ids:
+            transaction.on_commit(partial(report_cache.invalidate, *stale_experiment_ids), using=using)
+
+
+def rebuild_totals(experiments):
+    '''
+        Replace the running totals of the given experiments with the sums of their history.
+
+        Args:
+            experiments: a queryset of experiments.models.Experiment
+
+        Return:
+            The number of totals rows written.
+    '''
+
+    using = router.db_for_write(ExperimentVariationTotal)
+
+    with transaction.atomic(using=using):
+        ExperimentVariationTotal.objects.using(using).filter(experiment__in=experiments).delete()
+        totals = [
+            ExperimentVariationTotal(shard=0, **row)
+            for row in ExperimentHistory.objects.using(using).filter(experiment__in=experiments)
+            .values('experiment_id', 'variation_id')
+            .annotate(participant_count=Sum('participant_count'), completion_count=Sum('completion_count'))
+            .order_by()
+        ]
+        ExperimentVariationTotal.objects.using(using).bulk_create(totals)
+
+    return len(totals)
+
+
+def fold_shards(before):
+    '''
+        Add the counts in the shards of ExperimentHistory rows dated before the given date
+        to their shard 0 rows, and delete them, so that past days take up a single row.
+
+        Args:
+            before: the date of the first day to leave untouched; normally today, as the
+                    current day's rows are still being written to.
+
+        Return:
+            The number of rows deleted.
+    '''
+
+    using = router.db_for_write(ExperimentHistory)
+
+    with transaction.atomic(using=using):
+        sharded = list(
+            ExperimentHistory.objects.using(using).select_for_update()
+            .filter(date__lt=before, shard__gt=0)
+            .values_list('pk', 'experiment_id', 'variation_id', 'date', 'participant_count', 'completion_count')
+        )
+        if not sharded:
+            return 0
+
+        ExperimentHistory.objects.using(using).filter(pk__in=[row[0] for row in sharded]).delete()
+        increment_history_counts([row[1:] for row in sharded], update_totals=False)
+
+    return len(sharded)
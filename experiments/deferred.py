@@ -0,0 +1,198 @@
+'''
+    Optionally move the database writes made when tracking participants and completions
+    off the response path. Controlled by WAGTAIL_EXPERIMENTS_DEFER_WRITES:
+
+        None (default):      write immediately, on the request thread
+        'request_finished':  write on the request thread once the response has been sent
+        'thread':            hand writes to a pool of WAGTAIL_EXPERIMENTS_DEFER_WORKERS
+                             background threads (default 2), through a queue holding up to
+                             WAGTAIL_EXPERIMENTS_DEFER_QUEUE_SIZE writes (default 1000)
+
+    When the queue is full, WAGTAIL_EXPERIMENTS_DEFER_POLICY decides whether the write is
+    dropped immediately ('drop', the default) or the request waits up to
+    WAGTAIL_EXPERIMENTS_DEFER_BLOCK_TIMEOUT seconds (default 1) for space before dropping it
+    ('block'). Pending writes are drained when the process exits.
+'''
+
+import atexit
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class DeferredWriter(object):
+    '''
+        Runs write functions according to WAGTAIL_EXPERIMENTS_DEFER_WRITES, counting
+        submitted, completed, failed and dropped writes.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._queue = None
+        self._workers = []
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'dropped': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get_stats(self):
+        '''
+            Get the number of writes submitted, completed, failed and dropped in this process.
+
+            Return:
+                A dict of counts.
+        '''
+
+        with self._lock:
+            return dict(self.stats)
+
+    def submit(self, func, *args):
+        '''
+            Run `func(*args)` now or later, depending on WAGTAIL_EXPERIMENTS_DEFER_WRITES.
+
+            Return:
+                Nothing
+        '''
+
+        mode = getattr(settings, 'WAGTAIL_EXPERIMENTS_DEFER_WRITES', None)
+        if mode is None:
+            func(*args)
+            return
+
+        self._count('submitted')
+
+        if mode == 'request_finished':
+            pending = getattr(self._local, 'pending', None)
+            if pending is None:
+                pending = self._local.pending = []
+            pending.append((func, args))
+        elif mode == 'thread':
+            self._enqueue((func, args))
+        else:
+            raise ImproperlyConfigured(
+                "WAGTAIL_EXPERIMENTS_DEFER_WRITES must be None, 'request_finished' or 'thread', not %r" % mode
+            )
+
+    def _run(self, func, args):
+        try:
+            func(*args)
+        except Exception:
+            self._count('failed')
+            logger.exception("Deferred experiment write failed")
+        else:
+            self._count('completed')
+
+    def run_pending(self, **kwargs):
+        '''
+            Run the writes deferred until the end of the current request.
+            Connected to the request_finished signal.
+        '''
+
+        pending = getattr(self._local, 'pending', None)
+        if not pending:
+            return
+
+        self._local.pending = []
+        for func, args in pending:
+            self._run(func, args)
+
+    def _enqueue(self, item):
+        self._start_workers()
+
+        try:
+            if getattr(settings, 'WAGTAIL_EXPERIMENTS_DEFER_POLICY', 'drop') == 'block':
+                self._queue.put(item, timeout=getattr(settings, 'WAGTAIL_EXPERIMENTS_DEFER_BLOCK_TIMEOUT', 1))
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            self._count('dropped')
+            logger.warning("Experiment write queue is full; dropping write")
+
+    def _start_workers(self):
+        if self._workers:
+            return
+
+        with self._lock:
+            if self._workers:
+                return
+
+            self._queue = queue.Queue(getattr(settings, 'WAGTAIL_EXPERIMENTS_DEFER_QUEUE_SIZE', 1000))
+            for index in range(getattr(settings, 'WAGTAIL_EXPERIMENTS_DEFER_WORKERS', 2)):
+                worker = threading.Thread(
+                    target=self._work, name='wagtail-experiments-writer-%d' % index, daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                close_old_connections()
+                self._run(*item)
+                close_old_connections()
+            finally:
+                self._queue.task_done()
+
+    def drain(self):
+        '''
+            Wait until all queued writes have been run.
+
+            Return:
+                Nothing
+        '''
+
+        if self._queue is not None:
+            self._queue.join()
+
+    def shutdown(self, timeout=5):
+        '''
+            Run the remaining queued writes and stop the worker threads, waiting up to
+            `timeout` seconds for each of them.
+
+            Return:
+                Nothing
+        '''
+
+        with self._lock:
+            workers, self._workers = self._workers, []
+
+        for worker in workers:
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                break
+        for worker in workers:
+            worker.join(timeout)
+
+
+writer = DeferredWriter()
+atexit.register(writer.shutdown)
+
+
+def submit(func, *args):
+    '''
+        Run a database write now or later, depending on WAGTAIL_EXPERIMENTS_DEFER_WRITES.
+
+        Args:
+            func: the function making the write.
+            args: positional arguments for func.
+
+        Return:
+            Nothing
+    '''
+
+    writer.submit(func, *args)
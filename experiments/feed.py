@@ -0,0 +1,143 @@
+'''
+    Incremental feed of changes to experiment history, for polling by dashboards and
+    data warehouses.
+
+    Changes are found through ExperimentHistory.last_modified, paging through rows in
+    (last_modified, id) order from an opaque cursor. Each change is reported as the current
+    counts of a variation on a day, with all shards added up, so consumers can replace the
+    values they hold for that variation and day. Rows modified within the last
+    WAGTAIL_EXPERIMENTS_FEED_LAG seconds (default 60) are held back, so that writes from
+    transactions that had not committed yet when a page was read are not skipped.
+'''
+
+import base64
+import datetime
+import hashlib
+
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ExperimentHistory
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(last_modified, pk):
+    value = '{0}|{1}'.format(last_modified.isoformat(), pk)
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    '''
+        Decode a cursor returned by get_changes.
+
+        Args:
+            cursor: the cursor string, or an empty value for the start of the history.
+
+        Return:
+            A (last_modified, pk) tuple, or None for the start of the history.
+
+        Raises:
+            InvalidCursor if the cursor is malformed.
+    '''
+
+    if not cursor:
+        return None
+
+    try:
+        last_modified, pk = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        last_modified = parse_datetime(last_modified)
+        pk = int(pk)
+    except (ValueError, UnicodeError):
+        raise InvalidCursor(cursor)
+    if last_modified is None:
+        raise InvalidCursor(cursor)
+    return last_modified, pk
+
+
+def get_changed_rows(cursor, experiments=None):
+    '''
+        Get the history rows modified after the cursor, that are old enough to be reported.
+
+        Args:
+            cursor:      a (last_modified, pk) tuple as returned by decode_cursor, or None.
+            experiments: optional queryset of experiments to limit the changes to.
+
+        Return:
+            A queryset of ExperimentHistory, ordered by (last_modified, id).
+    '''
+
+    cutoff = timezone.now() - datetime.timedelta(seconds=getattr(settings, 'WAGTAIL_EXPERIMENTS_FEED_LAG', 60))
+    rows = ExperimentHistory.objects.filter(last_modified__lte=cutoff)
+    if cursor is not None:
+        last_modified, pk = cursor
+        rows = rows.filter(Q(last_modified__gt=last_modified) | Q(last_modified=last_modified, pk__gt=pk))
+    if experiments is not None:
+        rows = rows.filter(experiment__in=experiments)
+    return rows.order_by('last_modified', 'pk')
+
+
+def get_etag(cursor, experiments=None, variant=''):
+    '''
+        Get an entity tag for the changes after the cursor, which changes whenever there
+        are new changes to report, with a single indexed query.
+
+        Args:
+            cursor:      a (last_modified, pk) tuple as returned by decode_cursor, or None.
+            experiments: optional queryset of experiments to limit the changes to.
+            variant:     string identifying anything else the response depends on, such
+                         as the request's query string.
+
+        Return:
+            The ETag as a quoted string.
+    '''
+
+    latest = get_changed_rows(cursor, experiments).values_list('last_modified', 'pk').last()
+    value = '{0}|{1}'.format(encode_cursor(*latest) if latest else '', variant)
+    return '"{0}"'.format(hashlib.sha1(value.encode('utf-8')).hexdigest())
+
+
+def get_changes(cursor, limit, experiments=None):
+    '''
+        Get a page of changes to experiment history.
+
+        Args:
+            cursor:      a (last_modified, pk) tuple as returned by decode_cursor, or None.
+            limit:       the maximum number of history rows to read.
+            experiments: optional queryset of experiments to limit the changes to.
+
+        Return:
+            A (changes, next_cursor, has_more) tuple. changes is a list of dicts with the
+            experiment_id, variation_id, date, participant_count and completion_count of
+            each changed variation and day; next_cursor is the cursor to continue from.
+    '''
+
+    rows = list(
+        get_changed_rows(cursor, experiments).values_list(
+            'pk', 'last_modified', 'experiment_id', 'variation_id', 'date'
+        )[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], encode_cursor(*cursor[:2]) if cursor else '', False
+
+    keys = {(experiment_id, variation_id, date) for pk, last_modified, experiment_id, variation_id, date in rows}
+    totals = ExperimentHistory.objects.filter(
+        experiment_id__in={key[0] for key in keys},
+        variation_id__in={key[1] for key in keys},
+        date__in={key[2] for key in keys},
+    ).values('experiment_id', 'variation_id', 'date').annotate(
+        participant_count=Sum('participant_count'), completion_count=Sum('completion_count')
+    ).order_by('date', 'experiment_id', 'variation_id')
+
+    changes = [
+        total for total in totals
+        if (total['experiment_id'], total['variation_id'], total['date']) in keys
+    ]
+    next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+    return changes, next_cursor, has_more
@@ -0,0 +1,74 @@
+import signal
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from experiments.backends.collector import Collector
+
+
+class Command(BaseCommand):
+    help = 'Receives the events sent by experiments.backends.collector, ' \
+           'and writes them to the experiment history in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--address',
+            help='UDP address (host:port) or UNIX socket path to listen on. '
+                 'Defaults to WAGTAIL_EXPERIMENTS_COLLECTOR_ADDRESS.',
+        )
+        parser.add_argument(
+            '--flush-interval',
+            type=float,
+            help='Seconds between writes to the database. Defaults to '
+                 'WAGTAIL_EXPERIMENTS_COLLECTOR_FLUSH_INTERVAL, or 5.',
+        )
+
+    def write(self, text):
+        self.stdout.write(text)
+
+    def warn(self, text):
+        decorated = self.style.WARNING(text)
+        self.write(decorated)
+
+    def flush(self, collector):
+        dropped = collector.stats['dropped']
+        close_old_connections()
+        try:
+            count = collector.flush()
+        except Exception as e:
+            return self.warn('Failed to write %d events, will retry: %s' % (collector.pending(), e))
+
+        if count:
+            self.write('Wrote %d events in %.1fms (%d dropped in total).' % (
+                count, collector.stats['last_flush_seconds'] * 1000, dropped
+            ))
+
+    def handle(self, *args, **options):
+        address = options.get('address') or getattr(
+            settings, 'WAGTAIL_EXPERIMENTS_COLLECTOR_ADDRESS', '127.0.0.1:8127'
+        )
+        flush_interval = options.get('flush_interval') or getattr(
+            settings, 'WAGTAIL_EXPERIMENTS_COLLECTOR_FLUSH_INTERVAL', 5
+        )
+
+        collector = Collector(address)
+        collector.bind()
+        self.write('Listening on %s.' % (collector.address, ))
+
+        # write the pending events before exiting when stopped by a process manager
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        try:
+            while True:
+                collector.receive(flush_interval)
+                self.flush(collector)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.flush(collector)
+            collector.close()
+            self.write('Received %(received)d events; %(dropped)d dropped, %(invalid)d invalid, '
+                       '%(discarded)d for deleted experiments or pages; '
+                       'slowest write took %(max_flush_seconds).3fs.' % collector.stats)
@@ -0,0 +1,124 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from experiments.backends import eventlog
+from experiments.counters import exclude_deleted, increment_history_counts
+
+
+COMPACTING_SUFFIX = '.compacting'
+
+
+class Command(BaseCommand):
+    help = 'Adds the events logged by experiments.backends.eventlog ' \
+           'to the experiment history, and archives the log segments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--archive-dir',
+            help='Directory to move compacted segments to. Defaults to '
+                 'the "archive" subdirectory of the event log directory.',
+        )
+        parser.add_argument(
+            '--delete',
+            action='store_true',
+            default=False,
+            help='Delete compacted segments instead of archiving them.',
+        )
+        parser.add_argument(
+            '--seal-orphaned',
+            action='store_true',
+            default=False,
+            help='Seal and compact the active segments of processes on '
+                 'this host that are no longer running.',
+        )
+        parser.add_argument(
+            '--retry-interrupted',
+            action='store_true',
+            default=False,
+            help='Compact segments left behind by an interrupted run. Only '
+                 'use this if that run failed before updating the database, '
+                 'as their events may otherwise be counted twice.',
+        )
+
+    def write(self, text):
+        self.stdout.write(text)
+
+    def warn(self, text):
+        decorated = self.style.WARNING(text)
+        self.write(decorated)
+
+    def yeah(self, text):
+        decorated = self.style.SUCCESS(text)
+        self.write(decorated)
+
+    def handle(self, *args, **options):
+        log_dir = eventlog.get_log_dir()
+        if not os.path.isdir(log_dir):
+            return self.write('Event log directory %s does not exist.' % log_dir)
+
+        archive_dir = options.get('archive_dir') or os.path.join(log_dir, 'archive')
+
+        if options.get('seal_orphaned'):
+            for path in eventlog.seal_orphaned_segments(log_dir):
+                self.warn('Sealed orphaned segment %s.' % os.path.basename(path))
+
+        filenames = sorted(os.listdir(log_dir))
+        interrupted = [filename for filename in filenames if filename.endswith(COMPACTING_SUFFIX)]
+        if interrupted and not options.get('retry_interrupted'):
+            self.warn('Skipping %d segment(s) from an interrupted run; see '
+                      '--retry-interrupted.' % len(interrupted))
+            interrupted = []
+
+        # claim the segments, so that a concurrent run does not compact them too
+        paths = [os.path.join(log_dir, filename) for filename in interrupted]
+        for filename in filenames:
+            if filename.endswith(eventlog.SEALED_SUFFIX):
+                path = os.path.join(log_dir, filename)
+                claimed_path = path + COMPACTING_SUFFIX
+                try:
+                    os.rename(path, claimed_path)
+                except FileNotFoundError:
+                    continue
+                paths.append(claimed_path)
+
+        if not paths:
+            return self.write('No event log segments to compact.')
+
+        counts = {}
+        event_count = 0
+        for path in paths:
+            for experiment_id, variation_id, date, kind, timestamp in eventlog.read_segment(path):
+                participant_count, completion_count = counts.get((experiment_id, variation_id, date), (0, 0))
+                if kind == eventlog.PARTICIPANT:
+                    participant_count += 1
+                elif kind == eventlog.COMPLETION:
+                    completion_count += 1
+                counts[(experiment_id, variation_id, date)] = (participant_count, completion_count)
+                event_count += 1
+
+        # skip events for experiments or pages that have since been deleted
+        counts, deleted = exclude_deleted(counts)
+        skipped = sum(participant_count + completion_count for participant_count, completion_count in deleted.values())
+        increments = [
+            (experiment_id, variation_id, date, participant_count, completion_count)
+            for (experiment_id, variation_id, date), (participant_count, completion_count) in counts.items()
+        ]
+
+        with transaction.atomic():
+            increment_history_counts(increments)
+
+        if skipped:
+            self.warn('Skipped %d events for deleted experiments or pages.' % skipped)
+
+        if not options.get('delete'):
+            os.makedirs(archive_dir, exist_ok=True)
+        for path in paths:
+            if options.get('delete'):
+                os.remove(path)
+            else:
+                filename = os.path.basename(path)[:-len(COMPACTING_SUFFIX)]
+                os.rename(path, os.path.join(archive_dir, filename))
+
+        self.yeah('Compacted %d events from %d segment(s).' % (event_count, len(paths)))
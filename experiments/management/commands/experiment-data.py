@@ -1,9 +1,67 @@
-from datetime import datetime, timedelta
+import random
+from datetime import date, timedelta
 from django.core.management.base import BaseCommand
 from django.core.management.base import CommandError
-from django.db.models import F
-from experiments.models import Experiment, ExperimentHistory
-from random import randrange
+from experiments.counters import increment_history_counts
+from experiments.models import Experiment, ExperimentHistory, ExperimentVariationTotal
+from experiments.report_cache import report_cache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class CountGenerator(object):
+    '''
+        Draws the number of views of each variation on each day uniformly between
+        `min_` and `max_`, and the number of completions from a binomial distribution,
+        using NumPy if it is installed. The same seed gives the same counts, as long
+        as NumPy is or isn't installed in both cases.
+    '''
+
+    def __init__(self, min_, max_, seed=None):
+        self.min = min_
+        self.max = max_
+        if numpy is not None:
+            self.rng = numpy.random.default_rng(seed)
+        else:
+            self.rng = random.Random(seed)
+
+    def binomial(self, n, p):
+        if hasattr(self.rng, 'binomialvariate'):
+            return self.rng.binomialvariate(n, p)
+        return sum(1 for x in range(n) if self.rng.random() < p)
+
+    def generate(self, days, rates):
+        '''
+            Generate the counts for a number of days.
+
+            Args:
+                days:  the number of days.
+                rates: list of the conversion rate of each variation.
+
+            Return:
+                A list with a list of (participant_count, completion_count) tuples for
+                each day, one tuple per variation.
+        '''
+
+        if numpy is not None:
+            participants = self.rng.integers(self.min, self.max + 1, size=(days, len(rates)))
+            completions = self.rng.binomial(participants, rates)
+            return [
+                list(zip(day_participants.tolist(), day_completions.tolist()))
+                for day_participants, day_completions in zip(participants, completions)
+            ]
+
+        counts = []
+        for day in range(0, days):
+            day_counts = []
+            for rate in rates:
+                participant_count = self.rng.randint(self.min, self.max)
+                day_counts.append((participant_count, self.binomial(participant_count, rate)))
+            counts.append(day_counts)
+        return counts
 
 
 class Command(BaseCommand):
@@ -13,11 +71,18 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         # Positional arguments
         parser.add_argument(
-            'slug', help='Slug of the Wagtail Experiment '
-                         'to supply with demo data or to purge '
-                         'of its data.')
+            'slug', nargs='*', help='Slugs of the Wagtail Experiments '
+                                    'to supply with demo data or to purge '
+                                    'of their data.')
 
         # Named (optional) arguments
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            default=False,
+            help='Supply all experiments with demo data, '
+                 'or purge all of their data.',
+        )
         parser.add_argument(
             '--days',
             type=int,
@@ -39,6 +104,19 @@ class Command(BaseCommand):
             help='Maximum number of session views for a '
                  'variation.',
         )
+        parser.add_argument(
+            '--rates',
+            help='Comma-separated conversion rates of the control '
+                 'page and each alternative, such as 0.25,0.3. The last '
+                 'rate is used for any further alternatives. Defaults '
+                 'to 0.25 for the control page and 0.33 for alternatives.',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            help='Seed for the random number generator, to create '
+                 'the same data every time.',
+        )
         parser.add_argument(
             '--purge',
             action='store_true',
@@ -62,67 +140,74 @@ class Command(BaseCommand):
         decorated = self.style.SUCCESS(text)
         self.write(decorated)
 
+    def get_rates(self, option, variation_count):
+        if not option:
+            return [0.25] + [0.33] * (variation_count - 1)
+
+        try:
+            rates = [float(rate) for rate in option.split(',')]
+        except ValueError:
+            raise CommandError('--rates must be a comma-separated list of numbers.')
+        if not all(0 <= rate <= 1 for rate in rates):
+            raise CommandError('Conversion rates must be between 0 and 1.')
+        return (rates + rates[-1:] * variation_count)[:variation_count]
+
     def handle(self, *args, **options):
-        slug = options.get('slug', '')
+        slugs = options.get('slug', [])
         purge = options.get('purge', False)
         days = options.get('days', 10)
         min_ = options.get('min', 100)
         max_ = options.get('max', 150)
 
-        # Get the experiment by its slug
-        try:
-            experiment = Experiment.objects.get(slug=slug)
-        except Experiment.DoesNotExist:
-            return self.oops('No experiment with slug %s found. '
-                             'Did you create it?' % slug)
-
-        history = experiment.history.exists()
+        if options.get('all'):
+            experiments = list(Experiment.objects.order_by('pk'))
+        elif slugs:
+            experiments = list(Experiment.objects.filter(slug__in=slugs).order_by('pk'))
+            missing = set(slugs) - {experiment.slug for experiment in experiments}
+            if missing:
+                return self.oops('No experiment with slug %s found. '
+                                 'Did you create it?' % ', '.join(sorted(missing)))
+        else:
+            raise CommandError('Give the slugs of the experiments, or --all.')
+        if not 0 <= min_ <= max_:
+            raise CommandError('--min must be at most --max.')
 
         # If --purge: purge and quit
         if purge:
-            if not history:
-                return self.write('Experiment %s has no history data to '
-                                  'purge.' % experiment)
-            ExperimentHistory.objects.filter(experiment=experiment).delete()
-            return self.yeah('Deleted all history data for %s.' % experiment)
+            for experiment in experiments:
+                if not experiment.history.exists():
+                    self.write('Experiment %s has no history data to '
+                               'purge.' % experiment)
+                    continue
+                ExperimentHistory.objects.filter(experiment=experiment).delete()
+                ExperimentVariationTotal.objects.filter(experiment=experiment).delete()
+                report_cache.invalidate(experiment.pk)
+                self.yeah('Deleted all history data for %s.' % experiment)
+            return
 
         # If not --purge: create demo data
-        self.write('Creating demo history data for experiment '
-                   '%s...' % experiment)
-        self.write('Control pages will have a conversion rate of 1/4, '
-                   'whereas other variations will have a rate of 1/3.')
-        history and self.warn('Mind the already existing history data '
-                              'for this experiment.')
-
-        variations = experiment.get_variations()
-        control = experiment.control_page
-
-        for variation in variations:
-            for day in range(0, days):
-                date = datetime.now() - timedelta(days=day)
-                hist_range = range(0, randrange(min_, max_ + 1))
-                self.write('Adding %s views at %s for page %s...' %
-                           (len(hist_range),
-                            date.strftime('%b %d'),
-                            variation))
-                for x in hist_range:
-                    history, _ = ExperimentHistory.objects.get_or_create(
-                        experiment=experiment, variation=variation, date=date)
-
-                    # Increment the participant_count
-                    ExperimentHistory.objects.filter(pk=history.pk).update(
-                        participant_count=F('participant_count') + 1)
-
-                    if variation == control:
-                        # Make the control page less likely to complete
-                        if randrange(0, 4) == 1:
-                            ExperimentHistory.objects.filter(pk=history.pk) \
-                                .update(
-                                    completion_count=F('completion_count') + 1)
-                    else:
-                        if randrange(0, 3) == 1:
-                            ExperimentHistory.objects.filter(pk=history.pk) \
-                                .update(
-                                    completion_count=F('completion_count') + 1)
-
-        self.yeah('All done creating data for experiment %s.' % experiment)
+        generator = CountGenerator(min_, max_, options.get('seed'))
+        today = date.today()
+
+        for experiment in experiments:
+            variation_ids = experiment.get_variation_ids()
+            rates = self.get_rates(options.get('rates'), len(variation_ids))
+
+            self.write('Creating demo history data for experiment '
+                       '%s...' % experiment)
+            self.write('Variations will have conversion rates of %s.' %
+                       ', '.join('%g' % rate for rate in rates))
+            experiment.history.exists() and self.warn(
+                'Mind the already existing history data for this experiment.')
+
+            counts = generator.generate(days, rates)
+            increment_history_counts(
+                (experiment.pk, variation_id, today - timedelta(days=day), participant_count, completion_count)
+                for day, day_counts in enumerate(counts)
+                for variation_id, (participant_count, completion_count) in zip(variation_ids, day_counts)
+            )
+            self.write('Added %d views over %d days.' % (
+                sum(participant_count for day_counts in counts for participant_count, _ in day_counts), days
+            ))
+
+        self.yeah('All done creating data for %s.' % ', '.join(str(experiment) for experiment in experiments))
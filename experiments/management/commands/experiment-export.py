@@ -0,0 +1,135 @@
+import csv
+import gzip
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from experiments.models import Experiment, ExperimentHistory
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+COLUMNS = ['id', 'experiment_id', 'variation_id', 'date', 'shard', 'participant_count', 'completion_count']
+
+
+class ParquetWriter(object):
+    '''
+        Writes each chunk of history rows to a Parquet file as a row group.
+    '''
+
+    def __init__(self, path):
+        self.schema = pyarrow.schema([
+            ('id', pyarrow.int64()),
+            ('experiment_id', pyarrow.int32()),
+            ('variation_id', pyarrow.int32()),
+            ('date', pyarrow.date32()),
+            ('shard', pyarrow.int16()),
+            ('participant_count', pyarrow.int64()),
+            ('completion_count', pyarrow.int64()),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        self.writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema,
+        ))
+
+    def close(self):
+        self.writer.close()
+
+
+class CSVWriter(object):
+    '''
+        Writes history rows to a CSV file, compressed with gzip if the path ends in '.gz'.
+    '''
+
+    def __init__(self, path):
+        if path.endswith('.gz'):
+            self.file = gzip.open(path, 'wt', newline='')
+        else:
+            self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class Command(BaseCommand):
+    help = 'Exports the daily history of Wagtail Experiments ' \
+           '(A/B Testing) to a Parquet or CSV file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output',
+            help='Path of the file to write.',
+        )
+        parser.add_argument(
+            'slug',
+            nargs='*',
+            help='Slugs of the experiments to export. Defaults to all experiments.',
+        )
+        parser.add_argument(
+            '--format',
+            choices=['parquet', 'csv'],
+            help='File format. Defaults to parquet if pyarrow is installed, '
+                 'and csv otherwise.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=100000,
+            help='Number of rows to read from the database, and to write to '
+                 'each Parquet row group, at a time.',
+        )
+
+    def write(self, text):
+        self.stdout.write(text)
+
+    def yeah(self, text):
+        decorated = self.style.SUCCESS(text)
+        self.write(decorated)
+
+    def handle(self, *args, **options):
+        export_format = options.get('format') or ('parquet' if pyarrow is not None else 'csv')
+        if export_format == 'parquet' and pyarrow is None:
+            raise CommandError('Exporting to Parquet requires the pyarrow package.')
+
+        history = ExperimentHistory.objects.all()
+        if options.get('slug'):
+            experiments = Experiment.objects.filter(slug__in=options['slug'])
+            if not experiments:
+                raise CommandError('No experiments found with slug(s) %s.' % ', '.join(options['slug']))
+            history = history.filter(experiment__in=experiments)
+
+        started = time.monotonic()
+        writer = (ParquetWriter if export_format == 'parquet' else CSVWriter)(options['output'])
+        row_count = 0
+        last_id = 0
+        try:
+            # page through the table by primary key, which stays fast however far through
+            # the table we are, unlike OFFSET
+            while True:
+                rows = list(
+                    history.filter(pk__gt=last_id).order_by('pk').values_list(*COLUMNS)[:options['chunk_size']]
+                )
+                if not rows:
+                    break
+                writer.write(rows)
+                row_count += len(rows)
+                last_id = rows[-1][0]
+        finally:
+            writer.close()
+
+        self.yeah('Exported %d history rows to %s in %.1fs.' % (
+            row_count, options['output'], time.monotonic() - started
+        ))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from experiments.backends import cache
+from experiments.models import Experiment
+
+
+class Command(BaseCommand):
+    help = 'Moves the participant and completion counts held in the cache by ' \
+           'experiments.backends.cache to the experiment history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'experiment_slug',
+            nargs='*',
+            help='Only flush the counts of these experiments.',
+        )
+
+    def write(self, text):
+        self.stdout.write(text)
+
+    def yeah(self, text):
+        decorated = self.style.SUCCESS(text)
+        self.write(decorated)
+
+    def handle(self, *args, **options):
+        experiments = Experiment.objects.exclude(status='draft')
+        if options.get('experiment_slug'):
+            experiments = experiments.filter(slug__in=options['experiment_slug'])
+
+        count = cache.flush(experiments)
+        if count:
+            self.yeah('Flushed %d participants and completions.' % count)
+        else:
+            self.write('No counts to flush.')
@@ -0,0 +1,37 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from experiments.counters import fold_shards
+
+
+class Command(BaseCommand):
+    help = 'Folds the sharded experiment history rows of past days into a single row ' \
+           'per variation and day.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before',
+            help='Fold rows dated before this day (YYYY-MM-DD). Defaults to today.',
+        )
+
+    def write(self, text):
+        self.stdout.write(text)
+
+    def yeah(self, text):
+        decorated = self.style.SUCCESS(text)
+        self.write(decorated)
+
+    def handle(self, *args, **options):
+        before = datetime.date.today()
+        if options.get('before'):
+            try:
+                before = datetime.datetime.strptime(options['before'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--before must be a date in YYYY-MM-DD format.')
+
+        count = fold_shards(before)
+        if count:
+            self.yeah('Folded %d sharded history rows.' % count)
+        else:
+            self.write('No sharded history rows to fold.')
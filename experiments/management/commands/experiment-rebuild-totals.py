@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from experiments.counters import rebuild_totals
+from experiments.models import Experiment
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the running participant and completion totals of experiments ' \
+           'from their daily history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'experiment_slug',
+            nargs='*',
+            help='Only rebuild the totals of these experiments.',
+        )
+
+    def write(self, text):
+        self.stdout.write(text)
+
+    def yeah(self, text):
+        decorated = self.style.SUCCESS(text)
+        self.write(decorated)
+
+    def handle(self, *args, **options):
+        experiments = Experiment.objects.all()
+        if options.get('experiment_slug'):
+            experiments = experiments.filter(slug__in=options['experiment_slug'])
+
+        count = rebuild_totals(experiments)
+        self.yeah('Rebuilt %d variation totals.' % count)
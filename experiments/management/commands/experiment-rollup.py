@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from experiments.backends import events
+from experiments.models import Experiment
+
+
+class Command(BaseCommand):
+    help = 'Adds the events recorded by experiments.backends.events ' \
+           'since the last rollup to the experiment history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lag',
+            type=int,
+            default=None,
+            help='Leave events newer than this many seconds for the next rollup. Defaults to '
+                 'WAGTAIL_EXPERIMENTS_EVENT_ROLLUP_LAG, or 60.',
+        )
+        parser.add_argument(
+            '--rebuild',
+            nargs='*',
+            metavar='EXPERIMENT_SLUG',
+            help='Replace the history of these experiments (or of every experiment with events, '
+                 'if none are given) with counts rebuilt from the events already rolled up.',
+        )
+
+    def write(self, text):
+        self.stdout.write(text)
+
+    def yeah(self, text):
+        decorated = self.style.SUCCESS(text)
+        self.write(decorated)
+
+    def handle(self, *args, **options):
+        if options.get('rebuild') is not None:
+            experiments = Experiment.objects.filter(pk__in=events.ExperimentEvent.objects.values('experiment_id'))
+            if options['rebuild']:
+                experiments = experiments.filter(slug__in=options['rebuild'])
+            count = events.rebuild_history(experiments)
+            return self.yeah('Rebuilt experiment history from %d events.' % count)
+
+        lag = options.get('lag')
+        if lag is None:
+            lag = getattr(settings, 'WAGTAIL_EXPERIMENTS_EVENT_ROLLUP_LAG', 60)
+
+        count = events.roll_up_events(lag=lag)
+        if count:
+            self.yeah('Rolled up %d events.' % count)
+        else:
+            self.write('No new events to roll up.')
@@ -0,0 +1,49 @@
+from django.conf import settings
+
+
+class ParticipantStateMiddleware(object):
+    '''
+        Save the experiment state of the user on the response, for participant state
+        stores that keep it in a cookie (such as experiments.state.SignedCookieParticipantState).
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        state = getattr(request, '_experiments_participant_state', None)
+        if state is not None:
+            state.save(response)
+
+        return response
+
+
+class ServerTimingMiddleware(object):
+    '''
+        Add the times taken by the phases of serving experiment pages to a Server-Timing
+        response header, when WAGTAIL_EXPERIMENTS_SERVER_TIMING is True (it defaults to
+        the value of DEBUG).
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'WAGTAIL_EXPERIMENTS_SERVER_TIMING', settings.DEBUG):
+            return self.get_response(request)
+
+        # filled in by experiments.timing.span
+        request._experiments_timings = {}
+        response = self.get_response(request)
+
+        if request._experiments_timings:
+            metrics = ', '.join(
+                '%s;dur=%.3f' % (name, duration * 1000) for name, duration in request._experiments_timings.items()
+            )
+            if response.has_header('Server-Timing'):
+                metrics = response['Server-Timing'] + ', ' + metrics
+            response['Server-Timing'] = metrics
+
+        return response
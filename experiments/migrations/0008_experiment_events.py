@@ -0,0 +1,43 @@
+# Generated by Django 5.0.14 on 2026-10-18 09:58
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiments', '0007_alternative_revision'),
+        ('wagtailcore', '0078_referenceindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExperimentEventRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_event_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'experiment event rollup',
+                'verbose_name_plural': 'experiment event rollups',
+            },
+        ),
+        migrations.CreateModel(
+            name='ExperimentEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('participant', 'Participant'), ('completion', 'Completion')], max_length=20)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user_hash', models.CharField(max_length=40)),
+                ('experiment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='experiments.experiment')),
+                ('variation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.page')),
+            ],
+            options={
+                'verbose_name': 'experiment event',
+                'verbose_name_plural': 'experiment events',
+            },
+        ),
+    ]
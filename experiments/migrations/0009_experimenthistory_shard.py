@@ -0,0 +1,22 @@
+# Generated by Django 5.0.14 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("experiments", "0008_experiment_events"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="experimenthistory",
+            name="shard",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AlterUniqueTogether(
+            name="experimenthistory",
+            unique_together={("experiment", "date", "variation", "shard")},
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiments', '0009_experimenthistory_shard'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='experimenthistory',
+            index=models.Index(fields=['experiment', 'variation', 'date'], name='experiments_history_report'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_totals(apps, schema_editor):
+    ExperimentHistory = apps.get_model('experiments', 'ExperimentHistory')
+    ExperimentVariationTotal = apps.get_model('experiments', 'ExperimentVariationTotal')
+    db_alias = schema_editor.connection.alias
+
+    ExperimentVariationTotal.objects.using(db_alias).bulk_create([
+        ExperimentVariationTotal(shard=0, **row)
+        for row in ExperimentHistory.objects.using(db_alias).values('experiment_id', 'variation_id').annotate(
+            participant_count=Sum('participant_count'), completion_count=Sum('completion_count')
+        ).order_by()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiments', '0010_access_path_indexes'),
+        ('wagtailcore', '0078_referenceindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExperimentVariationTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('participant_count', models.PositiveIntegerField(default=0)),
+                ('completion_count', models.PositiveIntegerField(default=0)),
+                ('experiment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='totals', to='experiments.experiment')),
+                ('variation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.page')),
+            ],
+            options={
+                'verbose_name': 'experiment variation total',
+                'verbose_name_plural': 'experiment variation totals',
+                'unique_together': {('experiment', 'variation', 'shard')},
+            },
+        ),
+        migrations.RunPython(populate_totals, migrations.RunPython.noop),
+    ]
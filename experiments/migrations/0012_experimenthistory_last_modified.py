@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:21
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiments', '0011_experimentvariationtotal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experimenthistory',
+            name='last_modified',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='experimenthistory',
+            index=models.Index(fields=['last_modified', 'id'], name='experiments_history_modified'),
+        ),
+    ]
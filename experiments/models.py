@@ -1,18 +1,28 @@
+from collections import namedtuple
 from hashlib import sha1
 from importlib import import_module
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from wagtail.admin.panels import FieldPanel, PageChooserPanel, InlinePanel
-from wagtail.models import Orderable, Page
+from wagtail.models import Orderable, Page, Revision
 
 from modelcluster.fields import ParentalKey
 from modelcluster.models import ClusterableModel
 
+from .timing import span
+from .utils import get_remembered_variation_id, remember_variation
+from .variation_cache import variation_cache
+
 
 BACKEND = None
 
+# Identifies a variation without loading it. `alternative_id` is None for the control page, and
+# `revision_id` is set when the variation is served from a revision of a page that is not live.
+VariationReference = namedtuple('VariationReference', ['page_id', 'alternative_id', 'revision_id'])
+
 
 def get_backend():
     '''
@@ -34,6 +44,54 @@ def get_backend():
     return BACKEND
 
 
+def record_completions_for_user(experiments, user_id, request):
+    '''
+        Record the completion of several experiments for the user, such as when
+        a page is the goal of more than one experiment.
+
+        Args:
+            experiments: iterable of experiments.models.Experiment instances
+            user_id:     the id for this user
+            request:     django HttpRequest
+
+        Return:
+            Nothing
+
+        Backends that provide a record_completions function receive all the experiments
+        in one call; otherwise record_completion is called for each experiment.
+    '''
+
+    backend = get_backend()
+    if hasattr(backend, 'record_completions'):
+        with span('record_completions', request):
+            backend.record_completions(list(experiments), user_id, request)
+    else:
+        for experiment in experiments:
+            experiment.record_completion_for_user(user_id, request)
+
+
+def get_variation_ids_for_experiments(experiments):
+    '''
+        Get the page IDs of the variations of several experiments in a single query.
+
+        Args:
+            experiments: iterable of experiments.models.Experiment instances
+
+        Return:
+            A dict mapping the ID of each experiment to a list of its variation IDs,
+            in the same order as Experiment.get_variation_ids.
+    '''
+
+    variation_ids = {experiment.pk: [experiment.control_page_id] for experiment in experiments}
+    if variation_ids:
+        for experiment_id, page_id in Alternative.objects.filter(
+            experiment__in=list(variation_ids)
+        ).values_list('experiment_id', 'page_id'):
+            variation_ids[experiment_id].append(page_id)
+
+    return variation_ids
+
+
 class Experiment(ClusterableModel):
     '''
         Define an experiment for a page.
@@ -84,6 +142,8 @@ class Experiment(ClusterableModel):
                 Nothing
         '''
 
+        self.invalidate_variations()
+
         for alternative in self.alternatives.select_related('page'):
             if alternative.page.live:
                 alternative.revision = alternative.page.live_revision
@@ -103,35 +163,153 @@ class Experiment(ClusterableModel):
         '''
 
         variations = [self.control_page]
-        for alternative in self.alternatives.select_related('page', 'revision'):
-            if alternative.revision and not alternative.page.live:
+        for alternative in self.alternatives.select_related('page'):
+            if alternative.revision_id and not alternative.page.live:
                 # retrieve the version of the page indicated by the revision, so that we're
                 # not reflecting drafts that have been made since the experiment was created
-                variations.append(alternative.revision.as_object())
+                variations.append(variation_cache.get(
+                    self.pk, alternative.pk, alternative.revision_id, lambda: alternative.revision.as_object()
+                ))
             else:
                 variations.append(alternative.page)
 
         return variations
 
-    def get_variation_for_user(self, user_id):
+    def invalidate_variations(self):
+        '''
+            Discard the cached page objects built from the revisions of this experiment's
+            alternatives.
+
+            Return:
+                Nothing
         '''
-            Get a page variation for this user and request session.
+
+        variation_cache.invalidate(self.pk, self.alternatives.values_list('id', 'revision_id'))
+
+    def get_variation_ids(self):
+        '''
+            Get the page IDs of all the variations, without loading the pages.
+
+            Return:
+                variation_ids: a list with the ID of the control page followed by
+                the page IDs of all alternatives
+        '''
+
+        return [self.control_page_id] + list(self.alternatives.values_list('page_id', flat=True))
+
+    def get_variation_references(self):
+        '''
+            Get lightweight references to all the variations, in the same order as
+            get_variations, without loading any pages or revisions.
+
+            Return:
+                references: a list of VariationReference tuples for the control page
+                and all alternatives
+        '''
+
+        references = [VariationReference(self.control_page_id, None, None)]
+        for alternative_id, page_id, revision_id, live in self.alternatives.values_list(
+            'id', 'page_id', 'revision_id', 'page__live'
+        ):
+            references.append(VariationReference(page_id, alternative_id, None if live else revision_id))
+
+        return references
+
+    def get_variation(self, reference):
+        '''
+            Load the page for a single variation.
 
             Args:
-                user_id: the id for this user
+                reference: a VariationReference, as returned by get_variation_references
 
             Return:
                 variation: a page variation
         '''
 
-        variations = self.get_variations()
+        if reference.alternative_id is None:
+            return self.control_page
+
+        if reference.revision_id is not None:
+            # retrieve the version of the page indicated by the revision, so that we're
+            # not reflecting drafts that have been made since the experiment was created
+            return variation_cache.get(
+                self.pk, reference.alternative_id, reference.revision_id,
+                lambda: Revision.objects.get(pk=reference.revision_id).as_object()
+            )
+
+        return Page.objects.get(pk=reference.page_id)
+
+    def get_variation_reference_for_user(self, user_id):
+        '''
+            Choose the variation for this user, without loading any pages.
+
+            Args:
+                user_id: the id for this user
+
+            Return:
+                reference: a VariationReference for the chosen variation
+        '''
+
+        references = self.get_variation_references()
+        return references[self.get_variation_index_for_user(user_id, len(references))]
+
+    def get_variation_index_for_user(self, user_id, variation_count):
+        '''
+            Choose the position of this user's variation among all the variations.
+
+            Args:
+                user_id:         the id for this user
+                variation_count: the number of variations, including the control page
+
+            Return:
+                The index of the variation, in the order of get_variation_ids
+        '''
 
         # choose uniformly from variations, based on a hash of user_id and experiment.slug
         hash_input = "{0}.{1}".format(self.slug, user_id)
         hash_str = sha1(hash_input.encode('utf-8')).hexdigest()[:7]
-        variation_index = int(hash_str, 16) % len(variations)
+        return int(hash_str, 16) % variation_count
 
-        return variations[variation_index]
+    def get_variation_for_user(self, user_id):
+        '''
+            Get a page variation for this user and request session. Only the
+            chosen variation is loaded.
+
+            Args:
+                user_id: the id for this user
+
+            Return:
+                variation: a page variation
+        '''
+
+        return self.get_variation(self.get_variation_reference_for_user(user_id))
+
+    def get_assigned_variation(self, user_id, request, variation_ids=None):
+        '''
+            Get the variation previously served to this user, without loading the page.
+
+            Args:
+                user_id:       the id for this user
+                request:       django HttpRequest
+                variation_ids: optional list of the experiment's variation IDs, as returned
+                               by get_variation_ids, when they have already been loaded
+
+            Return:
+                An unsaved Page instance with only its primary key populated, which is
+                all that backends need to identify the variation.
+
+            A remembered variation is only used if it is still one of the experiment's
+            variations, as its page may have been deleted or removed from the experiment.
+        '''
+
+        if variation_ids is None:
+            variation_ids = self.get_variation_ids()
+
+        variation_id = get_remembered_variation_id(self, request)
+        if variation_id is None or variation_id not in variation_ids:
+            variation_id = variation_ids[self.get_variation_index_for_user(user_id, len(variation_ids))]
+
+        return Page(pk=variation_id)
 
     def start_experiment_for_user(self, user_id, request):
         '''
@@ -145,8 +323,13 @@ class Experiment(ClusterableModel):
                 Variation the user will see
         '''
 
-        variation = self.get_variation_for_user(user_id)
-        get_backend().record_participant(self, user_id, variation, request)
+        with span('choose_variation', request):
+            reference = self.get_variation_reference_for_user(user_id)
+        with span('load_variation', request):
+            variation = self.get_variation(reference)
+        remember_variation(self, variation.pk, request)
+        with span('record_participant', request):
+            get_backend().record_participant(self, user_id, variation, request)
         return variation
 
     def record_completion_for_user(self, user_id, request):
@@ -171,8 +354,10 @@ class Experiment(ClusterableModel):
         '''
 
         backend = get_backend()
-        variation = self.get_variation_for_user(user_id)
-        backend.record_completion(self, user_id, variation, request)
+        with span('assigned_variation', request):
+            variation = self.get_assigned_variation(user_id, request)
+        with span('record_completion', request):
+            backend.record_completion(self, user_id, variation, request)
 
     def select_winner(self, variation):
         '''
@@ -215,18 +400,90 @@ class ExperimentHistory(models.Model):
     '''
         Maintains the number of participants and completions
         on a given day for a given variation of an experiment.
+
+        With WAGTAIL_EXPERIMENTS_HISTORY_SHARDS set, the counts for a day may be
+        split over several rows, distinguished by `shard`, which must be summed.
+        `last_modified` is updated whenever the counts change.
     '''
 
     experiment = models.ForeignKey(Experiment, related_name='history', on_delete=models.CASCADE)
     date = models.DateField()
     variation = models.ForeignKey('wagtailcore.Page', related_name='+', on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField(default=0)
     participant_count = models.PositiveIntegerField(default=0)
     completion_count = models.PositiveIntegerField(default=0)
+    last_modified = models.DateTimeField(default=timezone.now)
 
     class Meta:
         unique_together = [
-            ('experiment', 'date', 'variation'),
+            ('experiment', 'date', 'variation', 'shard'),
+        ]
+        indexes = [
+            # for reports, which add up the counts of each variation by date
+            models.Index(fields=['experiment', 'variation', 'date'], name='experiments_history_report'),
+            # for the history feed, which pages through rows by modification time
+            models.Index(fields=['last_modified', 'id'], name='experiments_history_modified'),
         ]
 
         verbose_name = _('experiment history')
         verbose_name_plural = _('experiment histories')
+
+
+class ExperimentVariationTotal(models.Model):
+    '''
+        Maintains the total number of participants and completions for a variation of an
+        experiment, updated in the same transaction as ExperimentHistory. Like the history,
+        the totals may be split over several shards, which must be summed.
+    '''
+
+    experiment = models.ForeignKey(Experiment, related_name='totals', on_delete=models.CASCADE)
+    variation = models.ForeignKey('wagtailcore.Page', related_name='+', on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField(default=0)
+    participant_count = models.PositiveIntegerField(default=0)
+    completion_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [
+            ('experiment', 'variation', 'shard'),
+        ]
+
+        verbose_name = _('experiment variation total')
+        verbose_name_plural = _('experiment variation totals')
+
+
+class ExperimentEvent(models.Model):
+    '''
+        A single participant or completion, as recorded by the
+        experiments.backends.events backend. Events are only ever inserted,
+        and are rolled up into ExperimentHistory by the experiment-rollup command.
+    '''
+
+    KIND_CHOICES = [
+        ('participant', _("Participant")),
+        ('completion', _("Completion")),
+    ]
+    id = models.BigAutoField(primary_key=True)
+    experiment = models.ForeignKey(Experiment, related_name='events', on_delete=models.CASCADE)
+    variation = models.ForeignKey('wagtailcore.Page', related_name='+', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    timestamp = models.DateTimeField(default=timezone.now)
+    user_hash = models.CharField(max_length=40)
+
+    class Meta:
+        verbose_name = _('experiment event')
+        verbose_name_plural = _('experiment events')
+
+
+class ExperimentEventRollup(models.Model):
+    '''
+        Records how far the experiment-rollup command has got through ExperimentEvent:
+        all events with an ID up to and including last_event_id are counted in
+        ExperimentHistory.
+    '''
+
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _('experiment event rollup')
+        verbose_name_plural = _('experiment event rollups')
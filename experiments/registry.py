@@ -0,0 +1,149 @@
+import copy
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+from .models import Experiment
+from .utils import get_cache
+
+
+VERSION_CACHE_KEY = 'wagtail-experiments:registry-version'
+
+
+class ExperimentRegistry(object):
+    '''
+        Per-process index of the experiments that can affect page serving.
+
+        Live and completed experiments are loaded in a single query the first time
+        they are needed, and indexed by control page and goal page so that pages
+        which are not part of any experiment can be served without touching the
+        database. A version stamp held in the shared cache is checked on each lookup;
+        when an experiment or alternative changes anywhere, the stamp is replaced
+        and every process rebuilds its index on the next lookup. As the stamp only reaches
+        other processes through a shared cache, the index is also rebuilt once it is
+        WAGTAIL_EXPERIMENTS_REGISTRY_TTL seconds old (default 60; None disables this).
+
+        Only the experiments themselves are indexed, not their pages, and each lookup
+        returns copies of them, so that pages loaded while serving a request are not
+        kept or shared between requests.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._loaded_at = None
+        self._by_control_page = None
+        self._by_goal = None
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'WAGTAIL_EXPERIMENTS_REGISTRY_TTL', 60)
+
+    def _is_current(self, version):
+        if self._by_control_page is None or version != self._version:
+            return False
+        ttl = self.ttl
+        return ttl is None or time.monotonic() - self._loaded_at < ttl
+
+    def _get_shared_version(self):
+        cache = get_cache()
+        version = cache.get(VERSION_CACHE_KEY)
+        if version is None:
+            cache.add(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+            version = cache.get(VERSION_CACHE_KEY)
+        return version
+
+    def _load(self):
+        version = self._get_shared_version()
+        if self._is_current(version):
+            return self._by_control_page, self._by_goal
+
+        with self._lock:
+            if self._is_current(version):
+                return self._by_control_page, self._by_goal
+
+            by_control_page = {}
+            by_goal = {}
+            experiments = Experiment.objects.filter(status__in=('live', 'completed')).order_by('pk')
+
+            for experiment in experiments:
+                by_control_page.setdefault(experiment.control_page_id, []).append(experiment)
+                if experiment.status == 'live' and experiment.goal_id is not None:
+                    by_goal.setdefault(experiment.goal_id, []).append(experiment)
+
+            self._by_control_page, self._by_goal = by_control_page, by_goal
+            self._version = version
+            self._loaded_at = time.monotonic()
+            return by_control_page, by_goal
+
+    def get_experiments_for_page(self, page_id):
+        '''
+            Get the experiments using this page as the goal page or the control page,
+            checking the shared version stamp once for both.
+
+            Args:
+                page_id: the primary key of the page.
+
+            Return:
+                A (goal_experiments, control_experiments) tuple of lists, as returned by
+                get_experiments_for_goal and get_experiments_for_control_page.
+        '''
+
+        by_control_page, by_goal = self._load()
+        return (
+            [copy.copy(experiment) for experiment in by_goal.get(page_id, [])],
+            [copy.copy(experiment) for experiment in by_control_page.get(page_id, [])],
+        )
+
+    def get_experiments_for_control_page(self, page_id):
+        '''
+            Get the live or completed experiments using this page as the control page.
+
+            Args:
+                page_id: the primary key of the page.
+
+            Return:
+                A list of experiments, in order of creation.
+        '''
+
+        by_control_page, _ = self._load()
+        return [copy.copy(experiment) for experiment in by_control_page.get(page_id, [])]
+
+    def get_experiments_for_goal(self, page_id):
+        '''
+            Get the live experiments using this page as the goal page.
+
+            Args:
+                page_id: the primary key of the page.
+
+            Return:
+                A list of experiments, in order of creation.
+        '''
+
+        _, by_goal = self._load()
+        return [copy.copy(experiment) for experiment in by_goal.get(page_id, [])]
+
+    def clear(self):
+        '''
+            Discard this process's index, so that it is rebuilt on the next lookup.
+        '''
+
+        with self._lock:
+            self._by_control_page = None
+            self._by_goal = None
+            self._version = None
+            self._loaded_at = None
+
+    def invalidate(self):
+        '''
+            Discard the index in this process and, through the shared version stamp,
+            in every other process using the same cache.
+        '''
+
+        self.clear()
+        get_cache().set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+registry = ExperimentRegistry()
@@ -0,0 +1,74 @@
+import datetime
+
+from django.conf import settings
+
+from .utils import get_cache
+
+
+class ReportCache(object):
+    '''
+        Cache of the daily history of each experiment's variations, as shown in reports.
+
+        The history is stored in the Django cache for WAGTAIL_EXPERIMENTS_REPORT_CACHE_TIMEOUT
+        seconds (default 1 day; 0 disables it), along with the day it was computed. Later
+        reports only aggregate the rows dated on or after that day, which are the only ones
+        backends normally write to, and merge them into the cached history. Writes to
+        earlier days must invalidate the experiment's entry.
+    '''
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'WAGTAIL_EXPERIMENTS_REPORT_CACHE_TIMEOUT', 24 * 3600)
+
+    def get_cache_key(self, experiment_id):
+        return 'wagtail-experiments:report:{0}'.format(experiment_id)
+
+    def get(self, experiment_id, load):
+        '''
+            Get the history of an experiment, refreshing it from the database.
+
+            Args:
+                experiment_id: the primary key of the experiment.
+                load:          function taking a date (or None, for all dates), and returning
+                               the history from that date as a dict of lists of history entries,
+                               ordered by date, keyed by variation ID.
+
+            Return:
+                A dict of lists of history entries, ordered by date, keyed by variation ID.
+        '''
+
+        if not self.timeout:
+            return load(None)
+
+        cache = get_cache()
+        key = self.get_cache_key(experiment_id)
+        today = datetime.date.today()
+
+        cached = cache.get(key)
+        if cached is None:
+            history_by_variation = load(None)
+        else:
+            since = cached['date']
+            history_by_variation = {
+                variation_id: [entry for entry in history if entry['date'] < since]
+                for variation_id, history in cached['history'].items()
+            }
+            for variation_id, history in load(since).items():
+                history_by_variation.setdefault(variation_id, []).extend(history)
+
+        cache.set(key, {'date': today, 'history': history_by_variation}, self.timeout)
+        return history_by_variation
+
+    def invalidate(self, *experiment_ids):
+        '''
+            Discard the cached history of the given experiments.
+
+            Return:
+                Nothing
+        '''
+
+        if experiment_ids:
+            get_cache().delete_many([self.get_cache_key(experiment_id) for experiment_id in experiment_ids])
+
+
+report_cache = ReportCache()
@@ -0,0 +1,62 @@
+from django.core.signals import request_finished, setting_changed
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from .deferred import writer
+from .models import Alternative, Experiment
+from .registry import registry
+from .report_cache import report_cache
+from .timing import reset_sink
+
+
+def invalidate_registry(**kwargs):
+    '''
+        Discard the experiment registry in all processes when an experiment or
+        alternative changes. The registry is invalidated again once the transaction
+        commits, so that a process which rebuilt it in the meantime does not keep
+        a view of the database from before the change.
+    '''
+
+    registry.invalidate()
+    transaction.on_commit(registry.invalidate)
+
+
+def invalidate_variations(instance, **kwargs):
+    '''
+        Discard the cached alternative page objects of an experiment when it is saved.
+    '''
+
+    instance.invalidate_variations()
+
+
+def invalidate_report(instance, **kwargs):
+    '''
+        Discard the cached report history of an experiment when it is saved, such as
+        when a winner is selected, or deleted.
+    '''
+
+    report_cache.invalidate(instance.pk)
+
+
+def reset_timing_sink(setting, **kwargs):
+    '''
+        Create the timing sink again when its setting is overridden, such as in tests.
+    '''
+
+    if setting in ('WAGTAIL_EXPERIMENTS_TIMING_SINK', 'WAGTAIL_EXPERIMENTS_TIMING_SAMPLES'):
+        reset_sink()
+
+
+def register_signal_handlers():
+    for model in (Experiment, Alternative):
+        post_save.connect(invalidate_registry, sender=model)
+        post_delete.connect(invalidate_registry, sender=model)
+
+    post_save.connect(invalidate_variations, sender=Experiment)
+    post_save.connect(invalidate_report, sender=Experiment)
+    post_delete.connect(invalidate_report, sender=Experiment)
+
+    # run writes deferred until the response has been sent
+    request_finished.connect(writer.run_pending)
+
+    setting_changed.connect(reset_timing_sink)
@@ -0,0 +1,154 @@
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.utils.module_loading import import_string
+
+
+class SessionParticipantState(object):
+    '''
+        Keeps a user's experiment state in their Django session: the user ID used to
+        assign variations, the experiments they have started and completed, and the
+        variation they were assigned in each experiment.
+    '''
+
+    def __init__(self, request):
+        self.session = request.session
+
+    def get_user_id(self):
+        return self.session.setdefault('experiment_user_id', str(uuid.uuid4()))
+
+    def has_started(self, experiment_id):
+        return experiment_id in self.session.get('experiments_started', [])
+
+    def mark_started(self, experiment_id):
+        experiments_started = self.session.get('experiments_started', [])
+        experiments_started.append(experiment_id)
+        self.session['experiments_started'] = experiments_started
+
+    def has_completed(self, experiment_id):
+        return experiment_id in self.session.get('experiments_completed', [])
+
+    def mark_completed(self, experiment_id):
+        experiments_completed = self.session.get('experiments_completed', [])
+        experiments_completed.append(experiment_id)
+        self.session['experiments_completed'] = experiments_completed
+
+    def get_variation_id(self, experiment_id):
+        # keys are strings, as the session is serialized as JSON
+        return self.session.get('experiment_variations', {}).get(str(experiment_id))
+
+    def set_variation_id(self, experiment_id, variation_id):
+        experiment_variations = self.session.get('experiment_variations', {})
+        if experiment_variations.get(str(experiment_id)) != variation_id:
+            experiment_variations[str(experiment_id)] = variation_id
+            self.session['experiment_variations'] = experiment_variations
+
+    def save(self, response):
+        # the session middleware takes care of saving
+        pass
+
+
+class SignedCookieParticipantState(object):
+    '''
+        Keeps a user's experiment state in a single signed cookie, so that anonymous
+        visitors do not need a database-backed session. Requires
+        experiments.middleware.ParticipantStateMiddleware to write the cookie.
+
+        The cookie name and lifetime (in seconds) can be set with
+        WAGTAIL_EXPERIMENTS_COOKIE_NAME and WAGTAIL_EXPERIMENTS_COOKIE_AGE.
+    '''
+
+    salt = 'experiments.state.SignedCookieParticipantState'
+    # checked by experiments.checks, as without it the state is never saved
+    middleware = 'experiments.middleware.ParticipantStateMiddleware'
+
+    def __init__(self, request):
+        self.modified = False
+        self.cookie_name = getattr(settings, 'WAGTAIL_EXPERIMENTS_COOKIE_NAME', 'wagtail_experiments')
+        self.cookie_age = getattr(settings, 'WAGTAIL_EXPERIMENTS_COOKIE_AGE', 60 * 60 * 24 * 365)
+
+        data = {}
+        cookie = request.COOKIES.get(self.cookie_name)
+        if cookie:
+            try:
+                data = signing.loads(cookie, salt=self.salt, max_age=self.cookie_age)
+            except signing.BadSignature:
+                pass
+
+        self.user_id = data.get('u')
+        self.started = set(data.get('s', []))
+        self.completed = set(data.get('c', []))
+        self.variations = data.get('v', {})
+
+    def get_user_id(self):
+        if self.user_id is None:
+            self.user_id = str(uuid.uuid4())
+            self.modified = True
+        return self.user_id
+
+    def has_started(self, experiment_id):
+        return experiment_id in self.started
+
+    def mark_started(self, experiment_id):
+        self.started.add(experiment_id)
+        self.modified = True
+
+    def has_completed(self, experiment_id):
+        return experiment_id in self.completed
+
+    def mark_completed(self, experiment_id):
+        self.completed.add(experiment_id)
+        self.modified = True
+
+    def get_variation_id(self, experiment_id):
+        return self.variations.get(str(experiment_id))
+
+    def set_variation_id(self, experiment_id, variation_id):
+        if self.variations.get(str(experiment_id)) != variation_id:
+            self.variations[str(experiment_id)] = variation_id
+            self.modified = True
+
+    def save(self, response):
+        if not self.modified:
+            return
+
+        data = {'u': self.user_id}
+        if self.started:
+            data['s'] = sorted(self.started)
+        if self.completed:
+            data['c'] = sorted(self.completed)
+        if self.variations:
+            data['v'] = self.variations
+
+        response.set_cookie(
+            self.cookie_name,
+            signing.dumps(data, salt=self.salt, compress=True),
+            max_age=self.cookie_age,
+            secure=settings.SESSION_COOKIE_SECURE,
+            httponly=True,
+            samesite=settings.SESSION_COOKIE_SAMESITE,
+        )
+
+
+def get_participant_state(request):
+    '''
+        Get the experiment state of the user making this request.
+
+        Args:
+            request: django HttpRequest.
+
+        Return:
+            An instance of the class named by WAGTAIL_EXPERIMENTS_PARTICIPANT_STATE,
+            defaulting to experiments.state.SessionParticipantState. The same instance
+            is returned for every call with the same request.
+    '''
+
+    try:
+        return request._experiments_participant_state
+    except AttributeError:
+        state_class = import_string(getattr(
+            settings, 'WAGTAIL_EXPERIMENTS_PARTICIPANT_STATE', 'experiments.state.SessionParticipantState'
+        ))
+        request._experiments_participant_state = state_class(request)
+        return request._experiments_participant_state
@@ -0,0 +1,205 @@
+'''
+    Timing of the phases of serving experiment pages: finding the experiments of a page,
+    choosing and loading variations, backend writes and serving the chosen variation.
+
+    Each phase is timed as a span, reported to the sink named by
+    WAGTAIL_EXPERIMENTS_TIMING_SINK, one of:
+
+        None (default):                         no timing
+        'experiments.timing.LoggingSink':       logs each span at DEBUG level to the
+                                                'experiments.timing' logger
+        'experiments.timing.SignalSink':        sends the span_finished signal
+        'experiments.timing.AggregatingSink':   keeps the last WAGTAIL_EXPERIMENTS_TIMING_SAMPLES
+                                                durations of each span (default 1000) in
+                                                memory, for percentiles from get_sink().summary()
+
+    or the dotted path of your own class with a `record(name, duration, request)` method.
+    With experiments.middleware.ServerTimingMiddleware installed, spans are also added to a
+    Server-Timing response header. When neither is enabled, timing a span costs a function
+    call and an attribute lookup.
+'''
+
+import collections
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.dispatch import Signal
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+# sent with `name`, `duration` (in seconds) and `request` (or None) by SignalSink
+span_finished = Signal()
+
+_UNSET = object()
+_sink = _UNSET
+
+
+class LoggingSink(object):
+    '''
+        Logs each span at DEBUG level.
+    '''
+
+    def record(self, name, duration, request):
+        logger.debug('%s took %.3fms', name, duration * 1000)
+
+
+class SignalSink(object):
+    '''
+        Sends the span_finished signal for each span.
+    '''
+
+    def record(self, name, duration, request):
+        span_finished.send(sender=self.__class__, name=name, duration=duration, request=request)
+
+
+class AggregatingSink(object):
+    '''
+        Keeps the most recent durations of each span in this process, to report percentiles.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._counts = collections.Counter()
+        self.max_samples = getattr(settings, 'WAGTAIL_EXPERIMENTS_TIMING_SAMPLES', 1000)
+
+    def record(self, name, duration, request):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = collections.deque(maxlen=self.max_samples)
+            samples.append(duration)
+            self._counts[name] += 1
+
+    def percentile(self, name, percent):
+        '''
+            Get a percentile of the recent durations of a span.
+
+            Args:
+                name:    the name of the span.
+                percent: the percentile, from 0 to 100.
+
+            Return:
+                The duration in seconds, or None if the span has not been recorded.
+        '''
+
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+    def summary(self):
+        '''
+            Get statistics for each span, in milliseconds.
+
+            Return:
+                A dict mapping span names to dicts with the number of times the span was
+                recorded (`count`), and the 50th, 95th and 99th percentile (`p50`, `p95`,
+                `p99`) and maximum (`max`) of its recent durations.
+        '''
+
+        with self._lock:
+            names = list(self._samples)
+            counts = dict(self._counts)
+
+        summary = {}
+        for name in names:
+            summary[name] = {'count': counts[name]}
+            for percent in (50, 95, 99, 100):
+                summary[name]['max' if percent == 100 else 'p%d' % percent] = self.percentile(name, percent) * 1000
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+            self._counts = collections.Counter()
+
+
+def get_sink():
+    '''
+        Get the sink that spans are reported to.
+
+        Return:
+            An instance of the class named by WAGTAIL_EXPERIMENTS_TIMING_SINK, shared by
+            the whole process, or None if timing is disabled.
+    '''
+
+    global _sink
+    if _sink is _UNSET:
+        sink_name = getattr(settings, 'WAGTAIL_EXPERIMENTS_TIMING_SINK', None)
+        _sink = import_string(sink_name)() if sink_name else None
+    return _sink
+
+
+def reset_sink(**kwargs):
+    '''
+        Discard the sink, so that it is created again from the settings.
+    '''
+
+    global _sink
+    _sink = _UNSET
+
+
+class Span(object):
+    '''
+        Context manager timing a span.
+    '''
+
+    __slots__ = ('name', 'sink', 'request', 'started')
+
+    def __init__(self, name, sink, request):
+        self.name = name
+        self.sink = sink
+        self.request = request
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.started
+        if self.sink is not None:
+            self.sink.record(self.name, duration, self.request)
+
+        timings = getattr(self.request, '_experiments_timings', None)
+        if timings is not None:
+            timings[self.name] = timings.get(self.name, 0) + duration
+
+
+class NullSpan(object):
+    '''
+        Context manager that does nothing, used when timing is disabled.
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name, request=None):
+    '''
+        Time a phase of serving an experiment page.
+
+        Args:
+            name:    the name of the span, which must be a valid Server-Timing metric
+                     name (letters, digits, '-' and '_').
+            request: django HttpRequest being served, if any, for Server-Timing.
+
+        Return:
+            A context manager timing its block.
+    '''
+
+    sink = get_sink()
+    if sink is None and getattr(request, '_experiments_timings', None) is None:
+        return NULL_SPAN
+    return Span(name, sink, request)
@@ -1,6 +1,18 @@
-import uuid
+from django.conf import settings
+from django.core.cache import caches
 
-from .models import Alternative
+from .state import get_participant_state
+
+
+def get_cache():
+    '''
+        Get the Django cache used to share state between worker processes.
+
+        Return:
+            The cache named by WAGTAIL_EXPERIMENTS_CACHE, or the default cache.
+    '''
+
+    return caches[getattr(settings, 'WAGTAIL_EXPERIMENTS_CACHE', 'default')]
 
 
 def get_user_id(request):
@@ -18,7 +30,80 @@ def get_user_id(request):
             Require unique user ID for each session.
     '''
 
-    return request.session.setdefault('experiment_user_id', str(uuid.uuid4()))
+    return get_participant_state(request).get_user_id()
+
+
+def start_participation(experiment, request):
+    '''
+        Record in the participant state that the user has started the experiment.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+            request:    django HttpRequest.
+
+        Return:
+            True if the user had not started the experiment before, otherwise False.
+    '''
+
+    state = get_participant_state(request)
+    if state.has_started(experiment.id):
+        return False
+
+    state.mark_started(experiment.id)
+    return True
+
+
+def complete_participation(experiment, request):
+    '''
+        Record in the participant state that the user has completed the experiment.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+            request:    django HttpRequest.
+
+        Return:
+            True if the user has started the experiment but had not completed it before,
+            otherwise False.
+    '''
+
+    state = get_participant_state(request)
+    if not state.has_started(experiment.id) or state.has_completed(experiment.id):
+        return False
+
+    state.mark_completed(experiment.id)
+    return True
+
+
+def remember_variation(experiment, variation_id, request):
+    '''
+        Store the ID of the variation assigned to the user in the participant state, so that
+        completions can be recorded against it without choosing the variation again.
+
+        Args:
+            experiment:   instance of experiments.models.Experiment
+            variation_id: the page ID of the variation the user was assigned.
+            request:      django HttpRequest.
+
+        Return:
+            Nothing
+    '''
+
+    get_participant_state(request).set_variation_id(experiment.id, variation_id)
+
+
+def get_remembered_variation_id(experiment, request):
+    '''
+        Get the ID of the variation stored by remember_variation.
+
+        Args:
+            experiment: instance of experiments.models.Experiment
+            request:    django HttpRequest.
+
+        Return:
+            The page ID of the variation, or None if none was stored.
+    '''
+
+    return get_participant_state(request).get_variation_id(experiment.id)
 
 
 def percentage(fraction, population):
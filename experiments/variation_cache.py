@@ -0,0 +1,115 @@
+import copy
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .utils import get_cache
+
+
+class VariationCache(object):
+    '''
+        Cache of the page objects built from the revisions of draft alternatives,
+        keyed by (experiment_id, alternative_id, revision_id).
+
+        Deserializing a revision is much slower than serving a page, so the results are
+        kept in a per-process LRU cache of WAGTAIL_EXPERIMENTS_VARIATION_CACHE_SIZE
+        entries (default 100; 0 disables it). If WAGTAIL_EXPERIMENTS_VARIATION_CACHE_TIMEOUT
+        is set, they are also stored for that many seconds in the Django cache, so
+        that they are shared between processes.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'WAGTAIL_EXPERIMENTS_VARIATION_CACHE_SIZE', 100)
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'WAGTAIL_EXPERIMENTS_VARIATION_CACHE_TIMEOUT', None)
+
+    def get_cache_key(self, key):
+        return 'wagtail-experiments:variation:{0}:{1}:{2}'.format(*key)
+
+    def get(self, experiment_id, alternative_id, revision_id, load):
+        '''
+            Get the page object for a revision, building it if it is not cached.
+
+            Args:
+                experiment_id:  the primary key of the experiment.
+                alternative_id: the primary key of the alternative.
+                revision_id:    the primary key of the revision.
+                load:           function returning the page object for the revision.
+
+            Return:
+                A copy of the cached page object, which can be modified freely.
+        '''
+
+        key = (experiment_id, alternative_id, revision_id)
+
+        with self._lock:
+            page = self._entries.get(key)
+            if page is not None:
+                self._entries.move_to_end(key)
+
+        if page is None and self.timeout is not None:
+            page = get_cache().get(self.get_cache_key(key))
+            if page is not None:
+                self._store_local(key, page)
+
+        if page is None:
+            page = load()
+            self._store_local(key, page)
+            if self.timeout is not None:
+                get_cache().set(self.get_cache_key(key), page, self.timeout)
+
+        return copy.copy(page)
+
+    def _store_local(self, key, page):
+        max_size = self.max_size
+        if not max_size:
+            return
+
+        with self._lock:
+            self._entries[key] = page
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, experiment_id, alternatives=()):
+        '''
+            Discard the cached page objects for an experiment.
+
+            Args:
+                experiment_id: the primary key of the experiment.
+                alternatives:  iterable of (alternative_id, revision_id) pairs whose entries
+                               should also be removed from the Django cache.
+
+            Return:
+                Nothing
+        '''
+
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == experiment_id]:
+                del self._entries[key]
+
+        if self.timeout is not None:
+            get_cache().delete_many([
+                self.get_cache_key((experiment_id, alternative_id, revision_id))
+                for alternative_id, revision_id in alternatives
+                if revision_id is not None
+            ])
+
+    def clear(self):
+        '''
+            Discard all page objects cached in this process.
+        '''
+
+        with self._lock:
+            self._entries.clear()
+
+
+variation_cache = VariationCache()
@@ -1,12 +1,25 @@
+import csv
+import datetime
+import itertools
+import json
+
+from django.conf import settings
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Sum
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+)
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.http import parse_etags
 from django.utils.translation import gettext as _
 
 from wagtail.admin import messages
 from wagtail.models import Page
 
-from .models import Experiment, get_backend
+from . import feed
+from .models import Experiment, ExperimentHistory, get_backend
+from .timing import span
 from .utils import get_user_id, impersonate_other_page, percentage
 
 
@@ -43,27 +56,31 @@ def experiment_report(request, experiment_id):
 
     backend = get_backend()
     experiment = get_object_or_404(Experiment, pk=experiment_id)
-    variations = experiment.get_variations()
 
-    report = backend.get_report(experiment)
+    with span('get_report', request):
+        report = backend.get_report(experiment)
+    pages = Page.objects.in_bulk([
+        variation_report['variation_pk'] for variation_report in report['variations']
+    ])
 
     report_by_variation = {}
-    for variation in variations:
-        for variation_report in report['variations']:
-            if variation_report['variation_pk'] == variation.pk:
-                if 'history' in variation_report:
-                    for history_entry in variation_report['history']:
-                        history_entry['conversion_rate'] = percentage(
-                            history_entry['completion_count'],
-                            history_entry['participant_count'],
-                        )
-
-                variation_report['total_conversion_rate'] = percentage(
-                    variation_report['total_completion_count'],
-                    variation_report['total_participant_count'],
+    for variation_report in report['variations']:
+        variation = pages.get(variation_report['variation_pk'])
+        if variation is None:
+            continue
+
+        if 'history' in variation_report:
+            for history_entry in variation_report['history']:
+                history_entry['conversion_rate'] = percentage(
+                    history_entry['completion_count'],
+                    history_entry['participant_count'],
                 )
-                report_by_variation[variation] = variation_report
-                break
+
+        variation_report['total_conversion_rate'] = percentage(
+            variation_report['total_completion_count'],
+            variation_report['total_participant_count'],
+        )
+        report_by_variation[variation] = variation_report
 
     return render(request, 'experiments/report.html', {
         'experiment': experiment,
@@ -72,6 +89,134 @@ def experiment_report(request, experiment_id):
     })
 
 
+
+class Echo(object):
+    '''
+        A file-like object that returns what is written to it, for
+        streaming the output of csv.writer.
+    '''
+
+    def write(self, value):
+        return value
+
+
+EXPORT_FIELDS = ['date', 'variation_id', 'variation_title', 'participant_count', 'completion_count']
+
+
+def export_history(request, experiment_id):
+    '''
+        Stream the daily history of the experiment as CSV or newline-delimited JSON.
+
+        Args:
+            request:       django HttpRequest, with optional GET parameters `format`
+                           ('csv' or 'ndjson'), `from` and `to` (dates in YYYY-MM-DD format,
+                           inclusive).
+            experiment_id: the primary key for the experiment.
+
+        Return:
+            A StreamingHttpResponse, reading history rows from the database in chunks
+            of WAGTAIL_EXPERIMENTS_EXPORT_CHUNK_SIZE rows (default 2000).
+    '''
+
+    experiment = get_object_or_404(Experiment, pk=experiment_id)
+
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return HttpResponseBadRequest("format must be 'csv' or 'ndjson'")
+
+    history = ExperimentHistory.objects.filter(experiment=experiment)
+    for param, lookup in (('from', 'date__gte'), ('to', 'date__lte')):
+        if request.GET.get(param):
+            try:
+                date = datetime.datetime.strptime(request.GET[param], '%Y-%m-%d').date()
+            except ValueError:
+                return HttpResponseBadRequest("%s must be a date in YYYY-MM-DD format" % param)
+            history = history.filter(**{lookup: date})
+
+    rows = history.values('date', 'variation_id', variation_title=F('variation__title')).annotate(
+        participant_count=Sum('participant_count'), completion_count=Sum('completion_count')
+    ).order_by('date', 'variation_id').iterator(
+        chunk_size=getattr(settings, 'WAGTAIL_EXPERIMENTS_EXPORT_CHUNK_SIZE', 2000)
+    )
+
+    if export_format == 'csv':
+        writer = csv.writer(Echo())
+        content = (
+            writer.writerow([row[field] for field in EXPORT_FIELDS]) for row in rows
+        )
+        response = StreamingHttpResponse(
+            itertools.chain([writer.writerow(EXPORT_FIELDS)], content), content_type='text/csv'
+        )
+    else:
+        content = (
+            json.dumps({field: row[field] for field in EXPORT_FIELDS}, cls=DjangoJSONEncoder) + '\n'
+            for row in rows
+        )
+        response = StreamingHttpResponse(content, content_type='application/x-ndjson')
+
+    response['Content-Disposition'] = 'attachment; filename="%s-history.%s"' % (experiment.slug, export_format)
+    return response
+
+
+def history_feed(request):
+    '''
+        Get the changes to experiment history since a cursor, for dashboards and data
+        warehouses to poll.
+
+        Args:
+            request: django HttpRequest, with optional GET parameters `cursor` (as returned
+                     by the previous call; empty to start from the beginning), `limit`
+                     (history rows to read, default 1000, at most 10000), `experiment`
+                     (an experiment slug) and `format` ('json' or 'ndjson').
+
+        Return:
+            A JsonResponse with the changes in `results`, the cursor for the next call in
+            `next_cursor`, and whether there are more changes in `more`. In ndjson format,
+            one change per line, with the next cursor in the X-Next-Cursor header. If the
+            If-None-Match header matches the ETag, an empty 304 response.
+    '''
+
+    response_format = request.GET.get('format', 'json')
+    if response_format not in ('json', 'ndjson'):
+        return HttpResponseBadRequest("format must be 'json' or 'ndjson'")
+
+    try:
+        cursor = feed.decode_cursor(request.GET.get('cursor'))
+    except feed.InvalidCursor:
+        return HttpResponseBadRequest("invalid cursor")
+
+    try:
+        limit = int(request.GET.get('limit', 1000))
+    except ValueError:
+        return HttpResponseBadRequest("limit must be an integer")
+    if not 1 <= limit <= 10000:
+        return HttpResponseBadRequest("limit must be between 1 and 10000")
+
+    experiments = None
+    if request.GET.get('experiment'):
+        experiments = Experiment.objects.filter(slug=request.GET['experiment'])
+
+    etag = feed.get_etag(cursor, experiments, request.GET.urlencode())
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    changes, next_cursor, more = feed.get_changes(cursor, limit, experiments)
+
+    if response_format == 'json':
+        response = JsonResponse({'results': changes, 'next_cursor': next_cursor, 'more': more})
+    else:
+        response = HttpResponse(
+            ''.join(json.dumps(change, cls=DjangoJSONEncoder) + '\n' for change in changes),
+            content_type='application/x-ndjson',
+        )
+        response['X-More'] = 'true' if more else 'false'
+    response['X-Next-Cursor'] = next_cursor
+    response['ETag'] = etag
+    return response
+
+
 def select_winner(request, experiment_id, variation_id):
     '''
         Record the winner for the experiment if user has permission
@@ -1,10 +1,15 @@
+import datetime
+
 from django.urls import include, re_path
 from django.contrib.admin.utils import quote
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 
 from django.utils.translation import gettext_lazy as _
 from experiments import admin_urls
 from wagtail import hooks
+from wagtail.models import Page
 
 try:
     from wagtail_modeladmin.helpers import ButtonHelper
@@ -19,8 +24,10 @@ except ImportError:
         raise ImportError("wagtail-experiments requires the wagtail-modeladmin package.")
 
 
-from .models import Experiment
-from .utils import get_user_id, impersonate_other_page
+from .models import Experiment, ExperimentHistory, record_completions_for_user
+from .registry import registry
+from .timing import span
+from .utils import get_user_id, impersonate_other_page, percentage
 
 
 @hooks.register('register_admin_urls')
@@ -86,6 +93,40 @@ class ExperimentModelAdmin(ModelAdmin):
     button_helper_class = ExperimentButtonHelper
     create_view_class = CreateExperimentView
     edit_view_class = EditExperimentView
+    list_display = ('name', 'status', 'participants', 'completions', 'conversion_rate', 'days_running')
+    list_filter = ('status', )
+
+    def get_queryset(self, request):
+        # add up the totals of every listed experiment in the same query as the experiments
+        history = ExperimentHistory.objects.filter(experiment=OuterRef('pk')).values('date')
+        return super(ExperimentModelAdmin, self).get_queryset(request).annotate(
+            participant_count=Coalesce(Sum('totals__participant_count'), 0),
+            completion_count=Coalesce(Sum('totals__completion_count'), 0),
+            first_history_date=Subquery(history.order_by('date')[:1]),
+            last_history_date=Subquery(history.order_by('-date')[:1]),
+        )
+
+    def participants(self, obj):
+        return obj.participant_count
+    participants.short_description = _('participants')
+    participants.admin_order_field = 'participant_count'
+
+    def completions(self, obj):
+        return obj.completion_count
+    completions.short_description = _('completions')
+    completions.admin_order_field = 'completion_count'
+
+    def conversion_rate(self, obj):
+        return '%.2f%%' % percentage(obj.completion_count, obj.participant_count)
+    conversion_rate.short_description = _('conversion rate')
+
+    def days_running(self, obj):
+        if obj.first_history_date is None:
+            return 0
+        last_date = datetime.date.today() if obj.status == 'live' else obj.last_history_date
+        return (last_date - obj.first_history_date).days + 1
+    days_running.short_description = _('days running')
+    days_running.admin_order_field = 'first_history_date'
 
 modeladmin_register(ExperimentModelAdmin)
 
@@ -109,32 +150,38 @@ def check_experiments(page, request, serve_args, serve_kwargs):
             then show the variation page. Otherwise, return nothing.
     '''
 
-    # If the page being served is the goal page of an experiment, log a completion
-    completed_experiments = Experiment.objects.filter(goal=page, status='live')
+    with span('experiment_lookup', request):
+        completed_experiments, experiments = registry.get_experiments_for_page(page.pk)
 
+    # If the page being served is the goal page of an experiment, log a completion
     if completed_experiments:
         user_id = get_user_id(request)
-
-        for experiment in completed_experiments:
-            experiment.record_completion_for_user(user_id, request)
+        record_completions_for_user(completed_experiments, user_id, request)
 
     # If the page being served is the control page of an experiment, run the experiment
-    experiments = Experiment.objects.filter(control_page=page, status__in=('live', 'completed'))
     if experiments:
         experiment = experiments[0]
+        # the page being served is the control page, so don't load it again
+        experiment.control_page = page
+
+        variation = None
+        if experiment.status == 'completed' and experiment.winning_variation_id is not None:
+            # load the winner on every request, so that changes to it are served; it
+            # may also have been deleted since the registry was loaded
+            variation = Page.objects.filter(pk=experiment.winning_variation_id).first()
 
-        if experiment.status == 'completed' and experiment.winning_variation is not None:
-            variation = experiment.winning_variation
-        else:
+        if variation is None:
             user_id = get_user_id(request)
             variation = experiment.start_experiment_for_user(user_id, request)
 
         if variation.pk != page.pk:
             # serve this alternative instead of the current page
 
-            variation = variation.specific
+            with span('specific', request):
+                variation = variation.specific
 
             # hack the page-tree-related fields to match the control page
             impersonate_other_page(variation, page)
 
-            return variation.serve(request, *serve_args, **serve_kwargs)
+            with span('serve_variation', request):
+                return variation.serve(request, *serve_args, **serve_kwargs)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import platform
+import sys
+
+import django
+
+os.environ['DJANGO_SETTINGS_MODULE'] = 'tests.settings'
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+
+from tests.benchmarks import compare_results, run_benchmarks  # noqa: E402
+
+parser = argparse.ArgumentParser(description='Run the wagtail-experiments benchmarks.')
+parser.add_argument('names', nargs='*', help='Names of the benchmarks to run, such as control_page. Defaults to all.')
+parser.add_argument('--quick', action='store_true', help='Use fewer iterations and smaller data.')
+parser.add_argument('--output', help='File to write the results to as JSON. Defaults to standard output.')
+parser.add_argument('--compare', help='JSON results of an earlier run, to check for regressions against.')
+parser.add_argument('--tolerance', type=float, default=1.5,
+                    help='How many times slower than in the earlier run a median time may be.')
+args = parser.parse_args()
+
+setup_test_environment()
+old_name = connection.settings_dict['NAME']
+connection.creation.create_test_db(verbosity=0)
+try:
+    results = run_benchmarks('quick' if args.quick else 'full', args.names)
+finally:
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+    teardown_test_environment()
+
+output = json.dumps({
+    'environment': {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+    },
+    'results': results,
+}, indent=2)
+if args.output:
+    with open(args.output, 'w') as f:
+        f.write(output + '\n')
+else:
+    print(output)
+
+if args.compare:
+    with open(args.compare) as f:
+        regressions = compare_results(json.load(f)['results'], results, args.tolerance)
+    for regression in regressions:
+        sys.stderr.write(regression + '\n')
+    sys.exit(1 if regressions else 0)
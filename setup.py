@@ -14,6 +14,9 @@ setup(
     license='BSD',
     long_description=open('README.rst').read(),
     python_requires=">=3.8",
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
     classifiers=[
         'Development Status :: 4 - Beta',
         'Environment :: Web Environment',
@@ -0,0 +1,310 @@
+'''
+    Benchmarks for serving pages through the experiments hook, assigning variations and
+    building reports. Run them with runbenchmarks.py, which creates a test database and
+    writes the results as JSON.
+
+    Each benchmark runs in a transaction that is rolled back afterwards, with empty
+    caches, and reports the number of queries made by the first (cold) call and the most
+    made by any later (warm) call, along with timings of the warm calls.
+'''
+
+import datetime
+import random
+import statistics
+import time
+import uuid
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection, transaction
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.text import slugify
+from wagtail.models import Page
+
+from experiments.backends import db
+from experiments.counters import increment_history_counts
+from experiments.models import Alternative, Experiment
+from experiments.registry import registry
+from experiments.utils import get_cache
+from experiments.variation_cache import variation_cache
+from experiments.wagtail_hooks import check_experiments
+from tests.models import SimplePage
+
+
+SIZES = {
+    'full': {
+        'alternatives': [1, 5, 20],
+        'goal_experiments': [1, 5, 20],
+        'history_days': [30, 365],
+        'history_shards': 4,
+        'iterations': 200,
+        'report_iterations': 20,
+    },
+    'quick': {
+        'alternatives': [1, 5],
+        'goal_experiments': [1, 5],
+        'history_days': [10],
+        'history_shards': 2,
+        'iterations': 5,
+        'report_iterations': 3,
+    },
+}
+
+
+def measure(name, params, func, iterations, setup=None):
+    '''
+        Time a function.
+
+        Args:
+            name:       name of the benchmark.
+            params:     dict of the parameters of the benchmark, to include in the result.
+            func:       the function to time. It is called with the value returned by setup.
+            iterations: the number of timed calls, after an untimed cold call.
+            setup:      optional function called before each call, outside the timing.
+
+        Return:
+            The result as a dict.
+    '''
+
+    timings = []
+    warm_queries = 0
+    for iteration in range(0, iterations + 1):
+        arg = setup() if setup is not None else None
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            func(arg)
+            elapsed = time.perf_counter() - started
+        if iteration == 0:
+            cold_queries = len(queries)
+        else:
+            timings.append(elapsed * 1000)
+            warm_queries = max(warm_queries, len(queries))
+
+    timings.sort()
+    return {
+        'name': name,
+        'params': params,
+        'iterations': iterations,
+        'cold_queries': cold_queries,
+        'queries': warm_queries,
+        'min_ms': timings[0],
+        'median_ms': statistics.median(timings),
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'mean_ms': statistics.mean(timings),
+        'ops_per_second': len(timings) / (sum(timings) / 1000) if sum(timings) else None,
+    }
+
+
+def reset_caches():
+    registry.clear()
+    variation_cache.clear()
+    get_cache().clear()
+
+
+def make_user_ids(seed=0):
+    '''
+        Generate user IDs from a seed, so that users are assigned the same variations,
+        and make the same queries, on every run.
+    '''
+
+    rng = random.Random(seed)
+    while True:
+        yield str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def make_request(user_id):
+    request = RequestFactory().get('/')
+    request.session = {'experiment_user_id': user_id}
+    request.user = AnonymousUser()
+    return request
+
+
+def add_page(parent, title):
+    page = SimplePage(title=title, slug=uuid.uuid4().hex, body=title)
+    parent.add_child(instance=page)
+    return page
+
+
+def add_experiment(control_page, alternative_count, goal=None):
+    # variations are assigned from a hash of the slug, so keep it the same between runs
+    experiment = Experiment.objects.create(
+        name=control_page.title, slug=slugify(control_page.title), control_page=control_page,
+        goal=goal, status='live',
+    )
+    for index in range(0, alternative_count):
+        Alternative.objects.create(
+            experiment=experiment, page=add_page(control_page, 'Alternative %d' % index), sort_order=index
+        )
+    return experiment
+
+
+def benchmark_non_experiment_page(home, sizes):
+    page = add_page(home, 'Not in an experiment')
+    add_experiment(add_page(home, 'Control'), 1)
+    user_ids = make_user_ids()
+
+    return measure(
+        'serve_non_experiment_page', {}, lambda request: check_experiments(page, request, [], {}),
+        sizes['iterations'], setup=lambda: make_request(next(user_ids)),
+    )
+
+
+def benchmark_control_page(home, sizes, alternative_count):
+    control_page = add_page(home, 'Control')
+    add_experiment(control_page, alternative_count, goal=add_page(home, 'Goal'))
+    user_ids = make_user_ids()
+
+    return measure(
+        'serve_control_page', {'alternatives': alternative_count},
+        lambda request: check_experiments(control_page, request, [], {}),
+        sizes['iterations'], setup=lambda: make_request(next(user_ids)),
+    )
+
+
+def benchmark_goal_page(home, sizes, experiment_count):
+    goal = add_page(home, 'Goal')
+    control_pages = []
+    for index in range(0, experiment_count):
+        control_page = add_page(home, 'Control %d' % index)
+        add_experiment(control_page, 1, goal=goal)
+        control_pages.append(control_page)
+    user_ids = make_user_ids()
+
+    def setup():
+        # a new user, who has taken part in every experiment
+        request = make_request(next(user_ids))
+        for control_page in control_pages:
+            check_experiments(control_page, request, [], {})
+        return request
+
+    return measure(
+        'serve_goal_page', {'experiments': experiment_count},
+        lambda request: check_experiments(goal, request, [], {}),
+        sizes['iterations'], setup=setup,
+    )
+
+
+def benchmark_variation_assignment(home, sizes, alternative_count):
+    experiment = add_experiment(add_page(home, 'Control'), alternative_count)
+    user_ids = make_user_ids()
+
+    return measure(
+        'get_variation_for_user', {'alternatives': alternative_count},
+        lambda user_id: experiment.get_variation_for_user(user_id),
+        sizes['iterations'], setup=lambda: next(user_ids),
+    )
+
+
+def add_history(experiment, days, shards):
+    today = datetime.date.today()
+    for shard in range(0, shards):
+        increment_history_counts([
+            (experiment.pk, variation_id, today - datetime.timedelta(days=day), 100, 10)
+            for day in range(0, days)
+            for variation_id in experiment.get_variation_ids()
+        ], shard=shard)
+
+
+def benchmark_report(home, sizes, days):
+    experiment = add_experiment(add_page(home, 'Control'), 2, goal=add_page(home, 'Goal'))
+    add_history(experiment, days, sizes['history_shards'])
+    get_cache().clear()
+
+    return measure(
+        'get_report', {'days': days, 'shards': sizes['history_shards']},
+        lambda arg: db.get_report(experiment), sizes['report_iterations'],
+    )
+
+
+def benchmark_report_view(home, sizes, days):
+    experiment = add_experiment(add_page(home, 'Control'), 2, goal=add_page(home, 'Goal'))
+    add_history(experiment, days, sizes['history_shards'])
+    get_cache().clear()
+
+    client = Client()
+    client.force_login(User.objects.create_superuser(username=uuid.uuid4().hex, email='', password=None))
+    url = reverse('experiments:report', args=(experiment.pk, ))
+
+    def get_report_page(arg):
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+
+    return measure(
+        'experiment_report', {'days': days, 'shards': sizes['history_shards']},
+        get_report_page, sizes['report_iterations'],
+    )
+
+
+def get_benchmarks(sizes):
+    benchmarks = [(benchmark_non_experiment_page, ())]
+    benchmarks += [(benchmark_control_page, (count, )) for count in sizes['alternatives']]
+    benchmarks += [(benchmark_goal_page, (count, )) for count in sizes['goal_experiments']]
+    benchmarks += [(benchmark_variation_assignment, (count, )) for count in sizes['alternatives']]
+    benchmarks += [(benchmark_report, (days, )) for days in sizes['history_days']]
+    benchmarks += [(benchmark_report_view, (days, )) for days in sizes['history_days']]
+    return benchmarks
+
+
+def run_benchmarks(size='full', names=None):
+    '''
+        Run the benchmarks, against the current database.
+
+        Args:
+            size:  'full', or 'quick' for fewer iterations and smaller data.
+            names: optional list of the names of the benchmarks to run.
+
+        Return:
+            A list of results, as returned by measure.
+    '''
+
+    sizes = SIZES[size]
+    results = []
+    for benchmark, args in get_benchmarks(sizes):
+        if names and benchmark.__name__[len('benchmark_'):] not in names:
+            continue
+
+        with transaction.atomic():
+            reset_caches()
+            home = Page.get_first_root_node().add_child(instance=SimplePage(
+                title='Benchmarks', slug=uuid.uuid4().hex, body='Benchmarks',
+            ))
+            results.append(benchmark(home, sizes, *args))
+            transaction.set_rollback(True)
+        reset_caches()
+    return results
+
+
+def get_key(result):
+    return (result['name'], tuple(sorted(result['params'].items())))
+
+
+def compare_results(baseline, results, tolerance=1.5):
+    '''
+        Find regressions against the results of an earlier run.
+
+        Args:
+            baseline:  list of results from an earlier run.
+            results:   list of results from this run.
+            tolerance: how many times slower than the baseline a median time may be.
+
+        Return:
+            A list of messages describing the regressions.
+    '''
+
+    baseline = {get_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline.get(get_key(result))
+        if previous is None:
+            continue
+
+        label = '%s %s' % (result['name'], result['params'])
+        for field in ('cold_queries', 'queries'):
+            if result[field] > previous[field]:
+                regressions.append('%s: %s went from %d to %d' % (label, field, previous[field], result[field]))
+        if result['median_ms'] > previous['median_ms'] * tolerance:
+            regressions.append('%s: median went from %.2fms to %.2fms' % (
+                label, previous['median_ms'], result['median_ms']
+            ))
+    return regressions
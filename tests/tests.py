@@ -1,11 +1,51 @@
 
+import csv
+import datetime
+import gzip
+import importlib.util
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
 from django import __version__ as DJANGO_VERSION
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import Client, TestCase
+from django.core import signing
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished
+from django.db import connection
+from django.db.models import QuerySet, Sum
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from wagtail.models import Page
 
-from experiments.models import Experiment, ExperimentHistory
+from experiments import counters, timing
+from experiments.backends import buffered, cache, collector, db, eventlog, events
+from experiments.checks import check_participant_state
+from experiments.counters import get_shard, increment_history_counts
+from experiments.deferred import DeferredWriter
+from experiments.models import (
+    Experiment, ExperimentEvent, ExperimentHistory, ExperimentVariationTotal, get_variation_ids_for_experiments,
+    record_completions_for_user,
+)
+from experiments.registry import ExperimentRegistry, registry
+from experiments.report_cache import report_cache
+from experiments.state import SignedCookieParticipantState
+from experiments.utils import get_cache
+from experiments.variation_cache import variation_cache
+from experiments.wagtail_hooks import check_experiments
+from tests import benchmarks
+
+
+# a single upsert each for the daily history and the running totals, in a savepoint
+HISTORY_WRITE_QUERIES = 4
 
 
 class TestFrontEndView(TestCase):
@@ -13,6 +53,10 @@ class TestFrontEndView(TestCase):
     fixtures = ['test.json']
 
     def setUp(self):
+        # test transactions are rolled back without sending signals, so start from clean caches
+        registry.clear()
+        variation_cache.clear()
+
         self.experiment = Experiment.objects.get(slug='homepage-text')
         self.homepage = Page.objects.get(url_path='/home/')
         self.homepage_alternative_1 = Page.objects.get(url_path='/home/home-alternative-1/')
@@ -209,6 +253,28 @@ class TestFrontEndView(TestCase):
         self.client.get('/signup-complete/')
         self.assertEqual(ExperimentHistory.objects.filter(experiment=self.experiment).count(), 0)
 
+    def test_changes_to_the_winning_variation_are_served(self):
+        self.experiment.status = 'completed'
+        self.experiment.winning_variation = self.homepage_alternative_2
+        self.experiment.save()
+        self.assertContains(self.client.get('/'), "What do you want?")
+
+        # publishing the winning page doesn't change the experiment, but must still be served
+        winner = self.homepage_alternative_2.specific
+        winner.body = "Oh, it's you again."
+        winner.save_revision().publish()
+        self.assertContains(self.client.get('/'), "it&#x27;s you again.")
+
+        # deleting it sets winning_variation to NULL without sending post_save, so the
+        # registry keeps its ID; the experiment is run again, as it would be without a winner
+        registry._by_control_page[self.homepage.pk][0].winning_variation_id = 999
+        session = self.client.session
+        session['experiment_user_id'] = '11111111-1111-1111-1111-111111111111'
+        session.save()
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<p>Welcome to our site!</p>')
+
     def test_original_title_is_preserved(self):
         session = self.client.session
         session['experiment_user_id'] = '11111111-1111-1111-1111-111111111111'
@@ -252,6 +318,9 @@ class TestAdmin(TestCase):
     fixtures = ['test.json']
 
     def setUp(self):
+        registry.clear()
+        get_cache().clear()
+        variation_cache.clear()
         User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
         self.assertTrue(
             self.client.login(username='admin', password='password')
@@ -335,6 +404,33 @@ class TestAdmin(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Homepage text')
 
+    def test_experiments_index_shows_totals(self):
+        today = datetime.date.today()
+        increment_history_counts([
+            (self.experiment.pk, self.homepage.pk, today - datetime.timedelta(days=2), 40, 10),
+            (self.experiment.pk, self.homepage_alternative_1.pk, today, 40, 20),
+        ])
+
+        url = f'/{self.admin_home}/experiments/experiment/'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        experiment = [obj for obj in response.context['view'].queryset if obj.pk == self.experiment.pk][0]
+        self.assertEqual(experiment.participant_count, 80)
+        self.assertEqual(experiment.completion_count, 30)
+        self.assertContains(response, '37.50%')
+
+        # listing more experiments does not take more queries
+        for index in range(0, 5):
+            other_experiment = Experiment.objects.create(
+                name='Experiment %d' % index, slug='experiment-%d' % index,
+                control_page=self.homepage, status='completed',
+            )
+            increment_history_counts([(other_experiment.pk, self.homepage.pk, today, 1, 1)])
+        with self.assertNumQueries(len(queries)):
+            self.client.get(url)
+
     def test_experiment_new(self):
         response = self.client.get(f'/{self.admin_home}/experiments/experiment/create/')
         self.assertEqual(response.status_code, 200)
@@ -536,3 +632,1581 @@ class TestAdmin(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, '<title>Home</title>')
+
+
+class TestExperimentRegistry(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        registry.clear()
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+        self.homepage = Page.objects.get(url_path='/home/')
+        self.homepage_alternative_1 = Page.objects.get(url_path='/home/home-alternative-1/')
+        self.goal_page = Page.objects.get(url_path='/home/signup-complete/')
+
+    def test_lookup_by_control_page_and_goal(self):
+        self.assertEqual(registry.get_experiments_for_control_page(self.homepage.pk), [self.experiment])
+        self.assertEqual(registry.get_experiments_for_goal(self.goal_page.pk), [self.experiment])
+        self.assertEqual(registry.get_experiments_for_control_page(self.goal_page.pk), [])
+        self.assertEqual(registry.get_experiments_for_goal(self.homepage.pk), [])
+
+    def test_non_experiment_page_costs_no_queries(self):
+        request = RequestFactory().get('/home/home-alternative-1/')
+
+        # the first lookup builds the registry
+        with self.assertNumQueries(1):
+            self.assertIsNone(check_experiments(self.homepage_alternative_1, request, [], {}))
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(check_experiments(self.homepage_alternative_1, request, [], {}))
+
+    def test_lookup_by_page(self):
+        self.assertEqual(registry.get_experiments_for_page(self.homepage.pk), ([], [self.experiment]))
+        self.assertEqual(registry.get_experiments_for_page(self.goal_page.pk), ([self.experiment], []))
+
+    def test_version_stamp_is_read_once_per_page(self):
+        request = RequestFactory().get('/home/home-alternative-1/')
+        with mock.patch.object(registry, '_get_shared_version', wraps=registry._get_shared_version) as get_version:
+            check_experiments(self.homepage_alternative_1, request, [], {})
+        self.assertEqual(get_version.call_count, 1)
+
+    def test_registry_is_invalidated_on_save(self):
+        self.assertEqual(registry.get_experiments_for_control_page(self.homepage.pk), [self.experiment])
+
+        self.experiment.status = 'draft'
+        self.experiment.save()
+        self.assertEqual(registry.get_experiments_for_control_page(self.homepage.pk), [])
+
+        self.experiment.status = 'completed'
+        self.experiment.save()
+        self.assertEqual(registry.get_experiments_for_control_page(self.homepage.pk), [self.experiment])
+        # completed experiments no longer record completions
+        self.assertEqual(registry.get_experiments_for_goal(self.goal_page.pk), [])
+
+    def test_registry_is_invalidated_on_delete(self):
+        self.assertEqual(registry.get_experiments_for_goal(self.goal_page.pk), [self.experiment])
+        self.experiment.delete()
+        self.assertEqual(registry.get_experiments_for_goal(self.goal_page.pk), [])
+
+    @override_settings(WAGTAIL_EXPERIMENTS_REGISTRY_TTL=0)
+    def test_registry_is_rebuilt_when_expired(self):
+        self.assertEqual(registry.get_experiments_for_control_page(self.homepage.pk), [self.experiment])
+
+        # a change made in another process, whose version stamp is not shared, such as
+        # with a local-memory cache
+        Experiment.objects.filter(pk=self.experiment.pk).update(status='draft')
+        self.assertEqual(registry.get_experiments_for_control_page(self.homepage.pk), [])
+
+    def test_lookups_return_copies(self):
+        experiment = registry.get_experiments_for_control_page(self.homepage.pk)[0]
+        experiment.control_page = self.homepage
+        self.assertIsNot(registry.get_experiments_for_control_page(self.homepage.pk)[0], experiment)
+        self.assertFalse(
+            registry.get_experiments_for_control_page(self.homepage.pk)[0]._state.fields_cache
+        )
+
+    def test_other_processes_notice_changes_through_the_version_stamp(self):
+        self.assertEqual(registry.get_experiments_for_control_page(self.homepage.pk), [self.experiment])
+
+        # simulate a change made in another process, which only updates the shared version stamp
+        Experiment.objects.filter(pk=self.experiment.pk).update(status='draft')
+        self.assertEqual(registry.get_experiments_for_control_page(self.homepage.pk), [self.experiment])
+
+        ExperimentRegistry().invalidate()
+        self.assertEqual(registry.get_experiments_for_control_page(self.homepage.pk), [])
+
+
+class TestHistoryCounters(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        get_cache().clear()
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+        self.homepage = Page.objects.get(url_path='/home/')
+        self.homepage_alternative_1 = Page.objects.get(url_path='/home/home-alternative-1/')
+        self.today = datetime.date.today()
+
+    def get_counts(self, variation, date=None):
+        history = ExperimentHistory.objects.get(
+            experiment=self.experiment, variation=variation, date=date or self.today
+        )
+        return (history.participant_count, history.completion_count)
+
+    def test_increment_creates_and_updates_rows(self):
+        with self.assertNumQueries(HISTORY_WRITE_QUERIES):
+            increment_history_counts([(self.experiment.pk, self.homepage.pk, self.today, 1, 0)])
+        self.assertEqual(self.get_counts(self.homepage), (1, 0))
+
+        with self.assertNumQueries(HISTORY_WRITE_QUERIES):
+            increment_history_counts([(self.experiment.pk, self.homepage.pk, self.today, 0, 1)])
+        self.assertEqual(self.get_counts(self.homepage), (1, 1))
+
+    def test_increments_to_the_same_row_are_combined(self):
+        yesterday = self.today - datetime.timedelta(days=1)
+        increment_history_counts([
+            (self.experiment.pk, self.homepage.pk, self.today, 1, 0),
+            (self.experiment.pk, self.homepage_alternative_1.pk, self.today, 1, 0),
+            (self.experiment.pk, self.homepage.pk, self.today, 2, 1),
+            (self.experiment.pk, self.homepage.pk, yesterday, 1, 1),
+        ])
+        self.assertEqual(ExperimentHistory.objects.filter(experiment=self.experiment).count(), 3)
+        self.assertEqual(self.get_counts(self.homepage), (3, 1))
+        self.assertEqual(self.get_counts(self.homepage_alternative_1), (1, 0))
+        self.assertEqual(self.get_counts(self.homepage, yesterday), (1, 1))
+
+    def test_fallback_without_upsert_support(self):
+        with mock.patch('experiments.counters.get_upsert_sql', return_value=None):
+            increment_history_counts([(self.experiment.pk, self.homepage.pk, self.today, 1, 0)])
+            increment_history_counts([(self.experiment.pk, self.homepage.pk, self.today, 1, 1)])
+        self.assertEqual(self.get_counts(self.homepage), (2, 1))
+
+    def get_totals(self, variation):
+        totals = ExperimentVariationTotal.objects.get(experiment=self.experiment, variation=variation)
+        return (totals.participant_count, totals.completion_count)
+
+    def test_totals_are_kept_with_history(self):
+        yesterday = self.today - datetime.timedelta(days=1)
+        increment_history_counts([
+            (self.experiment.pk, self.homepage.pk, yesterday, 3, 1),
+            (self.experiment.pk, self.homepage.pk, self.today, 2, 1),
+            (self.experiment.pk, self.homepage_alternative_1.pk, self.today, 1, 0),
+        ])
+        self.assertEqual(self.get_totals(self.homepage), (5, 2))
+        self.assertEqual(self.get_totals(self.homepage_alternative_1), (1, 0))
+
+        # the history is not written if the totals cannot be
+        real_increment_with_upsert = counters._increment_with_upsert
+
+        def increment_with_upsert(connection, model, rows):
+            if model is ExperimentVariationTotal:
+                raise RuntimeError
+            real_increment_with_upsert(connection, model, rows)
+
+        with mock.patch('experiments.counters._increment_with_upsert', side_effect=increment_with_upsert):
+            with self.assertRaises(RuntimeError):
+                increment_history_counts([(self.experiment.pk, self.homepage.pk, self.today, 1, 0)])
+        self.assertEqual(self.get_counts(self.homepage), (2, 1))
+        self.assertEqual(self.get_totals(self.homepage), (5, 2))
+
+        with mock.patch('experiments.counters.get_upsert_sql', return_value=None):
+            increment_history_counts([(self.experiment.pk, self.homepage.pk, self.today, 1, 1)])
+        self.assertEqual(self.get_totals(self.homepage), (6, 3))
+
+    def test_totals_are_rebuilt_from_history(self):
+        increment_history_counts([(self.experiment.pk, self.homepage.pk, self.today, 2, 1)])
+        ExperimentVariationTotal.objects.update(participant_count=100)
+        ExperimentVariationTotal.objects.create(
+            experiment=self.experiment, variation=self.homepage_alternative_1, shard=3, participant_count=1
+        )
+
+        call_command('experiment-rebuild-totals', 'homepage-text', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.get_totals(self.homepage), (2, 1))
+        self.assertFalse(
+            ExperimentVariationTotal.objects.filter(variation=self.homepage_alternative_1).exists()
+        )
+
+    @override_settings(WAGTAIL_EXPERIMENTS_HISTORY_SHARDS=16)
+    def test_sharded_counts_are_summed_and_folded(self):
+        user_ids = ['user-%d' % index for index in range(0, 20)]
+        shards = {get_shard(user_id) for user_id in user_ids}
+        self.assertGreater(len(shards), 1)
+        self.assertTrue(all(0 <= shard < 16 for shard in shards))
+
+        for user_id in user_ids:
+            client = Client()
+            session = client.session
+            session['experiment_user_id'] = user_id
+            session.save()
+            client.get('/')
+
+        report = db.get_report(self.experiment)
+        self.assertEqual(
+            sum(variation['total_participant_count'] for variation in report['variations']), 20
+        )
+        # one entry per variation and day, whatever the number of shards
+        self.assertTrue(all(len(variation['history']) <= 1 for variation in report['variations']))
+        variation_count = len([variation for variation in report['variations'] if variation['history']])
+        sharded_row_count = ExperimentHistory.objects.filter(experiment=self.experiment).count()
+        self.assertGreater(sharded_row_count, variation_count)
+
+        # today's rows are left alone, as they are still being written to
+        call_command('experiment-fold-shards', stdout=open(os.devnull, 'w'))
+        self.assertEqual(ExperimentHistory.objects.filter(experiment=self.experiment).count(), sharded_row_count)
+
+        tomorrow = self.today + datetime.timedelta(days=1)
+        call_command('experiment-fold-shards', '--before', tomorrow.isoformat(), stdout=open(os.devnull, 'w'))
+        self.assertEqual(ExperimentHistory.objects.filter(experiment=self.experiment).count(), variation_count)
+        self.assertFalse(ExperimentHistory.objects.filter(shard__gt=0).exists())
+        self.assertEqual(
+            sum(ExperimentHistory.objects.values_list('participant_count', flat=True)), 20
+        )
+        # folding moves counts between history rows, which leaves the totals unchanged
+        self.assertEqual(
+            sum(ExperimentVariationTotal.objects.values_list('participant_count', flat=True)), 20
+        )
+
+
+@override_settings(WAGTAIL_EXPERIMENTS_BUFFER_FLUSH_INTERVAL=None, WAGTAIL_EXPERIMENTS_BUFFER_MAX_EVENTS=3)
+class TestBufferedBackend(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        registry.clear()
+        get_cache().clear()
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+        self.homepage = Page.objects.get(url_path='/home/')
+
+        backend_patcher = mock.patch('experiments.models.BACKEND', buffered)
+        backend_patcher.start()
+        self.addCleanup(backend_patcher.stop)
+        self.addCleanup(buffered.buffer.flush)
+
+    def visit_homepage(self, user_id):
+        client = Client()
+        session = client.session
+        session['experiment_user_id'] = user_id
+        session.save()
+        client.get('/')
+        return client
+
+    def test_counts_are_written_in_batches(self):
+        self.visit_homepage('11111111-1111-1111-1111-111111111111')
+        client = self.visit_homepage('22222222-2222-2222-2222-222222222222')
+
+        # nothing is written until the buffer holds WAGTAIL_EXPERIMENTS_BUFFER_MAX_EVENTS events
+        self.assertFalse(ExperimentHistory.objects.filter(experiment=self.experiment).exists())
+        self.assertEqual(
+            buffered.buffer.pending(),
+            {(self.experiment.pk, self.homepage.pk, datetime.date.today()): (2, 0)}
+        )
+
+        client.get('/signup-complete/')
+        self.assertEqual(buffered.buffer.pending(), {})
+        history_record = ExperimentHistory.objects.get(experiment=self.experiment, variation=self.homepage)
+        self.assertEqual(history_record.participant_count, 2)
+        self.assertEqual(history_record.completion_count, 1)
+
+    def test_report_includes_buffered_counts(self):
+        self.visit_homepage('11111111-1111-1111-1111-111111111111')
+
+        report = buffered.get_report(self.experiment)
+        control_report = [v for v in report['variations'] if v['is_control']][0]
+        self.assertEqual(control_report['total_participant_count'], 1)
+
+    def test_failed_flush_keeps_counts(self):
+        self.visit_homepage('11111111-1111-1111-1111-111111111111')
+
+        with mock.patch('experiments.backends.buffered.increment_history_counts', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                buffered.flush()
+
+        self.assertEqual(
+            buffered.buffer.pending(),
+            {(self.experiment.pk, self.homepage.pk, datetime.date.today()): (1, 0)}
+        )
+        buffered.flush()
+        self.assertEqual(
+            ExperimentHistory.objects.get(experiment=self.experiment, variation=self.homepage).participant_count, 1
+        )
+
+
+    def test_counts_for_deleted_experiments_are_discarded(self):
+        other_experiment = Experiment.objects.create(
+            name='Other', slug='other', control_page=self.homepage, status='live'
+        )
+        today = datetime.date.today()
+        buffered.buffer.add(other_experiment.pk, self.homepage.pk, today, 1, 0)
+        buffered.buffer.add(self.experiment.pk, self.homepage.pk, today, 2, 0)
+        other_experiment.delete()
+
+        with self.assertLogs('experiments.backends.buffered', level='WARNING'):
+            buffered.flush()
+
+        self.assertEqual(buffered.buffer.pending(), {})
+        self.assertEqual(
+            ExperimentHistory.objects.get(experiment=self.experiment, variation=self.homepage).participant_count, 2
+        )
+
+
+class TestCacheBackend(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        registry.clear()
+        get_cache().clear()
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+        self.homepage = Page.objects.get(url_path='/home/')
+        self.today = datetime.date.today()
+
+        backend_patcher = mock.patch('experiments.models.BACKEND', cache)
+        backend_patcher.start()
+        self.addCleanup(backend_patcher.stop)
+
+    def visit(self, user_id, *urls):
+        client = Client()
+        session = client.session
+        session['experiment_user_id'] = user_id
+        session.save()
+        for url in urls:
+            client.get(url)
+
+    def get_control_report(self):
+        report = cache.get_report(self.experiment)
+        return [variation for variation in report['variations'] if variation['is_control']][0]
+
+    def test_counts_are_flushed_to_history(self):
+        self.visit('11111111-1111-1111-1111-111111111111', '/', '/signup-complete/')
+        self.visit('22222222-2222-2222-2222-222222222222', '/')
+
+        self.assertFalse(ExperimentHistory.objects.exists())
+        self.assertEqual(
+            cache.get_pending_counts([self.experiment]),
+            {(self.experiment.pk, self.homepage.pk, self.today): (2, 1)}
+        )
+
+        call_command('experiment-flush-counters', stdout=open(os.devnull, 'w'))
+        self.assertEqual(cache.get_pending_counts([self.experiment]), {})
+        history_record = ExperimentHistory.objects.get(experiment=self.experiment, variation=self.homepage)
+        self.assertEqual(history_record.participant_count, 2)
+        self.assertEqual(history_record.completion_count, 1)
+
+        # flushing again does not count anything twice
+        self.assertEqual(cache.flush(), 0)
+
+    def test_report_merges_cached_and_flushed_counts(self):
+        self.visit('11111111-1111-1111-1111-111111111111', '/')
+        cache.flush()
+        self.visit('22222222-2222-2222-2222-222222222222', '/', '/signup-complete/')
+
+        control_report = self.get_control_report()
+        self.assertEqual(control_report['total_participant_count'], 2)
+        self.assertEqual(control_report['total_completion_count'], 1)
+        self.assertEqual(
+            control_report['history'],
+            [{'date': self.today, 'participant_count': 2, 'completion_count': 1}]
+        )
+
+    def test_failed_flush_keeps_counts(self):
+        self.visit('11111111-1111-1111-1111-111111111111', '/')
+
+        with mock.patch('experiments.backends.cache.increment_history_counts', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                cache.flush()
+
+        self.assertEqual(
+            cache.get_pending_counts([self.experiment]),
+            {(self.experiment.pk, self.homepage.pk, self.today): (1, 0)}
+        )
+
+
+class TestCollectorBackend(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        registry.clear()
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+        self.homepage = Page.objects.get(url_path='/home/')
+        self.today = datetime.date.today()
+
+        socket_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, socket_dir)
+        self.address = os.path.join(socket_dir, 'collector.sock')
+        settings_override = override_settings(WAGTAIL_EXPERIMENTS_COLLECTOR_ADDRESS=self.address)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.collector = collector.Collector(self.address)
+        self.collector.bind()
+        self.addCleanup(self.collector.close)
+
+        for target, value in [
+            ('experiments.models.BACKEND', collector),
+            ('experiments.backends.collector.sender', collector.DatagramSender()),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def visit(self, user_id, *urls):
+        client = Client()
+        session = client.session
+        session['experiment_user_id'] = user_id
+        session.save()
+        for url in urls:
+            client.get(url)
+
+    def make_datagram(self, pid, sequence, experiment=None):
+        return collector.DATAGRAM_HEADER.pack(collector.MAGIC, collector.VERSION, pid, sequence) + \
+            eventlog.encode_event(
+                (experiment or self.experiment).pk, self.homepage.pk, self.today, eventlog.PARTICIPANT, 0
+            )
+
+    def test_events_are_collected_into_history(self):
+        self.visit('11111111-1111-1111-1111-111111111111', '/', '/signup-complete/')
+        self.visit('22222222-2222-2222-2222-222222222222', '/')
+
+        self.collector.receive(0.1)
+        self.assertEqual(self.collector.pending(), 3)
+        self.assertFalse(ExperimentHistory.objects.exists())
+
+        # one query each to check the experiments and pages still exist, then the write
+        with self.assertNumQueries(2 + HISTORY_WRITE_QUERIES):
+            self.assertEqual(self.collector.flush(), 3)
+        history_record = ExperimentHistory.objects.get(experiment=self.experiment, variation=self.homepage)
+        self.assertEqual(history_record.participant_count, 2)
+        self.assertEqual(history_record.completion_count, 1)
+
+        self.assertEqual(self.collector.stats['received'], 3)
+        self.assertEqual(self.collector.stats['dropped'], 0)
+        self.assertIsNotNone(self.collector.stats['last_flush_seconds'])
+
+    def test_dropped_and_invalid_datagrams_are_counted(self):
+        self.collector.handle_datagram(self.make_datagram(100, 1))
+        self.collector.handle_datagram(self.make_datagram(100, 4))
+        self.collector.handle_datagram(self.make_datagram(200, 2))
+        self.collector.handle_datagram(b'nonsense')
+
+        self.assertEqual(self.collector.stats['received'], 3)
+        self.assertEqual(self.collector.stats['dropped'], 3)
+        self.assertEqual(self.collector.stats['invalid'], 1)
+
+        # a late datagram is no longer counted as dropped
+        self.collector.handle_datagram(self.make_datagram(100, 3))
+        self.assertEqual(self.collector.stats['dropped'], 2)
+        self.assertEqual(self.collector.pending(), 4)
+
+    def test_sending_without_a_collector_does_not_fail(self):
+        self.collector.close()
+
+        self.visit('11111111-1111-1111-1111-111111111111', '/')
+        self.assertEqual(collector.sender.failed, 1)
+
+    def test_events_for_deleted_experiments_are_discarded(self):
+        other_experiment = Experiment.objects.create(
+            name='Other', slug='other', control_page=self.homepage, status='live'
+        )
+        self.collector.handle_datagram(self.make_datagram(100, 1, other_experiment))
+        self.collector.handle_datagram(self.make_datagram(100, 2))
+        other_experiment.delete()
+
+        self.assertEqual(self.collector.flush(), 1)
+        self.assertEqual(self.collector.pending(), 0)
+        self.assertEqual(self.collector.stats['discarded'], 1)
+        self.assertEqual(
+            ExperimentHistory.objects.get(experiment=self.experiment, variation=self.homepage).participant_count, 1
+        )
+
+    def test_failed_flush_keeps_counts(self):
+        self.collector.handle_datagram(self.make_datagram(100, 1))
+
+        with mock.patch('experiments.backends.collector.increment_history_counts', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.collector.flush()
+
+        self.assertEqual(self.collector.pending(), 1)
+        self.assertEqual(self.collector.stats['flush_failures'], 1)
+        self.collector.flush()
+        self.assertEqual(
+            ExperimentHistory.objects.get(experiment=self.experiment, variation=self.homepage).participant_count, 1
+        )
+
+
+class TestDatabaseBackendReport(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        get_cache().clear()
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+        self.homepage = Page.objects.get(url_path='/home/')
+        self.homepage_alternative_1 = Page.objects.get(url_path='/home/home-alternative-1/')
+        self.homepage_alternative_2 = Page.objects.get(url_path='/home/home-alternative-2/')
+
+        today = datetime.date.today()
+        yesterday = today - datetime.timedelta(days=1)
+        increment_history_counts([
+            (self.experiment.pk, self.homepage.pk, yesterday, 10, 2),
+            (self.experiment.pk, self.homepage.pk, today, 5, 1),
+            (self.experiment.pk, self.homepage_alternative_1.pk, today, 4, 3),
+        ])
+
+    def test_get_report(self):
+        self.experiment.winning_variation = self.homepage_alternative_1
+        self.experiment.save()
+
+        # one query each for the alternatives, the totals and the history
+        with self.assertNumQueries(3):
+            report = db.get_report(self.experiment)
+
+        self.assertEqual(
+            [variation['variation_pk'] for variation in report['variations']],
+            [self.homepage.pk, self.homepage_alternative_1.pk, self.homepage_alternative_2.pk]
+        )
+
+        control, alternative_1, alternative_2 = report['variations']
+        self.assertTrue(control['is_control'])
+        self.assertFalse(control['is_winner'])
+        self.assertEqual(control['total_participant_count'], 15)
+        self.assertEqual(control['total_completion_count'], 3)
+        self.assertEqual(
+            [(entry['participant_count'], entry['completion_count']) for entry in control['history']],
+            [(10, 2), (5, 1)]
+        )
+
+        self.assertFalse(alternative_1['is_control'])
+        self.assertTrue(alternative_1['is_winner'])
+        self.assertEqual(alternative_1['total_participant_count'], 4)
+        self.assertEqual(alternative_1['total_completion_count'], 3)
+
+        self.assertEqual(alternative_2['total_participant_count'], 0)
+        self.assertEqual(alternative_2['history'], [])
+
+    def get_control_report(self):
+        return db.get_report(self.experiment)['variations'][0]
+
+    def test_report_is_refreshed_incrementally(self):
+        today = datetime.date.today()
+        self.get_control_report()
+
+        increment_history_counts([(self.experiment.pk, self.homepage.pk, today, 1, 1)])
+        with CaptureQueriesContext(connection) as queries:
+            control = self.get_control_report()
+
+        # only today's history is read again
+        history_queries = [query['sql'] for query in queries if 'experimenthistory' in query['sql']]
+        self.assertEqual(len(history_queries), 1)
+        self.assertIn('"date" >=', history_queries[0])
+        self.assertEqual(
+            [(entry['participant_count'], entry['completion_count']) for entry in control['history']],
+            [(10, 2), (6, 2)]
+        )
+        self.assertEqual(control['total_participant_count'], 16)
+
+        # writes to earlier days discard the cached history once they are committed, so
+        # that a report read in the meantime can't cache the old counts again
+        cache_key = report_cache.get_cache_key(self.experiment.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            increment_history_counts([
+                (self.experiment.pk, self.homepage.pk, today - datetime.timedelta(days=1), 1, 0)
+            ])
+            self.assertIsNotNone(get_cache().get(cache_key))
+        self.assertIsNone(get_cache().get(cache_key))
+        control = self.get_control_report()
+        self.assertEqual(
+            [(entry['participant_count'], entry['completion_count']) for entry in control['history']],
+            [(11, 2), (6, 2)]
+        )
+
+    def test_report_cache_is_invalidated(self):
+        cache_key = report_cache.get_cache_key(self.experiment.pk)
+
+        self.get_control_report()
+        self.assertIsNotNone(get_cache().get(cache_key))
+        self.experiment.select_winner(self.homepage_alternative_1)
+        self.assertIsNone(get_cache().get(cache_key))
+
+        self.get_control_report()
+        call_command('experiment-data', self.experiment.slug, '--purge', stdout=open(os.devnull, 'w'))
+        self.assertIsNone(get_cache().get(cache_key))
+        self.assertEqual(self.get_control_report()['total_participant_count'], 0)
+
+    def test_report_view(self):
+        User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.client.login(username='admin', password='password')
+
+        response = self.client.get(reverse('experiments:report', args=(self.experiment.pk, )))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '3 / 15')
+        self.assertContains(response, '20.00%')
+        self.assertContains(response, '3 / 4')
+        self.assertContains(response, 'Homepage alternative 2')
+
+    def test_report_links_to_export(self):
+        User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.client.login(username='admin', password='password')
+
+        response = self.client.get(reverse('experiments:report', args=(self.experiment.pk, )))
+        self.assertContains(response, reverse('experiments:export', args=(self.experiment.pk, )) + '?format=csv')
+
+    def get_export(self, **params):
+        admin, _ = User.objects.get_or_create(username='admin', defaults={'is_superuser': True, 'is_staff': True})
+        self.client.force_login(admin)
+        return self.client.get(reverse('experiments:export', args=(self.experiment.pk, )), params)
+
+    def test_export_csv(self):
+        today = datetime.date.today()
+        yesterday = today - datetime.timedelta(days=1)
+        # shards of the same day are added up
+        increment_history_counts([(self.experiment.pk, self.homepage.pk, today, 1, 1)], shard=2)
+
+        with mock.patch('django.db.models.query.QuerySet.iterator', autospec=True,
+                        side_effect=QuerySet.iterator) as iterator:
+            response = self.get_export(format='csv')
+            content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(response.streaming)
+        self.assertEqual(iterator.call_args[1], {'chunk_size': 2000})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('homepage-text-history.csv', response['Content-Disposition'])
+
+        self.assertEqual(list(csv.reader(io.StringIO(content))), [
+            ['date', 'variation_id', 'variation_title', 'participant_count', 'completion_count'],
+            [yesterday.isoformat(), str(self.homepage.pk), self.homepage.title, '10', '2'],
+            [today.isoformat(), str(self.homepage.pk), self.homepage.title, '6', '2'],
+            [today.isoformat(), str(self.homepage_alternative_1.pk), self.homepage_alternative_1.title, '4', '3'],
+        ])
+
+    def test_export_ndjson_with_date_range(self):
+        today = datetime.date.today()
+        response = self.get_export(format='ndjson', **{'from': today.isoformat(), 'to': today.isoformat()})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            [(row['date'], row['variation_id'], row['participant_count']) for row in rows],
+            [(today.isoformat(), self.homepage.pk, 5), (today.isoformat(), self.homepage_alternative_1.pk, 4)]
+        )
+
+    def test_export_rejects_invalid_parameters(self):
+        self.assertEqual(self.get_export(format='xml').status_code, 400)
+        self.assertEqual(self.get_export(**{'from': 'yesterday'}).status_code, 400)
+
+
+class TestExportCommand(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+        self.homepage = Page.objects.get(url_path='/home/')
+        self.homepage_alternative_1 = Page.objects.get(url_path='/home/home-alternative-1/')
+        self.today = datetime.date.today()
+        self.other_experiment = Experiment.objects.create(
+            name='Other', slug='other', control_page=self.homepage, status='live'
+        )
+
+        increment_history_counts([
+            (self.experiment.pk, self.homepage.pk, self.today - datetime.timedelta(days=1), 10, 2),
+            (self.experiment.pk, self.homepage.pk, self.today, 5, 1),
+            (self.experiment.pk, self.homepage_alternative_1.pk, self.today, 4, 3),
+            (self.other_experiment.pk, self.homepage.pk, self.today, 1, 0),
+        ])
+
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+
+    def export(self, filename, *args):
+        path = os.path.join(self.output_dir, filename)
+        call_command('experiment-export', path, *args, stdout=open(os.devnull, 'w'))
+        return path
+
+    def test_csv_export_in_chunks(self):
+        # one query per chunk, plus one to find the end
+        with self.assertNumQueries(3):
+            path = self.export('history.csv', '--format', 'csv', '--chunk-size', '2')
+
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual([int(row['id']) for row in rows], sorted(int(row['id']) for row in rows))
+        self.assertEqual(
+            sum(int(row['participant_count']) for row in rows if row['experiment_id'] == str(self.experiment.pk)), 19
+        )
+
+    def test_export_selected_experiments_to_gzipped_csv(self):
+        path = self.export('history.csv.gz', 'other', '--format', 'csv')
+
+        with gzip.open(path, 'rt', newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(
+            [(row['experiment_id'], row['variation_id'], row['date'], row['participant_count']) for row in rows],
+            [(str(self.other_experiment.pk), str(self.homepage.pk), self.today.isoformat(), '1')]
+        )
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), "pyarrow is not installed")
+    def test_parquet_export(self):
+        import pyarrow.parquet
+
+        path = self.export('history.parquet', '--chunk-size', '3')
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        self.assertEqual(parquet_file.metadata.num_row_groups, 2)
+        table = parquet_file.read()
+        self.assertEqual(table.num_rows, 4)
+        self.assertEqual(sum(table.column('participant_count').to_pylist()), 20)
+
+
+@override_settings(WAGTAIL_EXPERIMENTS_FEED_LAG=0)
+class TestHistoryFeed(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+        self.homepage = Page.objects.get(url_path='/home/')
+        self.homepage_alternative_1 = Page.objects.get(url_path='/home/home-alternative-1/')
+        self.today = datetime.date.today()
+        self.yesterday = self.today - datetime.timedelta(days=1)
+        self.other_experiment = Experiment.objects.create(
+            name='Other', slug='other', control_page=self.homepage, status='live'
+        )
+
+        increment_history_counts([
+            (self.experiment.pk, self.homepage.pk, self.yesterday, 10, 2),
+            (self.experiment.pk, self.homepage.pk, self.today, 5, 1),
+            (self.experiment.pk, self.homepage_alternative_1.pk, self.today, 4, 3),
+            (self.other_experiment.pk, self.homepage.pk, self.today, 1, 0),
+        ])
+
+        admin, _ = User.objects.get_or_create(username='admin', defaults={'is_superuser': True, 'is_staff': True})
+        self.client.force_login(admin)
+
+    def get_feed(self, **params):
+        headers = {}
+        if 'if_none_match' in params:
+            headers['HTTP_IF_NONE_MATCH'] = params.pop('if_none_match')
+        return self.client.get(reverse('experiments:history_feed'), params, **headers)
+
+    def get_changes(self, response):
+        return [
+            (change['experiment_id'], change['variation_id'], change['date'], change['participant_count'])
+            for change in response.json()['results']
+        ]
+
+    def test_page_through_changes(self):
+        response = self.get_feed(limit=3)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['more'])
+        self.assertEqual(len(response.json()['results']), 3)
+
+        response = self.get_feed(limit=3, cursor=response.json()['next_cursor'])
+        self.assertFalse(response.json()['more'])
+        self.assertEqual(len(response.json()['results']), 1)
+
+        # nothing has changed since the last page
+        cursor = response.json()['next_cursor']
+        response = self.get_feed(cursor=cursor)
+        self.assertEqual(response.json(), {'results': [], 'next_cursor': cursor, 'more': False})
+
+        # only the changed day is reported, with the counts of all its shards
+        increment_history_counts([(self.experiment.pk, self.homepage.pk, self.today, 2, 2)], shard=1)
+        response = self.get_feed(cursor=cursor)
+        self.assertEqual(
+            self.get_changes(response), [(self.experiment.pk, self.homepage.pk, self.today.isoformat(), 7)]
+        )
+        self.assertEqual(response.json()['results'][0]['completion_count'], 3)
+
+    def test_filter_by_experiment_as_ndjson(self):
+        response = self.get_feed(experiment='other', format='ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        changes = [json.loads(line) for line in response.content.decode('utf-8').splitlines()]
+        self.assertEqual(
+            [(change['experiment_id'], change['participant_count']) for change in changes],
+            [(self.other_experiment.pk, 1)]
+        )
+        self.assertEqual(response['X-More'], 'false')
+
+        response = self.get_feed(experiment='other', cursor=response['X-Next-Cursor'], format='ndjson')
+        self.assertEqual(response.content, b'')
+
+    def test_not_modified(self):
+        response = self.get_feed()
+        etag = response['ETag']
+
+        # only the ETag is checked, with a single query on the history
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_feed(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(
+            len([query for query in queries.captured_queries if 'experiments_experimenthistory' in query['sql']]), 1
+        )
+
+        increment_history_counts([(self.experiment.pk, self.homepage.pk, self.today, 1, 0)])
+        response = self.get_feed(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(WAGTAIL_EXPERIMENTS_FEED_LAG=60)
+    def test_recent_changes_are_held_back(self):
+        response = self.get_feed()
+        self.assertEqual(response.json(), {'results': [], 'next_cursor': '', 'more': False})
+
+        ExperimentHistory.objects.update(last_modified=timezone.now() - datetime.timedelta(minutes=5))
+        self.assertEqual(len(self.get_feed().json()['results']), 4)
+
+    def test_rejects_invalid_parameters(self):
+        self.assertEqual(self.get_feed(cursor='not a cursor').status_code, 400)
+        self.assertEqual(self.get_feed(limit=0).status_code, 400)
+        self.assertEqual(self.get_feed(limit='all').status_code, 400)
+        self.assertEqual(self.get_feed(format='xml').status_code, 400)
+
+
+class TestDataCommand(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+        self.homepage = Page.objects.get(url_path='/home/')
+        self.other_experiment = Experiment.objects.create(
+            name='Other', slug='other', control_page=self.homepage, status='live'
+        )
+
+    def generate(self, *args):
+        call_command('experiment-data', *args, stdout=open(os.devnull, 'w'))
+        return sorted(ExperimentHistory.objects.values_list(
+            'experiment_id', 'variation_id', 'date', 'participant_count', 'completion_count'
+        ))
+
+    def test_generate_for_all_experiments(self):
+        history = self.generate('--all', '--days', '4', '--seed', '1')
+
+        variation_count = len(self.experiment.get_variation_ids())
+        self.assertEqual(len(history), (variation_count + 1) * 4)
+        for experiment_id, variation_id, date, participant_count, completion_count in history:
+            self.assertTrue(100 <= participant_count <= 150)
+            self.assertTrue(0 <= completion_count <= participant_count)
+
+        # totals are kept in step with the history
+        totals = ExperimentVariationTotal.objects.filter(experiment=self.experiment).aggregate(
+            participant_count=Sum('participant_count')
+        )
+        self.assertEqual(
+            totals['participant_count'],
+            sum(row[3] for row in history if row[0] == self.experiment.pk)
+        )
+
+        # the same seed gives the same data
+        self.generate('--all', '--purge')
+        self.assertEqual(self.generate('--all', '--days', '4', '--seed', '1'), history)
+
+    def test_queries_do_not_depend_on_views(self):
+        with CaptureQueriesContext(connection) as few_views:
+            self.generate('other', '--days', '3', '--min', '1', '--max', '1')
+        with CaptureQueriesContext(connection) as many_views:
+            self.generate('other', '--days', '3', '--min', '5000', '--max', '5000')
+        self.assertEqual(len(many_views), len(few_views))
+
+    def test_conversion_rates(self):
+        history = self.generate('homepage-text', '--days', '2', '--rates', '0,1', '--min', '10', '--max', '20')
+        control_id = self.experiment.control_page_id
+        for experiment_id, variation_id, date, participant_count, completion_count in history:
+            self.assertEqual(completion_count, 0 if variation_id == control_id else participant_count)
+
+        with self.assertRaises(CommandError):
+            self.generate('homepage-text', '--rates', '0.5,2')
+        with self.assertRaises(CommandError):
+            self.generate()
+
+
+class TestBenchmarks(TestCase):
+
+    def test_run_benchmarks(self):
+        results = benchmarks.run_benchmarks('quick', ['non_experiment_page', 'report'])
+
+        self.assertEqual([result['name'] for result in results], ['serve_non_experiment_page', 'get_report'])
+        non_experiment_page, report = results
+        self.assertEqual(non_experiment_page['queries'], 0)
+        self.assertEqual(report['params'], {'days': 10, 'shards': 2})
+        self.assertEqual(report['iterations'], 3)
+        self.assertTrue(0 < report['min_ms'] <= report['median_ms'] <= report['p95_ms'])
+        json.dumps(results)
+
+        # the data is rolled back
+        self.assertFalse(Experiment.objects.exists())
+
+    def test_compare_results(self):
+        baseline = [
+            {'name': 'get_report', 'params': {'days': 10}, 'cold_queries': 3, 'queries': 3, 'median_ms': 2.0},
+            {'name': 'get_report', 'params': {'days': 30}, 'cold_queries': 3, 'queries': 3, 'median_ms': 4.0},
+        ]
+        results = [
+            {'name': 'get_report', 'params': {'days': 10}, 'cold_queries': 3, 'queries': 4, 'median_ms': 2.5},
+            {'name': 'get_report', 'params': {'days': 30}, 'cold_queries': 3, 'queries': 3, 'median_ms': 8.0},
+            {'name': 'get_report', 'params': {'days': 365}, 'cold_queries': 9, 'queries': 9, 'median_ms': 80.0},
+        ]
+
+        self.assertEqual(benchmarks.compare_results(baseline, results), [
+            "get_report {'days': 10}: queries went from 3 to 4",
+            "get_report {'days': 30}: median went from 4.00ms to 8.00ms",
+        ])
+
+
+class TestTiming(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        registry.clear()
+        variation_cache.clear()
+        self.homepage = Page.objects.get(url_path='/home/')
+
+        session = self.client.session
+        session['experiment_user_id'] = '33333333-3333-3333-3333-333333333333'
+        session.save()
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(timing.get_sink())
+        self.assertIs(timing.span('experiment_lookup', RequestFactory().get('/')), timing.NULL_SPAN)
+
+        response = self.client.get('/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(WAGTAIL_EXPERIMENTS_TIMING_SINK='experiments.timing.AggregatingSink')
+    def test_aggregating_sink(self):
+        self.client.get('/')
+        self.client.get('/signup-complete/')
+
+        summary = timing.get_sink().summary()
+        self.assertEqual(set(summary), {
+            'experiment_lookup', 'choose_variation', 'load_variation', 'record_participant',
+            'specific', 'serve_variation', 'record_completions',
+        })
+        self.assertEqual(summary['experiment_lookup']['count'], 2)
+        self.assertEqual(summary['record_participant']['count'], 1)
+        self.assertTrue(0 <= summary['experiment_lookup']['p50'] <= summary['experiment_lookup']['max'])
+
+        timing.get_sink().reset()
+        self.assertEqual(timing.get_sink().summary(), {})
+
+    def test_percentiles(self):
+        sink = timing.AggregatingSink()
+        self.assertIsNone(sink.percentile('lookup', 50))
+        for duration in range(1, 101):
+            sink.record('lookup', duration / 1000, None)
+
+        self.assertEqual(sink.percentile('lookup', 50), 0.051)
+        self.assertEqual(sink.percentile('lookup', 99), 0.1)
+        self.assertEqual(sink.summary()['lookup']['count'], 100)
+
+    @override_settings(WAGTAIL_EXPERIMENTS_TIMING_SINK='experiments.timing.LoggingSink')
+    def test_logging_sink(self):
+        with self.assertLogs('experiments.timing', level='DEBUG') as logs:
+            self.client.get('/')
+        self.assertTrue(any('record_participant took' in line for line in logs.output))
+
+    @override_settings(WAGTAIL_EXPERIMENTS_TIMING_SINK='experiments.timing.SignalSink')
+    def test_signal_sink(self):
+        spans = []
+
+        def receiver(name, duration, request, **kwargs):
+            spans.append((name, request.path))
+
+        timing.span_finished.connect(receiver)
+        self.addCleanup(timing.span_finished.disconnect, receiver)
+        self.client.get('/')
+
+        self.assertIn(('serve_variation', '/'), spans)
+
+    @override_settings(
+        MIDDLEWARE=settings.MIDDLEWARE + ['experiments.middleware.ServerTimingMiddleware'],
+        WAGTAIL_EXPERIMENTS_SERVER_TIMING=True,
+    )
+    def test_server_timing_header(self):
+        response = self.client.get('/')
+        metrics = [metric.split(';')[0] for metric in response['Server-Timing'].split(', ')]
+        self.assertEqual(metrics, [
+            'experiment_lookup', 'choose_variation', 'load_variation', 'record_participant',
+            'specific', 'serve_variation',
+        ])
+
+        with override_settings(WAGTAIL_EXPERIMENTS_SERVER_TIMING=False):
+            response = self.client.get('/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class TestQueryPlans(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest("query plans are only checked on SQLite and PostgreSQL")
+        if connection.vendor == 'postgresql':
+            # the test tables are too small for the planner to choose an index otherwise
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+        get_cache().clear()
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+
+    def get_plan(self, sql):
+        explain = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(explain + sql)
+            return '\n'.join(str(row) for row in cursor.fetchall())
+
+    def assertUsesIndex(self, queryset_or_sql, index_name):
+        if isinstance(queryset_or_sql, str):
+            plan = self.get_plan(queryset_or_sql)
+        else:
+            plan = queryset_or_sql.explain()
+        self.assertIn(index_name, plan)
+
+    def test_report_query_uses_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            db.get_report(self.experiment)
+
+        history_queries = [query['sql'] for query in queries if 'experimenthistory' in query['sql']]
+        self.assertEqual(len(history_queries), 1)
+        self.assertUsesIndex(history_queries[0], 'experiments_history_report')
+
+
+class TestVariationCache(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        variation_cache.clear()
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+
+        # fill in revision IDs (not in the fixture)
+        for alternative in self.experiment.alternatives.all():
+            alternative.revision = alternative.page.specific.save_revision()
+            alternative.save()
+
+    def test_revisions_are_deserialized_once(self):
+        with mock.patch('wagtail.models.Revision.as_object', autospec=True,
+                        side_effect=lambda revision: revision.content_object.with_content_json(revision.content)) as as_object:
+            variations = self.experiment.get_variations()
+            self.assertEqual(as_object.call_count, 2)
+
+            # only the alternatives are queried
+            with self.assertNumQueries(1):
+                cached_variations = self.experiment.get_variations()
+            self.assertEqual(as_object.call_count, 2)
+
+        self.assertEqual([v.pk for v in variations], [v.pk for v in cached_variations])
+        self.assertEqual(cached_variations[1].body, "Welcome to our site! It's lovely to meet you.")
+
+        # callers get their own copy, which they may modify
+        cached_variations[1].title = "Home"
+        self.assertEqual(self.experiment.get_variations()[1].title, "Homepage alternative 1")
+
+    def test_cache_is_invalidated_when_activating_draft_content(self):
+        alternative_1 = self.experiment.alternatives.first().page.specific
+        alternative_1.body = "updated"
+        alternative_1.save_revision()
+
+        self.assertNotEqual(self.experiment.get_variations()[1].body, "updated")
+        self.experiment.activate_alternative_draft_content()
+        self.assertEqual(self.experiment.get_variations()[1].body, "updated")
+
+    @override_settings(WAGTAIL_EXPERIMENTS_VARIATION_CACHE_SIZE=0, WAGTAIL_EXPERIMENTS_VARIATION_CACHE_TIMEOUT=60)
+    def test_shared_cache(self):
+        self.experiment.get_variations()
+
+        with mock.patch('wagtail.models.Revision.as_object') as as_object:
+            variations = self.experiment.get_variations()
+        as_object.assert_not_called()
+        self.assertEqual(variations[2].body, "Oh, it's you. What do you want?")
+
+        self.experiment.invalidate_variations()
+        with mock.patch('wagtail.models.Revision.as_object', autospec=True,
+                        side_effect=lambda revision: revision.content_object.with_content_json(revision.content)) as as_object:
+            self.experiment.get_variations()
+        self.assertEqual(as_object.call_count, 2)
+
+
+class TestVariationAssignment(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        variation_cache.clear()
+        self.experiment = Experiment.objects.select_related('control_page').get(slug='homepage-text')
+        self.homepage = Page.objects.get(url_path='/home/')
+        self.homepage_alternative_1 = Page.objects.get(url_path='/home/home-alternative-1/')
+
+    def test_assignment_matches_full_variation_list(self):
+        variations = self.experiment.get_variations()
+        for user_id in range(0, 30):
+            references = self.experiment.get_variation_references()
+            reference = self.experiment.get_variation_reference_for_user(user_id)
+            self.assertEqual(
+                self.experiment.get_variation(reference).pk,
+                variations[references.index(reference)].pk
+            )
+
+    def test_only_the_chosen_variation_is_loaded(self):
+        # the control page is already loaded, so only the alternatives are queried
+        with self.assertNumQueries(1):
+            variation = self.experiment.get_variation_for_user('11111111-1111-1111-1111-111111111111')
+        self.assertEqual(variation.pk, self.homepage.pk)
+
+        # alternatives query plus the alternative page itself
+        with self.assertNumQueries(2):
+            variation = self.experiment.get_variation_for_user('33333333-3333-3333-3333-333333333333')
+        self.assertEqual(variation.pk, self.homepage_alternative_1.pk)
+
+    def test_draft_alternative_is_served_from_revision(self):
+        alternative = self.experiment.alternatives.get(page=self.homepage_alternative_1)
+        alternative.revision = self.homepage_alternative_1.specific.save_revision()
+        alternative.save()
+
+        reference = self.experiment.get_variation_reference_for_user('33333333-3333-3333-3333-333333333333')
+        self.assertEqual(reference.revision_id, alternative.revision_id)
+        variation = self.experiment.get_variation(reference)
+        self.assertEqual(variation.body, "Welcome to our site! It's lovely to meet you.")
+
+
+class TestRememberedVariation(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        registry.clear()
+        self.experiment = Experiment.objects.select_related('control_page').get(slug='homepage-text')
+        self.homepage_alternative_1 = Page.objects.get(url_path='/home/home-alternative-1/')
+
+    def test_assigned_variation_is_reused_for_completion(self):
+        user_id = '33333333-3333-3333-3333-333333333333'
+        request = RequestFactory().get('/')
+        request.session = {}
+
+        self.experiment.start_experiment_for_user(user_id, request)
+        self.assertEqual(
+            request.session['experiment_variations'], {str(self.experiment.pk): self.homepage_alternative_1.pk}
+        )
+
+        # recording the completion only checks that the variation still belongs to the
+        # experiment, and writes the history record
+        with self.assertNumQueries(1 + HISTORY_WRITE_QUERIES):
+            self.experiment.record_completion_for_user(user_id, request)
+
+        history_record = ExperimentHistory.objects.get(
+            experiment=self.experiment, variation=self.homepage_alternative_1
+        )
+        self.assertEqual(history_record.participant_count, 1)
+        self.assertEqual(history_record.completion_count, 1)
+
+    def test_completion_uses_the_variation_the_user_saw(self):
+        session = self.client.session
+        session['experiment_user_id'] = '33333333-3333-3333-3333-333333333333'
+        session.save()
+        self.client.get('/')
+
+        # reordering the alternatives would change the variation chosen by the hash
+        alternative_1, alternative_2 = self.experiment.alternatives.order_by('sort_order')
+        alternative_1.sort_order, alternative_2.sort_order = alternative_2.sort_order, alternative_1.sort_order
+        alternative_1.save()
+        alternative_2.save()
+
+        self.client.get('/signup-complete/')
+        history_record = ExperimentHistory.objects.get(
+            experiment=self.experiment, variation=self.homepage_alternative_1
+        )
+        self.assertEqual(history_record.completion_count, 1)
+
+    def test_variation_no_longer_in_the_experiment_is_not_credited(self):
+        request = RequestFactory().get('/')
+        request.session = {'experiment_variations': {str(self.experiment.pk): 999}}
+
+        # a deleted page, or one removed from the experiment, falls back to the hashed variation
+        user_id = '33333333-3333-3333-3333-333333333333'
+        self.assertEqual(self.experiment.get_assigned_variation(user_id, request).pk, self.homepage_alternative_1.pk)
+
+        self.experiment.alternatives.filter(page=self.homepage_alternative_1).delete()
+        request.session = {'experiment_variations': {str(self.experiment.pk): self.homepage_alternative_1.pk}}
+        self.assertIn(
+            self.experiment.get_assigned_variation(user_id, request).pk, self.experiment.get_variation_ids()
+        )
+
+
+class TestBatchedCompletions(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        registry.clear()
+        self.homepage = Page.objects.get(url_path='/home/')
+        self.goal_page = Page.objects.get(url_path='/home/signup-complete/')
+        self.experiments = [Experiment.objects.get(slug='homepage-text')]
+        for index in range(1, 4):
+            self.experiments.append(Experiment.objects.create(
+                name="Experiment %d" % index, slug='experiment-%d' % index,
+                control_page=self.homepage, goal=self.goal_page, status='live',
+            ))
+
+        self.user_id = '11111111-1111-1111-1111-111111111111'
+        self.request = RequestFactory().get('/')
+        self.request.session = {}
+        # the user takes part in all experiments but the last
+        for experiment in self.experiments[:-1]:
+            experiment.start_experiment_for_user(self.user_id, self.request)
+
+    def test_completions_are_written_in_one_statement(self):
+        # the variations of all the experiments are checked in one query, however many there are
+        with self.assertNumQueries(1 + HISTORY_WRITE_QUERIES):
+            record_completions_for_user(self.experiments, self.user_id, self.request)
+
+        for experiment in self.experiments[:-1]:
+            history_record = ExperimentHistory.objects.get(experiment=experiment)
+            self.assertEqual(history_record.participant_count, 1)
+            self.assertEqual(history_record.completion_count, 1)
+        self.assertFalse(ExperimentHistory.objects.filter(experiment=self.experiments[-1]).exists())
+
+        # repeated completions are not counted
+        with self.assertNumQueries(0):
+            record_completions_for_user(self.experiments, self.user_id, self.request)
+
+    def test_variation_ids_for_experiments(self):
+        with self.assertNumQueries(1):
+            variation_ids = get_variation_ids_for_experiments(self.experiments)
+        self.assertEqual(variation_ids, {
+            experiment.pk: experiment.get_variation_ids() for experiment in self.experiments
+        })
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_variation_ids_for_experiments([]), {})
+
+    def test_hashed_variation_matches_the_variation_served(self):
+        request = RequestFactory().get('/')
+        request.session = {}
+        experiment = self.experiments[0]
+        for user_id in ('11111111-1111-1111-1111-111111111111', '33333333-3333-3333-3333-333333333333'):
+            self.assertEqual(
+                experiment.get_assigned_variation(user_id, request, experiment.get_variation_ids()).pk,
+                experiment.get_variation_for_user(user_id).pk,
+            )
+
+    def test_goal_page_shared_by_experiments(self):
+        session = self.client.session
+        session['experiment_user_id'] = self.user_id
+        session.save()
+        self.client.get('/')
+        self.client.get('/signup-complete/')
+
+        # only the first experiment on the control page runs, so only it is completed
+        self.assertEqual(
+            list(ExperimentHistory.objects.filter(completion_count=1).values_list('experiment', flat=True)),
+            [self.experiments[0].pk]
+        )
+
+    def test_backend_without_batch_support(self):
+        backend = mock.Mock(spec=['record_participant', 'record_completion', 'get_report'])
+        with mock.patch('experiments.models.BACKEND', backend):
+            record_completions_for_user(self.experiments, self.user_id, self.request)
+        self.assertEqual(backend.record_completion.call_count, 4)
+
+
+@override_settings(
+    WAGTAIL_EXPERIMENTS_PARTICIPANT_STATE='experiments.state.SignedCookieParticipantState',
+    MIDDLEWARE=settings.MIDDLEWARE + ['experiments.middleware.ParticipantStateMiddleware'],
+)
+class TestSignedCookieParticipantState(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        registry.clear()
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+        self.homepage = Page.objects.get(url_path='/home/')
+
+    def set_user_id(self, user_id):
+        self.client.cookies['wagtail_experiments'] = signing.dumps(
+            {'u': user_id}, salt=SignedCookieParticipantState.salt, compress=True
+        )
+
+    def get_cookie_data(self):
+        return signing.loads(
+            self.client.cookies['wagtail_experiments'].value, salt=SignedCookieParticipantState.salt
+        )
+
+    def test_state_is_kept_in_cookie(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertIn('wagtail_experiments', response.cookies)
+
+        data = self.get_cookie_data()
+        self.assertIn('u', data)
+        self.assertEqual(data['s'], [self.experiment.pk])
+
+    def test_participant_and_completion_are_logged(self):
+        self.set_user_id('11111111-1111-1111-1111-111111111111')
+        self.client.get('/')
+        self.client.get('/signup-complete/')
+
+        # repeated visits are not counted again
+        self.client.get('/')
+        self.client.get('/signup-complete/')
+
+        history_record = ExperimentHistory.objects.get(experiment=self.experiment, variation=self.homepage)
+        self.assertEqual(history_record.participant_count, 1)
+        self.assertEqual(history_record.completion_count, 1)
+        self.assertEqual(self.get_cookie_data()['c'], [self.experiment.pk])
+
+    def test_selected_variation_depends_on_user_id(self):
+        self.set_user_id('33333333-3333-3333-3333-333333333333')
+        response = self.client.get('/')
+        self.assertContains(response, "<p>Welcome to our site! It&#x27;s lovely to meet you.</p>")
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.cookies['wagtail_experiments'] = 'not-a-signed-value'
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(self.get_cookie_data()['u'], 'not-a-signed-value')
+
+    def test_unchanged_state_does_not_set_cookie(self):
+        self.client.get('/')
+        response = self.client.get('/')
+        self.assertNotIn('wagtail_experiments', response.cookies)
+
+    def test_check_passes_with_middleware(self):
+        self.assertEqual(check_participant_state(None), [])
+
+    def test_check_fails_without_middleware(self):
+        with override_settings(MIDDLEWARE=[
+            name for name in settings.MIDDLEWARE if name != 'experiments.middleware.ParticipantStateMiddleware'
+        ]):
+            errors = check_participant_state(None)
+        self.assertEqual([error.id for error in errors], ['experiments.E001'])
+
+        # the session store doesn't need it
+        with override_settings(WAGTAIL_EXPERIMENTS_PARTICIPANT_STATE='experiments.state.SessionParticipantState'):
+            self.assertEqual(check_participant_state(None), [])
+
+
+class TestDeferredWrites(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        registry.clear()
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+        self.homepage = Page.objects.get(url_path='/home/')
+
+    @override_settings(WAGTAIL_EXPERIMENTS_DEFER_WRITES='request_finished')
+    def test_writes_after_request_finished(self):
+        request = RequestFactory().get('/')
+        request.session = {}
+        self.experiment.start_experiment_for_user('11111111-1111-1111-1111-111111111111', request)
+        self.assertFalse(ExperimentHistory.objects.filter(experiment=self.experiment).exists())
+
+        request_finished.send(sender=self.__class__)
+        history_record = ExperimentHistory.objects.get(experiment=self.experiment, variation=self.homepage)
+        self.assertEqual(history_record.participant_count, 1)
+
+        # through the test client, which sends request_finished when the response is closed
+        session = self.client.session
+        session['experiment_user_id'] = '22222222-2222-2222-2222-222222222222'
+        session.save()
+        self.client.get('/')
+        history_record.refresh_from_db()
+        self.assertEqual(history_record.participant_count, 2)
+
+    @override_settings(WAGTAIL_EXPERIMENTS_DEFER_WRITES='thread', WAGTAIL_EXPERIMENTS_DEFER_WORKERS=2)
+    def test_thread_pool(self):
+        writer = DeferredWriter()
+        results = []
+        writer.submit(results.append, 1)
+        writer.submit(results.append, 2)
+        writer.drain()
+        self.assertEqual(sorted(results), [1, 2])
+
+        with self.assertLogs('experiments.deferred', 'ERROR'):
+            writer.submit(mock.Mock(side_effect=RuntimeError))
+            writer.shutdown()
+        self.assertEqual(writer.get_stats(), {'submitted': 3, 'completed': 2, 'failed': 1, 'dropped': 0})
+
+    @override_settings(
+        WAGTAIL_EXPERIMENTS_DEFER_WRITES='thread', WAGTAIL_EXPERIMENTS_DEFER_WORKERS=1,
+        WAGTAIL_EXPERIMENTS_DEFER_QUEUE_SIZE=1,
+    )
+    def test_full_queue_drops_writes(self):
+        writer = DeferredWriter()
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocking_write():
+            started.set()
+            release.wait(5)
+
+        writer.submit(blocking_write)
+        started.wait(5)
+        # the worker is busy, so one write fits in the queue and the next is dropped
+        writer.submit(lambda: None)
+        with self.assertLogs('experiments.deferred', 'WARNING'):
+            writer.submit(lambda: None)
+        release.set()
+        writer.shutdown()
+
+        self.assertEqual(writer.get_stats(), {'submitted': 3, 'completed': 2, 'failed': 0, 'dropped': 1})
+
+
+class TestEventLogBackend(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        registry.clear()
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+        self.homepage = Page.objects.get(url_path='/home/')
+        self.homepage_alternative_1 = Page.objects.get(url_path='/home/home-alternative-1/')
+
+        self.log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir)
+        settings_override = override_settings(WAGTAIL_EXPERIMENTS_EVENT_LOG_DIR=self.log_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        backend_patcher = mock.patch('experiments.models.BACKEND', eventlog)
+        backend_patcher.start()
+        self.addCleanup(backend_patcher.stop)
+        self.addCleanup(eventlog.writer.seal)
+
+    def visit(self, user_id, *urls):
+        client = Client()
+        session = client.session
+        session['experiment_user_id'] = user_id
+        session.save()
+        for url in urls:
+            client.get(url)
+
+    def compact(self, *args):
+        call_command('experiment-compact-log', *args, stdout=open(os.devnull, 'w'))
+
+    def test_events_are_compacted_into_history(self):
+        self.visit('11111111-1111-1111-1111-111111111111', '/', '/signup-complete/')
+        self.visit('33333333-3333-3333-3333-333333333333', '/')
+
+        # nothing reaches the database until the log is compacted
+        self.assertFalse(ExperimentHistory.objects.exists())
+
+        # segments in use are not compacted
+        self.compact()
+        self.assertFalse(ExperimentHistory.objects.exists())
+
+        eventlog.writer.seal()
+        self.compact()
+
+        history_record = ExperimentHistory.objects.get(experiment=self.experiment, variation=self.homepage)
+        self.assertEqual(history_record.participant_count, 1)
+        self.assertEqual(history_record.completion_count, 1)
+        history_record = ExperimentHistory.objects.get(
+            experiment=self.experiment, variation=self.homepage_alternative_1
+        )
+        self.assertEqual(history_record.participant_count, 1)
+        self.assertEqual(history_record.completion_count, 0)
+
+        # compacted segments are archived with their raw events
+        archived = os.listdir(os.path.join(self.log_dir, 'archive'))
+        self.assertEqual(len(archived), 1)
+        events = eventlog.read_segment(os.path.join(self.log_dir, 'archive', archived[0]))
+        self.assertEqual(
+            [(event[1], event[3]) for event in events],
+            [
+                (self.homepage.pk, eventlog.PARTICIPANT),
+                (self.homepage.pk, eventlog.COMPLETION),
+                (self.homepage_alternative_1.pk, eventlog.PARTICIPANT),
+            ]
+        )
+
+        # compacting again does not count the events twice
+        self.compact()
+        history_record = ExperimentHistory.objects.get(experiment=self.experiment, variation=self.homepage)
+        self.assertEqual(history_record.participant_count, 1)
+
+    def test_events_for_deleted_experiments_are_skipped(self):
+        self.visit('11111111-1111-1111-1111-111111111111', '/', '/signup-complete/')
+        eventlog.writer.seal()
+        self.experiment.delete()
+
+        stdout = io.StringIO()
+        call_command('experiment-compact-log', stdout=stdout)
+        self.assertIn('Skipped 2 events for deleted experiments or pages.', stdout.getvalue())
+        self.assertFalse(ExperimentHistory.objects.exists())
+
+    @override_settings(WAGTAIL_EXPERIMENTS_EVENT_LOG_SEGMENT_SIZE=2)
+    def test_segments_rotate_when_full(self):
+        for index in range(0, 5):
+            self.visit('user-%d' % index, '/')
+        eventlog.writer.seal()
+
+        self.assertEqual(len(os.listdir(self.log_dir)), 3)
+        self.compact('--delete')
+        self.assertEqual(os.listdir(self.log_dir), [])
+        self.assertEqual(
+            sum(ExperimentHistory.objects.values_list('participant_count', flat=True)), 5
+        )
+
+    def test_orphaned_segments_are_sealed(self):
+        self.visit('11111111-1111-1111-1111-111111111111', '/')
+
+        # copy the active segment, as if it had been left behind by a process that has exited
+        active_filename = os.listdir(self.log_dir)[0]
+        host, pid, suffix = active_filename.rsplit('-', 2)
+        shutil.copy(
+            os.path.join(self.log_dir, active_filename),
+            os.path.join(self.log_dir, '-'.join([host, '999999', suffix]))
+        )
+
+        def kill(pid, signal):
+            if pid == 999999:
+                raise ProcessLookupError
+
+        with mock.patch('os.kill', side_effect=kill):
+            self.compact('--seal-orphaned')
+
+        # only the orphaned segment is compacted
+        history_record = ExperimentHistory.objects.get(experiment=self.experiment, variation=self.homepage)
+        self.assertEqual(history_record.participant_count, 1)
+        self.assertEqual(sorted(os.listdir(self.log_dir)), sorted(['archive', active_filename]))
+
+
+
+class TestEventTableBackend(TestCase):
+    fixtures = ['test.json']
+
+    def setUp(self):
+        registry.clear()
+        self.experiment = Experiment.objects.get(slug='homepage-text')
+        self.homepage = Page.objects.get(url_path='/home/')
+        self.homepage_alternative_1 = Page.objects.get(url_path='/home/home-alternative-1/')
+
+        backend_patcher = mock.patch('experiments.models.BACKEND', events)
+        backend_patcher.start()
+        self.addCleanup(backend_patcher.stop)
+
+    def visit(self, user_id, *urls):
+        client = Client()
+        session = client.session
+        session['experiment_user_id'] = user_id
+        session.save()
+        for url in urls:
+            client.get(url)
+
+    def roll_up(self, *args):
+        call_command('experiment-rollup', *args, stdout=open(os.devnull, 'w'))
+
+    def test_events_are_rolled_up_into_history(self):
+        self.visit('11111111-1111-1111-1111-111111111111', '/', '/signup-complete/')
+        self.visit('33333333-3333-3333-3333-333333333333', '/')
+
+        self.assertEqual(
+            list(ExperimentEvent.objects.order_by('pk').values_list('variation_id', 'kind')),
+            [
+                (self.homepage.pk, 'participant'),
+                (self.homepage.pk, 'completion'),
+                (self.homepage_alternative_1.pk, 'participant'),
+            ]
+        )
+        self.assertFalse(ExperimentHistory.objects.exists())
+
+        # recent events are left for the next rollup
+        self.roll_up()
+        self.assertFalse(ExperimentHistory.objects.exists())
+
+        self.roll_up('--lag', '0')
+        history_record = ExperimentHistory.objects.get(experiment=self.experiment, variation=self.homepage)
+        self.assertEqual(history_record.participant_count, 1)
+        self.assertEqual(history_record.completion_count, 1)
+        history_record = ExperimentHistory.objects.get(
+            experiment=self.experiment, variation=self.homepage_alternative_1
+        )
+        self.assertEqual(history_record.participant_count, 1)
+        self.assertEqual(history_record.completion_count, 0)
+
+        # only events recorded since the last rollup are added
+        self.visit('44444444-4444-4444-4444-444444444444', '/')
+        self.assertEqual(events.roll_up_events(lag=0), 1)
+        self.assertEqual(events.roll_up_events(lag=0), 0)
+        self.assertEqual(
+            sum(ExperimentHistory.objects.values_list('participant_count', flat=True)), 3
+        )
+
+    def test_history_is_rebuilt_from_events(self):
+        self.visit('11111111-1111-1111-1111-111111111111', '/', '/signup-complete/')
+        self.roll_up('--lag', '0')
+
+        ExperimentHistory.objects.filter(experiment=self.experiment).update(participant_count=100)
+        self.roll_up('--rebuild', 'homepage-text')
+
+        history_record = ExperimentHistory.objects.get(experiment=self.experiment, variation=self.homepage)
+        self.assertEqual(history_record.participant_count, 1)
+        self.assertEqual(history_record.completion_count, 1)